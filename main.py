@@ -1,29 +1,232 @@
 #!/usr/bin/env python
 
-from scraper.scrape import Scrape
-from scraper.transform import Transform
-from scraper.visualize import Visualize
+from scraper.pipeline import Pipeline
+from scraper.instrument import INSTRUMENT
+from concurrent.futures import ThreadPoolExecutor
 import argparse
+import datetime
+import json
+import signal
+import threading
 import pandas as pd
 import os
 
 
+# Method of Execute that runs each command. The modules of a command are
+# imported inside these methods, only when the command runs, so a transform
+# or visualize job doesn't load selenium, tweepy, nltk, or sklearn.
+COMMANDS = {
+    'scrape': 'scrape',
+    'transform': 'transform',
+    'visualize': 'visualize',
+    'refresh': 'refresh',
+    'all': 'execute_all',
+}
+
+
+# Modules of the package imported by each command. Keep it in sync with
+# the imports inside the methods of Execute that the command runs, which
+# tests/test_imports.py checks. The startup benchmark imports them to
+# measure the start of each command.
+COMMAND_MODULES = {
+    'scrape': ['scraper.fake_backend', 'scraper.scrape'],
+    'transform': ['scraper.transform'],
+    'visualize': ['scraper.dashboard', 'scraper.visualize'],
+    'refresh': ['scraper.api', 'scraper.dashboard', 'scraper.fake_backend',
+                'scraper.refresh', 'scraper.visualize'],
+    'all': ['scraper.dashboard', 'scraper.fake_backend', 'scraper.scrape',
+            'scraper.transform', 'scraper.visualize'],
+}
+
+
+def parse_args():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("command", nargs='?', default='all',
+                    choices=list(COMMANDS),
+                    help='Stage to run. Runs every stage by default.')
+    ap.add_argument("-keyword", required=False, default=None)
+    ap.add_argument("-start", required=False, default=None)
+    ap.add_argument("-end", required=False, default=None)
+    ap.add_argument("-keyword_type", required=False, default=None)
+    ap.add_argument("-keys_path", required=False, default=None)
+    ap.add_argument("--delay", required=False, default='1')
+    ap.add_argument("--chromedriver_path", required=False,
+                    default='/usr/local/bin/chromedriver')
+    ap.add_argument("--global_index", required=False, action='store_true')
+    ap.add_argument("--workers", required=False, default='4')
+    ap.add_argument("--force", required=False, action='store_true')
+    ap.add_argument("--trace_memory", required=False, action='store_true')
+    ap.add_argument("--prometheus_path", required=False, default=None)
+    ap.add_argument("--base_url", required=False,
+                    default='https://twitter.com')
+    ap.add_argument("--fake_api", required=False, nargs='?', const='{}',
+                    default=None)
+    ap.add_argument("--dashboard_only", required=False,
+                    action='store_true')
+    ap.add_argument("--manifest", required=False, default=None,
+                    help='CSV or JSON file with the columns keyword, '
+                         'keyword_type, start, and end, to process many '
+                         'keywords in one process')
+    ap.add_argument("--max_keywords", required=False, default='4')
+    ap.add_argument("--max_drivers", required=False, default='2')
+    ap.add_argument("--hydration_cache_size", required=False,
+                    default='50000')
+    ap.add_argument("--engine", required=False, default='selenium',
+                    choices=['selenium', 'async_browser', 'async_http'])
+    ap.add_argument("--max_concurrency", required=False, default='8')
+    ap.add_argument("--max_empty_scrolls", required=False, default='1')
+    ap.add_argument("--max_scrolls", required=False, default=None)
+    ap.add_argument("--day_time_budget", required=False, default=None)
+    ap.add_argument("--split_scrolls", required=False, default=None)
+    ap.add_argument("--split_rate", required=False, default=None)
+    ap.add_argument("--window_workers", required=False, default='1')
+    ap.add_argument("--worker", required=False, action='store_true',
+                    help='Run jobs from the queue in data/.queue until '
+                         'stopped')
+    ap.add_argument("--submit", required=False, action='store_true',
+                    help='Add the command to the queue of the worker '
+                         'instead of running it')
+    ap.add_argument("--job_status", required=False, nargs='?', const='all',
+                    default=None,
+                    help='Print the status of a job, or of every job')
+    ap.add_argument("--compare", required=False, nargs='+', default=None,
+                    help='Keywords with clean data to compare, e.g. '
+                         '--compare keyword1 keyword2')
+    ap.add_argument("--refresh_budget", required=False, default='10',
+                    help='API calls per refresh, of 100 tweets each')
+    ap.add_argument("--half_life", required=False, default='3',
+                    help='Days after which the refresh priority of a tweet '
+                         'is halved')
+    ap.add_argument("--top_k", required=False, default='1000',
+                    help='Tweets kept in each ranking. Use 0 to keep every '
+                         'tweet.')
+    args = vars(ap.parse_args())
+    # The comparison and the job status only read data already saved
+    if args['compare'] is not None or args['job_status'] is not None:
+        return args
+    # The worker gets the keywords from the jobs of the queue
+    if args['worker']:
+        if args['keys_path'] is None and args['fake_api'] is None:
+            ap.error('-keys_path is required unless --fake_api is used')
+        return args
+    # Transform and visualize only read the data already scraped
+    if args['command'] in ['transform', 'visualize']:
+        if args['keyword'] is None and args['manifest'] is None:
+            ap.error(f"-keyword is required by {args['command']} unless "
+                     f"--manifest is used")
+        return args
+    # The refresh only hydrates tweets already scraped
+    if args['command'] == 'refresh' and args['manifest'] is None:
+        if args['keyword'] is None:
+            ap.error('-keyword is required by refresh unless --manifest is '
+                     'used')
+        if args['keys_path'] is None and args['fake_api'] is None \
+                and not args['submit']:
+            ap.error('-keys_path is required unless --fake_api is used')
+        return args
+    # The worker has the API keys
+    if args['keys_path'] is None and args['fake_api'] is None \
+            and not args['submit']:
+        ap.error('-keys_path is required unless --fake_api is used')
+    if args['manifest'] is None and None in [
+            args['keyword'], args['start'], args['end'],
+            args['keyword_type']]:
+        ap.error('-keyword, -start, -end, and -keyword_type are required '
+                 'unless --manifest is used')
+    return args
+
+
+def shared_resources(args):
+    """
+    Creates the resources shared by the keywords of a batch or the jobs of a
+    worker: the API client, a pool of Chrome sessions, and a cache of the
+    most recently hydrated tweets.
+    """
+    from scraper.api import new_api
+    from scraper.scrape import DriverPool
+    from scraper.cache import LRUCache
+    if args['fake_api'] is not None:
+        from scraper.fake_backend import FakeStatusesAPI
+        api = FakeStatusesAPI(**json.loads(args['fake_api']))
+    else:
+        with open(args['keys_path'], 'r') as file:
+            api = new_api(json.load(file))
+    driver_pool = DriverPool(args['chromedriver_path'],
+                             size=args['max_drivers'])
+    hydration_cache = LRUCache(args['hydration_cache_size'])
+    return {'api': api, 'driver_pool': driver_pool,
+            'hydration_cache': hydration_cache}
+
+
 class Execute(object):
-    def __init__(self):
-        ap = argparse.ArgumentParser()
-        ap.add_argument("-keyword", required=True)
-        ap.add_argument("-start", required=True)
-        ap.add_argument("-end", required=True)
-        ap.add_argument("-keyword_type", required=True)
-        ap.add_argument("-keys_path", required=True)
-        ap.add_argument("--delay", required=False, default='1')
-        ap.add_argument("--chromedriver_path", required=False,
-                        default='/usr/local/bin/chromedriver')
-        self.args = vars(ap.parse_args())
-        self.path_raw_data = f"{os.path.expanduser('data')}/" \
-                             f"{self.args['keyword']}/.raw_data/df_raw.csv"
+    def __init__(self, args=None, shared=None):
+        """
+        Runs the scraping, transformation and visualization of one keyword.
+        Args:
+            - args (dict): Command line arguments. If None, they are parsed
+                from sys.argv.
+            - shared (dict): Resources shared by the keywords of a batch:
+                'api', 'driver_pool', and 'hydration_cache'
+        """
+        self.args = args if args is not None else parse_args()
+        self.shared = shared if shared is not None else {}
+        self.path_data = f"{os.path.expanduser('data')}/{self.args['keyword']}"
+        self.path_raw_data = f"{self.path_data}/.raw_data/df_raw.csv"
+
+        # Data frames returned by Transform during this run, keyed by the
+        # folder where they are saved
+        self.results = {}
+
+        # Inputs and outputs of each aggregation and chart, relative to the
+        # keyword folder. The pipeline uses them to order the stages, run
+        # independent stages concurrently, and skip unchanged stages.
+        clean = 'clean_data/df_clean.csv'
+        users = 'users/df_users.csv'
+        self.transform_stages = [
+            ('get_df_clean_data', ['.raw_data/df_raw.csv'],
+             [clean, users, '.raw_data/search.sqlite']),
+            ('get_df_grouped_date', [clean],
+             ['grouped_date/grouped_date.csv']),
+            ('get_df_key_topics', [clean], ['key_topics/key_topics.csv']),
+            ('get_df_most_mentioned_users', [clean],
+             ['most_mentioned_users/most_mentioned_users.csv']),
+            ('get_df_most_mentioned_hashtags', [clean],
+             ['most_mentioned_hashtags/most_mentioned_hashtags.csv']),
+            ('get_df_most_active_users', [clean],
+             ['most_active_users/most_active_users.csv']),
+            ('get_df_most_retweeted_users', [users],
+             ['most_retweeted_users/most_retweeted_users.csv']),
+            ('get_df_users_by_followers', [users],
+             ['users_by_followers/users_by_followers.csv']),
+            ('get_df_interaction_graph', [clean],
+             ['interaction_graph/interaction_graph.csv',
+              'interaction_graph/edges.csv',
+              'interaction_graph/adjacency.npz']),
+            ('get_df_cohashtags_matrix', [clean],
+             ['co_hashtags_matrix/co_hashtags_matrix.csv']),
+            ('get_df_rankings', [clean], ['rankings/rankings.csv']),
+        ]
+        self.visualize_stages = [
+            (f'visualize_{name}', [f'{name}/{name}.csv'],
+             [f'{name}/{name}.html'])
+            for name in ['grouped_date', 'key_topics', 'most_mentioned_users',
+                         'most_mentioned_hashtags', 'most_active_users',
+                         'most_retweeted_users', 'users_by_followers',
+                         'interaction_graph']
+        ]
+        # The time series chart also saves its daily data for the drilldown
+        self.visualize_stages[0][2].append('grouped_date/grouped_date_raw.js')
+
+    def _api(self):
+        # A fake API client configured with a JSON string, e.g.
+        # '{"latency": 0.2, "rate_limit": 180, "error_rate": 0.01}'
+        if self.args['fake_api'] is None:
+            return None
+        from scraper.fake_backend import FakeStatusesAPI
+        return FakeStatusesAPI(**json.loads(self.args['fake_api']))
 
     def scrape(self):
+        from scraper.scrape import Scrape
         scraper = Scrape(
             keyword=self.args['keyword'],
             start=self.args['start'],
@@ -31,51 +234,284 @@ class Execute(object):
             keyword_type=self.args['keyword_type'],
             keys_path=self.args['keys_path'],
             delay=self.args['delay'],
-            chromedriver_path=self.args['chromedriver_path']
+            chromedriver_path=self.args['chromedriver_path'],
+            global_index=self.args['global_index'],
+            base_url=self.args['base_url'],
+            api=self.shared.get('api') or self._api(),
+            driver_pool=self.shared.get('driver_pool'),
+            hydration_cache=self.shared.get('hydration_cache'),
+            engine=self.args['engine'],
+            max_concurrency=self.args['max_concurrency'],
+            max_empty_scrolls=self.args['max_empty_scrolls'],
+            max_scrolls=self.args['max_scrolls'],
+            day_time_budget=self.args['day_time_budget'],
+            split_scrolls=self.args['split_scrolls'],
+            split_rate=self.args['split_rate'],
+            window_workers=self.args['window_workers'],
+            max_drivers=self.args['max_drivers']
         )
         scraper.extract_all_ids()
         scraper.get_metadata()
 
-    def transform(self):
-        if pd.read_csv(self.path_raw_data).empty:
-            return 'There is no raw data to transform'
+    def refresh(self):
+        """
+        Refreshes the retweets and favorites of the tweets with the highest
+        priority, then draws the charts again.
+        """
+        if not self._has_raw_data():
+            return 'There is no raw data to refresh'
+
+        from scraper.refresh import EngagementRefresh
+        api = self.shared.get('api') or self._api()
+        if api is None:
+            from scraper.api import new_api
+            with open(self.args['keys_path'], 'r') as file:
+                api = new_api(json.load(file))
+        summary = EngagementRefresh(
+            keyword=self.args['keyword'],
+            api=api,
+            budget=self.args['refresh_budget'],
+            half_life=self.args['half_life'],
+            top_k=self.args['top_k']
+        ).refresh()
+        print(f"Refreshed {summary['refreshed']} tweets with "
+              f"{summary['api_calls']} API calls, {summary['changed']} "
+              f"changed")
+        self.visualize()
+        return summary
+
+    def write_report(self):
+        # The report is saved next to the outputs of the keyword
+        INSTRUMENT.write_report(f'{self.path_data}/run_report.json',
+                                prometheus_path=self.args['prometheus_path'])
+
+    def _has_raw_data(self):
+        # Only the first row is needed to know if there is raw data
+        try:
+            return not pd.read_csv(self.path_raw_data, nrows=1).empty
+        except (FileNotFoundError, pd.errors.EmptyDataError):
+            return False
+
+    def _pipeline(self):
+        return Pipeline(
+            state_path=f'{self.path_data}/.raw_data/pipeline_state.json',
+            max_workers=self.args['workers'],
+            force=self.args['force']
+        )
+
+    def _add_stages(self, pipeline, instance, stages, register=False):
+        for method, inputs, outputs in stages:
+            func = getattr(instance, method)
+            if register:
+                func = self._registered(func, outputs[0].split('/')[0])
+            pipeline.add(
+                method, func,
+                inputs=[f'{self.path_data}/{path}' for path in inputs],
+                outputs=[f'{self.path_data}/{path}' for path in outputs]
+            )
+
+    def _registered(self, func, name):
+        # Keep the data frame returned by a Transform method, so Visualize
+        # doesn't read back the CSV file that was just written
+        def run():
+            self.results[name] = func()
+            return self.results[name]
+        return run
 
+    def _add_transform_stages(self, pipeline):
+        from scraper.transform import Transform
         transform = Transform(
-            keyword=self.args['keyword']
+            keyword=self.args['keyword'],
+            top_k=self.args['top_k']
         )
+        self._add_stages(pipeline, transform, self.transform_stages,
+                         register=True)
+
+    def _add_visualize_stages(self, pipeline):
+        from scraper.visualize import Visualize
+        from scraper.dashboard import Dashboard
+        # The dashboard includes every chart, so the standalone chart pages
+        # can be skipped to save storage
+        if not self.args['dashboard_only']:
+            visualize = Visualize(
+                keyword=self.args['keyword'],
+                results=self.results
+            )
+            self._add_stages(pipeline, visualize, self.visualize_stages)
 
-        transform.get_df_clean_data()
-        transform.get_df_grouped_date()
-        transform.get_df_key_topics()
-        transform.get_df_most_mentioned_users()
-        transform.get_df_most_mentioned_hashtags()
-        transform.get_df_most_active_users()
-        transform.get_df_most_retweeted_users()
-        transform.get_df_users_by_followers()
-        transform.get_df_cohashtags_matrix()
-        transform.get_df_tweets_sorted_by_retweets()
+        dashboard = Dashboard(
+            keyword=self.args['keyword'],
+            results=self.results
+        )
+        pipeline.add(
+            'dashboard', dashboard.render,
+            inputs=[f'{self.path_data}/{inputs[0]}'
+                    for _, inputs, _ in self.visualize_stages],
+            outputs=[dashboard.dashboard_path]
+        )
+
+    def transform(self):
+        if not self._has_raw_data():
+            return 'There is no raw data to transform'
+
+        pipeline = self._pipeline()
+        self._add_transform_stages(pipeline)
+        return pipeline.run()
 
     def visualize(self):
-        if pd.read_csv(self.path_raw_data).empty:
+        if not self._has_raw_data():
             return 'There is no raw data to transform'
 
-        visualize = Visualize(
-            keyword=self.args['keyword']
-        )
+        pipeline = self._pipeline()
+        self._add_visualize_stages(pipeline)
+        return pipeline.run()
 
-        visualize.visualize_grouped_date()
-        visualize.visualize_key_topics()
-        visualize.visualize_most_mentioned_users()
-        visualize.visualize_most_mentioned_hashtags()
-        visualize.visualize_most_active_users()
-        visualize.visualize_most_retweeted_users()
-        visualize.visualize_users_by_followers()
+    def run(self, command='all'):
+        """
+        Runs one command: 'scrape', 'transform', 'visualize', 'refresh', or
+        'all'.
+        """
+        return getattr(self, COMMANDS[command])()
 
     def execute_all(self):
         self.scrape()
-        self.transform()
-        self.visualize()
+        if not self._has_raw_data():
+            return 'There is no raw data to transform'
+
+        # Transform and visualize share one graph, so each chart starts as
+        # soon as the aggregation it reads is written
+        pipeline = self._pipeline()
+        self._add_transform_stages(pipeline)
+        self._add_visualize_stages(pipeline)
+        return pipeline.run()
+
+
+class BatchRunner(object):
+    """
+    Runs every keyword of a manifest in one process. The keywords share the
+    API client, a pool of Chrome sessions, a cache of hydrated tweets, and
+    the text cleaning resources loaded by Transform, and up to max_keywords
+    keywords run at the same time. The status of each keyword is saved in
+    data/batch_status.json while the batch runs.
+    Args:
+        - args (dict): Command line arguments, including the path of the
+            manifest with the columns keyword, keyword_type, start, and end
+    """
+    def __init__(self, args):
+        self.args = args
+        self.status_path = f"{os.path.expanduser('data')}/batch_status.json"
+        self.keywords = self._read_manifest(args['manifest'])
+        self.status = {row['keyword']: {'status': 'pending'}
+                       for row in self.keywords}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _read_manifest(path):
+        if path.endswith('.json'):
+            with open(path, 'r') as file:
+                keywords = json.load(file)
+        else:
+            keywords = pd.read_csv(path, dtype=str).to_dict('records')
+        columns = ['keyword', 'keyword_type', 'start', 'end']
+        for row in keywords:
+            missing = [column for column in columns if not row.get(column)]
+            if missing:
+                raise ValueError(f'The manifest row {row} is missing '
+                                 f'{missing}')
+        return keywords
+
+    def _update_status(self, keyword, **status):
+        with self._lock:
+            self.status[keyword].update(status)
+            folder = os.path.dirname(self.status_path)
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            with open(self.status_path, 'w') as file:
+                json.dump(self.status, file, indent=2)
+
+    def _run_keyword(self, row, shared):
+        keyword = row['keyword']
+        args = dict(self.args)
+        args.update({column: row[column] for column in
+                     ['keyword', 'keyword_type', 'start', 'end']})
+        self._update_status(keyword, status='running',
+                            started_at=datetime.datetime.now().isoformat())
+        try:
+            Execute(args=args, shared=shared).run(args['command'])
+        except Exception as error:
+            self._update_status(keyword, status='failed', error=repr(error),
+                                finished_at=datetime.datetime.now()
+                                .isoformat())
+            return
+        self._update_status(keyword, status='done',
+                            finished_at=datetime.datetime.now().isoformat())
+
+    def run(self):
+        # Transform and visualize don't need the scraping resources
+        if self.args['command'] in ['transform', 'visualize']:
+            return self._run_all({})
+
+        # Create the resources shared by every keyword once
+        shared = shared_resources(self.args)
+        try:
+            return self._run_all(shared)
+        finally:
+            shared['driver_pool'].close()
+
+    def _run_all(self, shared):
+        with ThreadPoolExecutor(
+                max_workers=int(self.args['max_keywords'])) as executor:
+            for row in self.keywords:
+                executor.submit(self._run_keyword, row, shared)
+        return self.status
 
 
 if __name__ == '__main__':
-    Execute().execute_all()
+    args = parse_args()
+    INSTRUMENT.reset(trace_memory=args['trace_memory'])
+    if args['job_status'] is not None:
+        from scraper.worker import JobQueue
+        queue = JobQueue()
+        if args['job_status'] == 'all':
+            print(json.dumps(queue.jobs(), indent=2))
+        else:
+            print(json.dumps(queue.get(args['job_status']), indent=2))
+    elif args['submit']:
+        from scraper.worker import JobQueue
+        job = {column: args[column] for column in
+               ['keyword', 'keyword_type', 'start', 'end', 'force',
+                'dashboard_only'] if args[column] is not None}
+        print(JobQueue().submit(job, command=args['command']))
+    elif args['worker']:
+        from scraper.worker import JobQueue, Worker
+        shared = shared_resources(args)
+        worker = Worker(args, JobQueue(), Execute, shared=shared,
+                        concurrency=args['max_keywords'])
+        signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+        try:
+            worker.serve()
+        finally:
+            shared['driver_pool'].close()
+    elif args['compare'] is not None:
+        from scraper.compare import Compare
+        compare = Compare(keywords=args['compare'])
+        try:
+            compare.compare_all()
+        finally:
+            INSTRUMENT.write_report(
+                f"{os.path.expanduser('data')}/{compare.comparison}/"
+                f"run_report.json",
+                prometheus_path=args['prometheus_path'])
+    elif args['manifest'] is not None:
+        try:
+            BatchRunner(args).run()
+        finally:
+            INSTRUMENT.write_report(
+                f"{os.path.expanduser('data')}/batch_report.json",
+                prometheus_path=args['prometheus_path'])
+    else:
+        execute = Execute(args=args)
+        try:
+            execute.run(args['command'])
+        finally:
+            execute.write_report()
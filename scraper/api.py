@@ -0,0 +1,46 @@
+import tweepy
+from time import sleep
+
+
+def new_api(keys):
+    """
+    Creates a tweepy client with the Twitter Developer keys.
+    Args:
+        - keys (dict): consumer_key, consumer_secret, access_token, and
+            access_token_secret
+    """
+    auth = tweepy.OAuthHandler(keys['consumer_key'], keys['consumer_secret'])
+    auth.set_access_token(keys['access_token'], keys['access_token_secret'])
+    return tweepy.API(auth)
+
+
+def lookup_statuses(api, ids_batch, max_retries=3, rate_limit_wait=900,
+                    delay=1):
+    """
+    Gets the metadata of up to 100 tweet ids. When the rate limit is
+    reached, it waits for the next window, and other errors are retried
+    with exponential backoff.
+    Args:
+        - api (object): client with a statuses_lookup method
+        - ids_batch (list): Tweet ids
+        - max_retries (int): times the batch is retried after an error
+        - rate_limit_wait (float): seconds to wait when the rate limit is
+            reached
+        - delay (float): seconds waited before the first retry
+    Returns:
+        - response (list): Statuses returned by the API
+    """
+    attempt = 0
+    while True:
+        try:
+            return api.statuses_lookup(ids_batch, tweet_mode='extended')
+        except tweepy.RateLimitError:
+            print(f'Rate limit reached, waiting {rate_limit_wait} seconds')
+            sleep(rate_limit_wait)
+        except tweepy.TweepError as error:
+            if attempt >= max_retries:
+                raise
+            wait = delay * 2 ** attempt
+            print(f'API error {error}, retrying in {wait} seconds')
+            sleep(wait)
+            attempt += 1
@@ -0,0 +1,486 @@
+#!/usr/bin/env python
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from scraper.instrument import INSTRUMENT
+from scraper.save import Save
+from scraper.transform import Transform
+from scraper.visualize import Visualize
+
+
+TRANSFORM_METHODS = [
+    'get_df_clean_data', 'get_df_grouped_date', 'get_df_key_topics',
+    'get_df_most_mentioned_users', 'get_df_most_mentioned_hashtags',
+    'get_df_most_active_users', 'get_df_most_retweeted_users',
+    'get_df_users_by_followers', 'get_df_interaction_graph',
+    'get_df_cohashtags_matrix', 'get_df_tweets_sorted_by_retweets',
+    'get_df_rankings'
+]
+VISUALIZE_METHODS = [
+    'visualize_grouped_date', 'visualize_key_topics',
+    'visualize_most_mentioned_users', 'visualize_most_mentioned_hashtags',
+    'visualize_most_active_users', 'visualize_most_retweeted_users',
+    'visualize_users_by_followers', 'visualize_interaction_graph'
+]
+# Packages with a slow import, reported by the startup benchmark
+HEAVY_PACKAGES = ['selenium', 'tweepy', 'nltk', 'sklearn', 'highcharts']
+
+
+class SyntheticCorpus(object):
+    """
+    Generates raw tweets shaped like the rows that Scrape.get_metadata saves
+    in df_raw.csv, with nested user, entities, place and quoted_status
+    fields. Users, hashtags, mentions and words are drawn from Zipf
+    distributions, so a few of them are very frequent and most of them are
+    rare, like in real corpora. The same seed always generates the same
+    corpus.
+    Args:
+        - n_rows (int): Number of tweets
+        - seed (int): Seed of the random generator
+        - start (str): First day of the corpus. Format: 'YYYY-MM-DD'
+        - days (int): Number of days covered by the corpus
+    """
+    def __init__(self, n_rows, seed=0, start='2019-01-01', days=365):
+        self.n_rows = int(n_rows)
+        self.rng = np.random.RandomState(seed)
+        self.start = datetime.datetime.strptime(start, '%Y-%m-%d')
+        self.days = days
+        self.n_users = max(self.n_rows // 5, 10)
+        self.n_hashtags = max(self.n_rows // 20, 10)
+        self.vocabulary = self._words(5000)
+
+    def _words(self, size):
+        letters = np.array(list('abcdefghijklmnopqrstuvwxyz'))
+        lengths = self.rng.randint(3, 10, size=size)
+        return [''.join(self.rng.choice(letters, length))
+                for length in lengths]
+
+    def _zipf(self, size, upper, a=1.6):
+        # Zipf samples are unbounded, so they are folded into [0, upper)
+        return (self.rng.zipf(a, size=size) - 1) % upper
+
+    def _user(self, user_index, followers):
+        return {'id': int(user_index),
+                'screen_name': f'user{user_index}',
+                'followers_count': int(followers),
+                'friends_count': int(self.rng.randint(0, 5000)),
+                'statuses_count': int(self.rng.randint(1, 100000)),
+                'location': f'City {user_index % 50}',
+                'created_at': 'Wed Oct 10 20:19:24 +0000 2012'}
+
+    def generate(self):
+        n = self.n_rows
+        seconds = self.rng.randint(0, self.days * 24 * 3600, size=n)
+        authors = self._zipf(n, self.n_users)
+        followers = (self.rng.pareto(1.2, size=self.n_users) * 100)\
+            .astype(int)
+        n_hashtags = self.rng.poisson(1.0, size=n)
+        n_mentions = self.rng.poisson(0.8, size=n)
+        n_words = self.rng.randint(5, 25, size=n)
+        retweets = (self.rng.pareto(1.5, size=n) * 5).astype(int)
+        favorites = (retweets * self.rng.uniform(1, 4, size=n)).astype(int)
+        is_quote = self.rng.uniform(size=n) < 0.2
+        is_reply = self.rng.uniform(size=n) < 0.15
+        has_place = self.rng.uniform(size=n) < 0.05
+        languages = self.rng.choice(['en', 'es', 'und'], size=n,
+                                    p=[0.7, 0.2, 0.1])
+
+        rows = []
+        for i in range(n):
+            ts = self.start + datetime.timedelta(seconds=int(seconds[i]))
+            hashtags = [f'tag{h}' for h in
+                        self._zipf(n_hashtags[i], self.n_hashtags)]
+            mentions = [f'user{u}' for u in
+                        self._zipf(n_mentions[i], self.n_users)]
+            words = [self.vocabulary[w] for w in
+                     self._zipf(n_words[i], len(self.vocabulary), a=1.3)]
+            text = ' '.join(words + ['#' + h for h in hashtags]
+                            + ['@' + m for m in mentions])
+            tweet_id = 1000000000000000000 + i
+            row = {
+                'created_at': ts.strftime('%a %b %d %H:%M:%S +0000 %Y'),
+                'id': tweet_id,
+                'id_str': str(tweet_id),
+                'full_text': text,
+                'truncated': False,
+                'display_text_range': [0, len(text)],
+                'entities': {
+                    'hashtags': [{'text': h, 'indices': [0, 0]}
+                                 for h in hashtags],
+                    'symbols': [], 'urls': [],
+                    'user_mentions': [{'screen_name': m, 'name': m}
+                                      for m in mentions]},
+                'source': 'Twitter Web App',
+                'in_reply_to_status_id': None,
+                'in_reply_to_user_id': None,
+                'in_reply_to_screen_name':
+                    f'user{authors[i - 1]}' if is_reply[i] else None,
+                'user': self._user(authors[i], followers[authors[i]]),
+                'geo': None,
+                'coordinates': None,
+                'place': {'country_code': 'US',
+                          'full_name': f'City {i % 50}, ST',
+                          'name': f'City {i % 50}'} if has_place[i] else None,
+                'contributors': None,
+                'is_quote_status': bool(is_quote[i]),
+                'retweet_count': int(retweets[i]),
+                'favorite_count': int(favorites[i]),
+                'favorited': False,
+                'retweeted': False,
+                'lang': languages[i]
+            }
+            if is_quote[i]:
+                quoted = self._zipf(1, self.n_users)[0]
+                row['quoted_status'] = {
+                    'retweet_count': int(self.rng.randint(0, 1000)),
+                    'user': self._user(quoted, followers[quoted])}
+            rows.append(row)
+
+        # Columns missing in a row are saved as empty cells, like when the
+        # API omits quoted_status for tweets that are not quotes
+        return pd.DataFrame(rows)
+
+
+class Benchmark(object):
+    """
+    Times every Transform and Visualize method, and the Save of the raw
+    data, on synthetic corpora of several sizes. Everything runs offline in
+    a temporary folder, and the timings are saved as JSON per commit, so
+    they can be compared between commits.
+    Args:
+        - sizes (list): Number of rows of each corpus
+        - results_path (str): Folder where the JSON results are saved
+        - seed (int): Seed used to generate the corpora
+    """
+    def __init__(self, sizes, results_path='benchmarks/results', seed=0):
+        self.sizes = [int(size) for size in sizes]
+        self.results_path = os.path.expanduser(results_path)
+        self.seed = seed
+
+    @staticmethod
+    def _commit():
+        try:
+            return subprocess.check_output(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=subprocess.DEVNULL).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return 'unknown'
+
+    def run_size(self, n_rows):
+        keyword = f'benchmark_{n_rows}'
+        save_path = tempfile.mkdtemp(prefix='scraper_benchmark_')
+        try:
+            df_raw = SyntheticCorpus(n_rows, seed=self.seed).generate()
+            INSTRUMENT.reset()
+            Save(df_raw, save_path, keyword, '.raw_data', 'df_raw',
+                 True).save_data()
+            transform = Transform(keyword=keyword, save_path=save_path)
+            for method in TRANSFORM_METHODS:
+                getattr(transform, method)()
+            visualize = Visualize(keyword=keyword, save_path=save_path)
+            for method in VISUALIZE_METHODS:
+                getattr(visualize, method)()
+
+            # Only the outermost stages are kept, so Save calls made by the
+            # methods are not counted twice
+            stages = {}
+            for record in INSTRUMENT.records:
+                if record['parent'] is None:
+                    stage = stages.setdefault(
+                        record['stage'], {'wall_s': 0.0, 'cpu_s': 0.0})
+                    stage['wall_s'] += record['wall_s']
+                    stage['cpu_s'] += record['cpu_s']
+                    stage['rows_in'] = record['rows_in']
+                    stage['rows_out'] = record['rows_out']
+            return stages
+        finally:
+            shutil.rmtree(save_path, ignore_errors=True)
+
+    @staticmethod
+    def startup_times(commands=None, repeat=3):
+        """
+        Measures the time to import main.py and the modules of each of its
+        commands in a new interpreter, with python -X importtime.
+        Args:
+            - commands (list): Commands of main.py. All of them by default.
+            - repeat (int): Number of measures of each command
+        Returns:
+            - times (dict): Median import time in seconds of each command,
+                and the slow packages it loads
+        """
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        commands = commands or ['scrape', 'transform', 'visualize', 'all']
+        sys.path.insert(0, root)
+        import main
+        modules = main.COMMAND_MODULES
+        times = {}
+        for command in commands:
+            code = f'import importlib, main\n' \
+                   f'for module in {modules[command]!r}:\n' \
+                   f'    importlib.import_module(module)'
+            measures = []
+            for _ in range(repeat):
+                output = subprocess.run(
+                    [sys.executable, '-X', 'importtime', '-c', code],
+                    cwd=root, stdout=subprocess.DEVNULL,
+                    stderr=subprocess.PIPE, check=True).stderr.decode()
+                # Lines look like 'import time: self | cumulative | name',
+                # and nested imports are indented, so the total is the sum
+                # of the cumulative times of the top level imports
+                total = 0
+                packages = set()
+                for line in output.splitlines():
+                    parts = line.split('|')
+                    if not line.startswith('import time:') or \
+                            not parts[1].strip().isdigit():
+                        continue
+                    name = parts[2][1:]
+                    if not name.startswith(' '):
+                        total += int(parts[1])
+                    packages.add(name.strip().split('.')[0])
+                measures.append(total / 1e6)
+            times[command] = {
+                'import_s': float(np.median(measures)),
+                'heavy_packages': [package for package in HEAVY_PACKAGES
+                                   if package in packages]}
+        return times
+
+    @staticmethod
+    def dom_extraction(chromedriver_path='/usr/local/bin/chromedriver',
+                       anchors=5000, scrolls=10):
+        """
+        Times the extraction of tweet ids from a local fixture page that
+        grows by anchors / scrolls status anchors on every simulated scroll,
+        with one get_attribute call per anchor and with one script call that
+        only returns the new anchors. It needs Chrome and chromedriver.
+        Args:
+            - chromedriver_path (str): Path to the chromedriver executable
+            - anchors (int): Number of status anchors of the final page
+            - scrolls (int): Number of times the page grows
+        Returns:
+            - times (dict): Seconds taken by each method, and the number of
+                ids found
+        """
+        from scraper.scrape import Scrape, new_driver, new_status_ids
+        per_scroll = max(anchors // scrolls, 1)
+        folder = tempfile.mkdtemp(prefix='scraper_benchmark_')
+        path = f'{folder}/fixture.html'
+        with open(path, 'w') as file:
+            file.write(f"""<!DOCTYPE html>
+<html><body><div id="timeline"></div>
+<script>
+var next = 1000000000000000000;
+function addPage() {{
+  var html = '';
+  for (var i = 0; i < {per_scroll}; i++) {{
+    next += 1;
+    html += '<article><a href="/user/status/' + next + '">tweet</a>' +
+            '<a href="/user/status/' + next + '/photo/1">photo</a>' +
+            '</article>';
+  }}
+  document.getElementById('timeline').insertAdjacentHTML('beforeend', html);
+}}
+</script></body></html>""")
+
+        driver = new_driver(chromedriver_path)
+        times = {}
+        try:
+            for method in ['per_element', 'bulk']:
+                driver.get(f'file://{path}')
+                ids = set()
+                start = time.perf_counter()
+                for _ in range(scrolls):
+                    driver.execute_script('addPage();')
+                    if method == 'per_element':
+                        elements = driver.find_elements_by_xpath(
+                            '//a[contains(@href,"/status/")]')
+                        ids.update(Scrape._parse_ids(element)
+                                   for element in elements)
+                    else:
+                        ids.update(new_status_ids(driver))
+                times[f'{method}_s'] = time.perf_counter() - start
+                times[f'{method}_ids'] = len(ids)
+        finally:
+            driver.quit()
+            shutil.rmtree(folder, ignore_errors=True)
+        return times
+
+    def service_latency(self, n_rows=100000, clients=8, requests=400,
+                        cache_size=256):
+        """
+        Times concurrent requests to the aggregate service over a synthetic
+        corpus, with and without the result cache. The requests pick their
+        aggregate, date range, and top N from a fixed set, so the same
+        queries are repeated like on a dashboard.
+        Args:
+            - n_rows (int): Number of rows of the corpus
+            - clients (int): Number of requests sent at the same time
+            - requests (int): Number of requests sent with each cache size
+            - cache_size (int): Size of the cache of the cached run
+        Returns:
+            - latencies (dict): Percentiles of the latency in milliseconds,
+                requests per second, and cache hits of each run
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        from urllib.request import urlopen
+        from scraper.service import AggregateService
+
+        keyword = f'benchmark_{n_rows}'
+        save_path = tempfile.mkdtemp(prefix='scraper_benchmark_')
+        rng = np.random.RandomState(self.seed)
+        months = [f'2019-{month:02d}' for month in range(1, 13)]
+        queries = []
+        for aggregate in ['summary', 'grouped_date', 'most_active_users',
+                          'most_mentioned_users', 'most_mentioned_hashtags',
+                          'top_tweets']:
+            top = '&top=20' if aggregate.startswith(('most', 'top')) else ''
+            for month in rng.choice(months, 4, replace=False):
+                queries.append(f'/{keyword}/{aggregate}?start={month}-01'
+                               f'&end={month}-28{top}')
+            queries.append(f'/{keyword}/{aggregate}')
+        paths = [queries[i] for i in
+                 rng.randint(0, len(queries), size=int(requests))]
+        try:
+            Save(SyntheticCorpus(n_rows, seed=self.seed).generate(),
+                 save_path, keyword, '.raw_data', 'df_raw', True).save_data()
+            Transform(keyword=keyword, save_path=save_path)\
+                .get_df_clean_data()
+
+            results = {}
+            for name, size in [('uncached', 0), ('cached', cache_size)]:
+                with AggregateService(save_path, port=0,
+                                      cache_size=size) as service:
+                    # The first request reads the clean data
+                    urlopen(f'{service.base_url}/{keyword}/summary').read()
+
+                    def get(path):
+                        start = time.perf_counter()
+                        urlopen(f'{service.base_url}{path}').read()
+                        return time.perf_counter() - start
+
+                    start = time.perf_counter()
+                    with ThreadPoolExecutor(max_workers=int(clients)) \
+                            as executor:
+                        latencies = np.array(list(executor.map(get, paths)))
+                    wall = time.perf_counter() - start
+                    results[name] = {
+                        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+                        'p95_ms': float(np.percentile(latencies, 95) * 1000),
+                        'p99_ms': float(np.percentile(latencies, 99) * 1000),
+                        'requests_per_s': len(paths) / wall,
+                        'cache_hits': service.cache.hits}
+            return results
+        finally:
+            shutil.rmtree(save_path, ignore_errors=True)
+
+    def run(self):
+        results = {'commit': self._commit(),
+                   'date': datetime.datetime.now().isoformat(),
+                   'python': platform.python_version(),
+                   'pandas': pd.__version__,
+                   'seed': self.seed,
+                   'startup': self.startup_times(),
+                   'sizes': {}}
+        for n_rows in self.sizes:
+            print(f'Benchmarking {n_rows} rows')
+            results['sizes'][str(n_rows)] = self.run_size(n_rows)
+
+        if not os.path.exists(self.results_path):
+            os.makedirs(self.results_path)
+        path = f"{self.results_path}/{results['commit']}.json"
+        with open(path, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f'Results saved in {path}')
+        return results
+
+    @staticmethod
+    def compare(baseline_path, results_path):
+        """
+        Returns the wall time of both results per size and stage, and the
+        ratio between them. A ratio above 1 means the new results are slower.
+        """
+        with open(baseline_path, 'r') as file:
+            baseline = json.load(file)
+        with open(results_path, 'r') as file:
+            results = json.load(file)
+        rows = []
+        for size, stages in results['sizes'].items():
+            for stage, values in stages.items():
+                old = baseline['sizes'].get(size, {}).get(stage)
+                rows.append({
+                    'rows': int(size), 'stage': stage,
+                    'baseline_s': old['wall_s'] if old else np.nan,
+                    'wall_s': values['wall_s'],
+                    'ratio': values['wall_s'] / old['wall_s']
+                    if old and old['wall_s'] else np.nan})
+        return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", nargs='+', default=['10000', '100000',
+                                                  '1000000'])
+    ap.add_argument("--results_path", required=False,
+                    default='benchmarks/results')
+    ap.add_argument("--seed", required=False, default='0')
+    ap.add_argument("--compare", required=False, default=None,
+                    help='JSON results of a previous commit to compare with')
+    ap.add_argument("--startup", required=False, action='store_true',
+                    help='Only measure the import time of each command')
+    ap.add_argument("--dom", required=False, action='store_true',
+                    help='Only measure the extraction of ids from a local '
+                         'page with Chrome')
+    ap.add_argument("--anchors", required=False, default='5000')
+    ap.add_argument("--chromedriver_path", required=False,
+                    default='/usr/local/bin/chromedriver')
+    ap.add_argument("--service", required=False, action='store_true',
+                    help='Only measure the latency of concurrent requests to '
+                         'the aggregate service, on the first size of --rows')
+    ap.add_argument("--clients", required=False, default='8')
+    ap.add_argument("--requests", required=False, default='400')
+    args = vars(ap.parse_args())
+
+    if args['dom']:
+        print(Benchmark.dom_extraction(args['chromedriver_path'],
+                                       anchors=int(args['anchors'])))
+        raise SystemExit
+
+    if args['service']:
+        latencies = Benchmark(sizes=args['rows'], seed=int(args['seed']))\
+            .service_latency(int(args['rows'][0]),
+                             clients=int(args['clients']),
+                             requests=int(args['requests']))
+        for name, values in latencies.items():
+            print(f"{name}: p50 {values['p50_ms']:.1f}ms, "
+                  f"p95 {values['p95_ms']:.1f}ms, "
+                  f"p99 {values['p99_ms']:.1f}ms, "
+                  f"{values['requests_per_s']:.0f} requests/s, "
+                  f"{values['cache_hits']} cache hits")
+        raise SystemExit
+
+    if args['startup']:
+        for command, values in Benchmark.startup_times().items():
+            print(f"{command}: {values['import_s']:.3f}s "
+                  f"{', '.join(values['heavy_packages'])}")
+        raise SystemExit
+
+    benchmark = Benchmark(sizes=args['rows'],
+                          results_path=args['results_path'],
+                          seed=int(args['seed']))
+    benchmark.run()
+    if args['compare'] is not None:
+        print(Benchmark.compare(
+            args['compare'],
+            f"{benchmark.results_path}/{benchmark._commit()}.json"
+        ).to_string(index=False))
@@ -0,0 +1,51 @@
+import collections
+import threading
+
+
+class LRUCache(object):
+    """
+    Thread safe cache that keeps the most recently used results and drops
+    the least recently used one when it is full.
+    Args:
+        - maxsize (int): Maximum number of results kept. If 0, nothing is
+            cached.
+    """
+    def __init__(self, maxsize=256):
+        self.maxsize = int(maxsize)
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def get(self, key):
+        """
+        Returns whether the key was found and its value.
+        """
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return True, self._data[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, predicate):
+        """
+        Drops the results whose key matches the predicate.
+        """
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
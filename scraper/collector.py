@@ -0,0 +1,145 @@
+import asyncio
+import datetime
+import json
+import ssl
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlsplit
+
+
+async def http_get_json(url, timeout=30):
+    """
+    Gets a JSON document with a plain HTTP/1.0 request on an asyncio
+    connection, so many requests can be in flight on one thread. HTTP/1.0
+    makes the server close the connection after the body instead of using
+    chunked encoding.
+    Args:
+        - url (str): http or https URL
+        - timeout (float): Seconds to wait for the whole response
+    Returns:
+        - data (dict): Decoded JSON body
+    """
+    parts = urlsplit(url)
+    https = parts.scheme == 'https'
+    port = parts.port or (443 if https else 80)
+    path = parts.path or '/'
+    if parts.query:
+        path += f'?{parts.query}'
+
+    async def request():
+        reader, writer = await asyncio.open_connection(
+            parts.hostname, port,
+            ssl=ssl.create_default_context() if https else None)
+        try:
+            writer.write(f'GET {path} HTTP/1.0\r\nHost: {parts.netloc}\r\n'
+                         f'Accept: application/json\r\n\r\n'.encode())
+            return await reader.read()
+        finally:
+            writer.close()
+
+    response = await asyncio.wait_for(request(), timeout)
+    head, _, body = response.partition(b'\r\n\r\n')
+    status = int(head.split(b' ', 2)[1])
+    if status != 200:
+        raise IOError(f'GET {url} returned HTTP {status}')
+    return json.loads(body.decode())
+
+
+class AsyncCollector(object):
+    """
+    Collects the tweet ids of many days concurrently with asyncio. A
+    semaphore limits the days in flight, and the ids of each day are passed
+    to on_day as soon as the day is complete, so a cancelled or failed run
+    keeps the days already collected.
+
+    In 'http' mode, each day is fetched over plain HTTP from a search
+    endpoint that returns pages as JSON with the keys 'ids' and 'next', like
+    FakeTwitterServer with format=json, so dozens of days can be in flight on
+    a single thread. In 'browser' mode, the Selenium collection of each day
+    runs in a thread pool, since WebDriver calls block, and the driver pool
+    of the scraper limits the number of Chrome sessions.
+    Args:
+        - scraper (Scrape): Scraper that builds the URLs and, in 'browser'
+            mode, collects each day
+        - mode (str): 'http' or 'browser'
+        - max_concurrency (int): Maximum number of days in flight
+        - timeout (float): Seconds allowed for the whole collection. Days not
+            finished by then are cancelled.
+    """
+    def __init__(self, scraper, mode='http', max_concurrency=8, timeout=None):
+        if mode not in ['http', 'browser']:
+            raise ValueError(f'Unknown collection mode {mode}')
+        self.scraper = scraper
+        self.mode = mode
+        self.max_concurrency = int(max_concurrency)
+        self.timeout = timeout
+
+    def _day_url(self, day):
+        until = (datetime.datetime.strptime(day, '%Y-%m-%d') +
+                 datetime.timedelta(days=1)).strftime('%Y-%m-%d')
+        return self.scraper._form_url(
+            keyword_type=self.scraper.keyword_type, since=day, until=until,
+            keyword=self.scraper.keyword)
+
+    async def _collect_day_http(self, day):
+        # Follow the 'next' links until the last page of the day
+        ids = []
+        url = self._day_url(day)
+        while url:
+            data = await http_get_json(f'{url}&format=json')
+            ids.extend(data['ids'])
+            url = urljoin(url, data['next']) if data.get('next') else None
+        return list(dict.fromkeys(ids))
+
+    async def _collect_day(self, day, semaphore, executor):
+        async with semaphore:
+            if self.mode == 'http':
+                return await self._collect_day_http(day)
+            # A cancelled day still finishes in its thread, but its ids are
+            # discarded
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(
+                executor, self.scraper._extract_ids_from_one_day, day)
+
+    async def collect(self, days, on_day=None):
+        """
+        Collects the ids of every day.
+        Args:
+            - days (list): Dates. Format: 'YYYY-MM-DD'
+            - on_day (function): Called with the day and its ids as soon as
+                each day is complete
+        Returns:
+            - ids (dict): Ids of each day completed, by day
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        executor = ThreadPoolExecutor(max_workers=self.max_concurrency) \
+            if self.mode == 'browser' else None
+        results = {}
+
+        async def run(day):
+            ids = await self._collect_day(day, semaphore, executor)
+            results[day] = ids or []
+            if on_day is not None:
+                on_day(day, results[day])
+
+        tasks = [asyncio.ensure_future(run(day)) for day in days]
+        try:
+            await asyncio.wait_for(asyncio.gather(*tasks), self.timeout)
+        finally:
+            # Cancel the days still in flight after an error, a timeout, or
+            # the cancellation of the collection
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if executor is not None:
+                executor.shutdown(wait=False)
+        return results
+
+    def run(self, days, on_day=None):
+        """
+        Runs collect in a new event loop.
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self.collect(days, on_day))
+        finally:
+            loop.close()
@@ -0,0 +1,218 @@
+from highcharts import Highchart
+import numpy as np
+import pandas as pd
+import os
+from scraper.downsample import downsample_time_series
+from scraper.instrument import INSTRUMENT, instrumented
+from scraper.save import Save
+
+
+class Compare(object):
+    """
+    Compares several keywords. The clean data of every keyword is read once
+    and stacked in a single data frame with a keyword column, so each
+    comparison is one vectorized groupby or crosstab over all keywords
+    instead of one pass per keyword plus manual merges.
+    The outputs are saved in data/_comparison/<keyword1>_vs_<keyword2>...
+    Args:
+        - keywords (list): Keywords to compare. Transform must have already
+            generated their clean data.
+        - save_path (str): Path where data is saved
+    """
+    def __init__(self, keywords, save_path='data'):
+        if len(keywords) < 2:
+            raise ValueError('At least two keywords are needed to compare')
+        self.keywords = list(keywords)
+        self.save_path = save_path
+        self.comparison = f'_comparison/{"_vs_".join(self.keywords)}'
+        self.usecols = ['id', 'date', 'hashtags', 'user_screen_name',
+                        'retweet_count', 'favorite_count']
+        self._df = None
+
+    @property
+    def df(self):
+        # Read the clean data of every keyword only once
+        if self._df is None:
+            frames = []
+            for keyword in self.keywords:
+                path = f'{os.path.expanduser(self.save_path)}/{keyword}/' \
+                       f'clean_data/df_clean.csv'
+                frame = pd.read_csv(path, usecols=self.usecols,
+                                    dtype={'id': str})
+                frame['keyword'] = keyword
+                frames.append(frame)
+            self._df = pd.concat(frames, ignore_index=True)
+            self._df['keyword'] = pd.Categorical(self._df['keyword'],
+                                                 categories=self.keywords)
+            INSTRUMENT.set_rows_in(self._df.shape[0])
+        return self._df
+
+    def _save(self, df, name):
+        save_data = Save(df, self.save_path, self.comparison, name, name,
+                         True)
+        save_data.save_data()
+
+    @staticmethod
+    def _overlap_matrix(presence):
+        """
+        Returns the number of items shared by each pair of keywords, given a
+        0/1 matrix with one row per item and one column per keyword.
+        """
+        values = presence.values.astype(np.int64)
+        return pd.DataFrame(values.T.dot(values), index=presence.columns,
+                            columns=presence.columns)
+
+    @instrumented
+    def get_df_daily_volume(self):
+        # Tweets, retweets and favorites per day, side by side per keyword
+        df = self.df.groupby(['date', 'keyword']) \
+            .agg(tweets_published=('id', 'count'),
+                 retweet_count=('retweet_count', 'sum'),
+                 favorite_count=('favorite_count', 'sum')) \
+            .unstack('keyword', fill_value=0)
+        df.columns = [f'{metric}_{keyword}' for metric, keyword in df.columns]
+        df = df.reset_index()
+
+        self._save(df, 'daily_volume')
+        return df
+
+    @instrumented
+    def get_df_hashtag_overlap(self):
+        # Hashtags are saved as the string of a list, so they are extracted
+        # with one vectorized regular expression instead of literal_eval
+        hashtags = self.df[['keyword']].join(
+            self.df['hashtags'].fillna('').str.findall(r"'(#[^']+)'")
+            .explode().rename('hashtag')).dropna()
+        # Keywords without hashtags still get their column
+        df = pd.crosstab(hashtags.hashtag, hashtags.keyword) \
+            .reindex(columns=self.keywords, fill_value=0)
+        df = df[(df > 0).sum(axis=1) > 1]
+        df['total'] = df.sum(axis=1)
+        df = df.sort_values('total', ascending=False).reset_index()
+        df.columns.name = None
+
+        self._save(df, 'hashtag_overlap')
+        return df
+
+    @instrumented
+    def get_df_user_overlap(self):
+        # Users who published tweets under more than one keyword
+        df = pd.crosstab(self.df.user_screen_name, self.df.keyword) \
+            .reindex(columns=self.keywords, fill_value=0)
+        df = df[(df > 0).sum(axis=1) > 1]
+        df['total'] = df.sum(axis=1)
+        df = df.sort_values('total', ascending=False) \
+            .reset_index() \
+            .rename({'user_screen_name': 'user'}, axis=1)
+        df.columns.name = None
+        df['link'] = 'https://twitter.com/' + df['user']
+
+        self._save(df, 'user_overlap')
+        return df
+
+    @instrumented
+    def get_df_shared_tweets(self):
+        # Number of tweet ids shared by each pair of keywords. The diagonal
+        # is the number of tweets of each keyword.
+        presence = pd.crosstab(self.df.id, self.df.keyword).clip(upper=1) \
+            .reindex(columns=self.keywords, fill_value=0)
+        df = self._overlap_matrix(presence)
+        df.index.name = 'keyword'
+        df = df.reset_index()
+        df.columns.name = None
+
+        self._save(df, 'shared_tweets')
+        return df
+
+    def _save_chart(self, h, name):
+        path = f'{os.path.expanduser(self.save_path)}/{self.comparison}/' \
+               f'{name}/{name}.html'
+        folder = os.path.dirname(path)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(path, 'w') as file:
+            file.write(h.htmlcontent)
+
+    @instrumented
+    def visualize_daily_volume(self, df=None):
+        if df is None:
+            df = self.get_df_daily_volume()
+        columns = [f'tweets_published_{keyword}' for keyword in self.keywords]
+        df, resolution = downsample_time_series(df, 'date', columns)
+
+        options = {
+            'title': {'text': f'Count of tweets published by {resolution} '
+                              f'for {", ".join(self.keywords)}',
+                      'style': {'fontSize': '20'}
+                      },
+            'xAxis': {'categories': df.date.dt.strftime('%Y-%m-%d').tolist(),
+                      'labels': {'style': {'fontSize': '13px'}
+                                 },
+                      'title': {'text': f'Date ({resolution.capitalize()})',
+                                'style': {'fontSize': '15'}
+                                }
+                      },
+            'yAxis': {'title': {'text': 'Tweets published',
+                                'style': {'fontSize': '15'}
+                                },
+                      'allowDecimals': False,
+                      'labels': {'style': {'fontSize': '15px'},
+                                 'format': '{value}'}
+                      },
+            'chart': {'backgroundColor': 'white'}
+        }
+
+        # Create chart
+        h = Highchart(width=1000, height=700)
+        h.set_dict_options(options)
+        for keyword, column in zip(self.keywords, columns):
+            h.add_data_set(df[column].values.tolist(), 'line', keyword)
+        self._save_chart(h, 'daily_volume')
+
+    @instrumented
+    def visualize_hashtag_overlap(self, df=None, top_hashtags=20):
+        if df is None:
+            df = self.get_df_hashtag_overlap()
+        df = df.head(top_hashtags)
+
+        options = {
+            'title': {'text': f'Top {top_hashtags} hashtags shared by '
+                              f'{", ".join(self.keywords)}',
+                      'style': {'fontSize': '20'}
+                      },
+            'xAxis': {'categories': df.hashtag.values.tolist(),
+                      'labels': {'style': {'fontSize': '13px'}
+                                 },
+                      'title': {'text': 'Hashtags mentioned',
+                                'style': {'fontSize': '15'}
+                                }
+                      },
+            'yAxis': {'title': {'text': 'Count of hashtags',
+                                'style': {'fontSize': '15'}
+                                },
+                      'allowDecimals': False,
+                      'labels': {'style': {'fontSize': '15px'},
+                                 'format': '{value}'}
+                      },
+            'plotOptions': {'bar': {'stacking': 'normal'}
+                            },
+            'chart': {'backgroundColor': 'white'}
+        }
+
+        # Create chart
+        h = Highchart(width=1000, height=700)
+        h.set_dict_options(options)
+        for keyword in self.keywords:
+            h.add_data_set(df[keyword].values.tolist(), 'bar', keyword)
+        self._save_chart(h, 'hashtag_overlap')
+
+    def compare_all(self):
+        """
+        Generates every comparison output and chart.
+        """
+        df_daily_volume = self.get_df_daily_volume()
+        df_hashtag_overlap = self.get_df_hashtag_overlap()
+        self.get_df_user_overlap()
+        self.get_df_shared_tweets()
+        self.visualize_daily_volume(df_daily_volume)
+        self.visualize_hashtag_overlap(df_hashtag_overlap)
@@ -0,0 +1,139 @@
+import json
+import os
+import numpy as np
+from scraper.instrument import instrumented
+from scraper.visualize import Visualize, DRILLDOWN_JS
+
+
+class Dashboard(object):
+    """
+    Renders every chart of a keyword in a single HTML page. The Highcharts
+    scripts are loaded once, the options and data of all charts are embedded
+    once as compact JSON, and each chart is only drawn when it scrolls into
+    view.
+    Args:
+        - keyword (str): Hashtag, Twitter account, or query
+        - save_path (str): Path where data is saved
+        - results (dict): Data frames returned by the Transform methods,
+            used by Visualize instead of reading the CSV files
+    """
+    # Only the scripts needed to draw line and bar charts are loaded
+    js_sources = ['https://code.highcharts.com/6/highcharts.js',
+                  'https://code.highcharts.com/6/modules/exporting.js']
+
+    def __init__(self, keyword, save_path='data', results=None):
+        self.keyword = keyword
+        self.save_path = save_path
+        self.visualize = Visualize(keyword=keyword, save_path=save_path,
+                                   results=results)
+        self.dashboard_path = f'{os.path.expanduser(save_path)}/{keyword}/' \
+                              f'dashboard/dashboard.html'
+
+    @staticmethod
+    def _to_json(value):
+        # Numpy scalars returned by pandas are not JSON serializable
+        if isinstance(value, np.generic):
+            return value.item()
+        return str(value)
+
+    def get_charts(self):
+        """
+        Returns the Highcharts configuration of every chart with data.
+        """
+        charts = []
+        for name in self.visualize.charts:
+            try:
+                chart = getattr(self.visualize, f'chart_{name}')()
+            except FileNotFoundError:
+                chart = None
+            if chart is None:
+                continue
+            config = dict(chart['options'])
+            config['series'] = chart['series']
+            charts.append({'name': name, 'config': config,
+                           'drilldown': chart.get('drilldown')})
+        return charts
+
+    def _html(self, charts):
+        scripts = ''.join(f'<script src="{source}"></script>'
+                          for source in self.js_sources)
+        containers = ''
+        for i, chart in enumerate(charts):
+            containers += f'<div id="chart-{chart["name"]}" class="chart" ' \
+                          f'data-index="{i}"></div>'
+            # The daily data of downsampled charts is saved next to their
+            # standalone page
+            if chart['drilldown'] is not None:
+                drilldown = chart['drilldown']
+                containers += \
+                    f'<button onclick="drilldown({i}, \'../{chart["name"]}/' \
+                    f'{drilldown["script"]}\', \'{drilldown["name"]}\'); ' \
+                    f'this.disabled = true;">Show daily data</button>'
+        # Escape the closing tags, so the JSON can't end the script element
+        data = json.dumps([chart['config'] for chart in charts],
+                          separators=(',', ':'), default=self._to_json)\
+            .replace('</', '<\\/')
+        return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8">
+<title>Dashboard for {self.keyword}</title>
+<style>
+body {{font-family: sans-serif; background: white; margin: 20px;}}
+.chart {{width: 1000px; height: 700px; margin: 0 auto 40px auto;}}
+</style>
+{scripts}
+</head><body>
+<h1>Dashboard for {self.keyword}</h1>
+{containers}
+<script id="chart-data" type="application/json">{data}</script>
+<script>
+var configs = JSON.parse(document.getElementById('chart-data').textContent);
+var rendered = {{}};
+function render(element) {{
+  var index = +element.dataset.index;
+  if (!rendered[index]) {{
+    rendered[index] = Highcharts.chart(element, configs[index]);
+  }}
+  return rendered[index];
+}}
+function drilldown(index, src, name) {{
+  var element = document.querySelector('[data-index="' + index + '"]');
+  loadDrilldown(render(element), src, name);
+}}
+{DRILLDOWN_JS}
+var elements = document.querySelectorAll('.chart');
+if ('IntersectionObserver' in window) {{
+  var observer = new IntersectionObserver(function (entries) {{
+    entries.forEach(function (entry) {{
+      if (entry.isIntersecting) {{
+        observer.unobserve(entry.target);
+        render(entry.target);
+      }}
+    }});
+  }}, {{rootMargin: '200px'}});
+  elements.forEach(function (element) {{ observer.observe(element); }});
+}} else {{
+  elements.forEach(render);
+}}
+</script>
+</body></html>
+"""
+
+    @instrumented
+    def render(self):
+        """
+        Saves the dashboard in data/<keyword>/dashboard/dashboard.html.
+        Returns:
+            - charts (list): Names of the charts included in the dashboard
+        """
+        charts = self.get_charts()
+        # The daily data of downsampled charts is also needed when their
+        # standalone pages are not saved
+        for chart in charts:
+            if chart['drilldown'] is not None:
+                self.visualize._save_drilldown(chart, chart['name'])
+        folder = os.path.dirname(self.dashboard_path)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(self.dashboard_path, 'w') as file:
+            file.write(self._html(charts))
+        return [chart['name'] for chart in charts]
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+
+
+# Pandas resampling rules of each resolution. Weeks start on Monday.
+RESOLUTIONS = {'day': 'D', 'week': 'W-MON', 'month': 'MS'}
+
+
+def choose_resolution(start, end, max_points=400):
+    """
+    Returns the finest resolution that keeps the number of points of a
+    time series under max_points.
+    Args:
+        - start (datetime): First date of the series
+        - end (datetime): Last date of the series
+        - max_points (int): Maximum number of points to plot
+    Returns:
+        - resolution (str): 'day', 'week', or 'month'
+    """
+    days = (pd.Timestamp(end) - pd.Timestamp(start)).days + 1
+    if days <= max_points:
+        return 'day'
+    elif days / 7 <= max_points:
+        return 'week'
+    return 'month'
+
+
+def resample_sum(df, date_col, columns, resolution):
+    """
+    Adds up the columns of a daily data frame by day, week, or month.
+    Returns:
+        - df (df): One row per period, with the first date of the period in
+            date_col. Periods without data have zero counts.
+    """
+    rule = RESOLUTIONS[resolution]
+    df = df.set_index(pd.to_datetime(df[date_col]))[columns]
+    if resolution == 'week':
+        df = df.resample(rule, label='left', closed='left').sum()
+    else:
+        df = df.resample(rule).sum()
+    return df.rename_axis(date_col).reset_index()
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling. It keeps the first and last
+    points, and from each of the buckets in between, the point forming the
+    largest triangle with the point kept in the previous bucket and the
+    average of the next bucket, which preserves the peaks of the series.
+    Args:
+        - x (array): Numeric x values, sorted
+        - y (array): Numeric y values
+        - threshold (int): Number of points to keep
+    Returns:
+        - indices (array): Positions of the points kept
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = x.shape[0]
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # Bucket edges for the points between the first and the last one
+    edges = np.floor(np.linspace(1, n - 1, threshold - 1)).astype(int)
+    indices = np.empty(threshold, dtype=int)
+    indices[0] = 0
+    indices[-1] = n - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start = end
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        # Twice the triangle area for every candidate of the bucket
+        areas = np.abs((x[previous] - avg_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (avg_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        indices[i + 1] = previous
+    return indices
+
+
+def downsample_time_series(df, date_col, columns, max_points=400,
+                           lttb_column=None):
+    """
+    Aggregates a daily series to the resolution chosen for its date range
+    and, if it still has more than max_points rows, keeps max_points rows
+    with LTTB applied on lttb_column.
+    Returns:
+        - df (df): Downsampled data frame
+        - resolution (str): 'day', 'week', or 'month'
+    """
+    dates = pd.to_datetime(df[date_col])
+    resolution = choose_resolution(dates.min(), dates.max(), max_points)
+    df = resample_sum(df, date_col, columns, resolution)
+    if df.shape[0] > max_points:
+        lttb_column = lttb_column or columns[0]
+        x = df[date_col].values.astype('datetime64[D]').astype(float)
+        df = df.iloc[lttb(x, df[lttb_column].values, max_points)]\
+            .reset_index(drop=True)
+    return df, resolution
@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+
+import argparse
+import datetime
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, quote
+from tweepy import TweepError, RateLimitError
+
+
+# Twitter ids are snowflakes: the milliseconds since this epoch shifted 22
+# bits to the left, plus a sequence number. The fake backend generates ids
+# the same way, so the fake API knows when each tweet was published.
+TWITTER_EPOCH_MS = 1288834974657
+
+
+def snowflake_to_datetime(tweet_id):
+    ms = (int(tweet_id) >> 22) + TWITTER_EPOCH_MS
+    return datetime.datetime.fromtimestamp(ms / 1000, tz=datetime.timezone.utc)
+
+
+def datetime_to_snowflake(ts, sequence=0):
+    ms = int(ts.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+    return ((ms - TWITTER_EPOCH_MS) << 22) + sequence
+
+
+def _search_bounds(query):
+    """
+    Returns the lower and upper bounds of a search query, using the operators
+    since_time/until_time (unix seconds) or since/until (dates).
+    """
+    bounds = []
+    for operator in ['since', 'until']:
+        match = re.search(operator + r'_time:(\d+)', query)
+        if match:
+            bounds.append(datetime.datetime.utcfromtimestamp(
+                int(match.group(1))))
+            continue
+        match = re.search(operator + r':(\d{4}-\d{2}-\d{2})', query)
+        if match is None:
+            raise ValueError(f'The query {query} has no {operator} operator')
+        bounds.append(datetime.datetime.strptime(match.group(1), '%Y-%m-%d'))
+    return bounds
+
+
+class FakeTwitterServer(object):
+    """
+    Local stand-in for the Twitter search page. GET /search?q=... returns a
+    scrollable timeline with '/status/' anchors, and scrolling to the bottom
+    loads the next page of anchors, like twitter.com. The ids returned by a
+    query are deterministic and fall within its since/until bounds.
+
+    Plain HTTP clients can follow the 'next' link of each page, or request
+    /search?q=...&cursor=N&format=json to get the ids of one page as JSON.
+    Args:
+        - host (str): Host where the server listens
+        - port (int): Port where the server listens. If 0, a free port is used
+        - tweets_per_day (int): Average number of tweets returned per day
+        - page_size (int): Number of anchors loaded per page or scroll
+        - latency (float): Seconds waited before answering each request
+        - seed (int): Seed used to generate the tweets of each query
+    """
+    def __init__(self, host='127.0.0.1', port=0, tweets_per_day=200,
+                 page_size=20, latency=0.0, seed=0):
+        self.tweets_per_day = tweets_per_day
+        self.page_size = page_size
+        self.latency = latency
+        self.seed = seed
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def serve_forever(self):
+        """
+        Answers requests in the current thread until stop is called from
+        another thread or the process is interrupted.
+        """
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def ids_for_query(self, query):
+        """
+        Returns the sorted ids of the tweets matching the query, newest
+        first like the search timeline.
+        """
+        since, until = _search_bounds(query)
+        seconds = max(int((until - since).total_seconds()), 1)
+        rng = random.Random(zlib.crc32(query.encode()) ^ self.seed)
+        expected = self.tweets_per_day * seconds / 86400
+        count = max(int(rng.gauss(expected, expected ** 0.5)), 0)
+        offsets = sorted((rng.randrange(seconds) for _ in range(count)),
+                         reverse=True)
+        return [str(datetime_to_snowflake(
+                    since + datetime.timedelta(seconds=offset), sequence))
+                for sequence, offset in enumerate(offsets)]
+
+    def _page(self, query, cursor):
+        ids = self.ids_for_query(query)
+        page = ids[cursor:cursor + self.page_size]
+        next_cursor = cursor + self.page_size \
+            if cursor + self.page_size < len(ids) else None
+        return page, next_cursor
+
+    def _anchors(self, ids):
+        # Each tweet has a link to the status and a link to its photo, like
+        # the real timeline
+        return ''.join(
+            f'<article style="height:120px">'
+            f'<a href="/user{int(tweet_id) % 97}/status/{tweet_id}">tweet</a> '
+            f'<a href="/user{int(tweet_id) % 97}/status/{tweet_id}/photo/1">'
+            f'photo</a></article>'
+            for tweet_id in ids)
+
+    def _html(self, query, cursor):
+        page, next_cursor = self._page(query, cursor)
+        next_url = f'/search?q={quote(query)}&cursor={next_cursor}' \
+            if next_cursor is not None else ''
+        return f"""<!DOCTYPE html>
+<html><head><title>Search</title></head>
+<body>
+<div id="timeline">{self._anchors(page)}</div>
+<a id="next" rel="next" href="{next_url}">next</a>
+<script>
+var nextUrl = "{next_url}";
+var loading = false;
+window.addEventListener('scroll', function () {{
+  if (loading || !nextUrl) return;
+  if (window.innerHeight + window.scrollY <
+      document.body.scrollHeight - 10) return;
+  loading = true;
+  fetch(nextUrl + '&format=fragment').then(function (response) {{
+    return response.json();
+  }}).then(function (data) {{
+    document.getElementById('timeline')
+      .insertAdjacentHTML('beforeend', data.html);
+    nextUrl = data.next;
+    loading = false;
+  }});
+}});
+</script>
+</body></html>"""
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body, content_type):
+                body = body.encode()
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                # Clients cancelled by the async collector close the
+                # connection before reading the response
+                try:
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                url = urlparse(self.path)
+                params = parse_qs(url.query)
+                if url.path != '/search' or 'q' not in params:
+                    return self._send(404, 'Not found', 'text/plain')
+                query = params['q'][0]
+                cursor = int(params.get('cursor', ['0'])[0])
+                output = params.get('format', ['html'])[0]
+                try:
+                    if output == 'html':
+                        return self._send(200, server._html(query, cursor),
+                                          'text/html')
+                    page, next_cursor = server._page(query, cursor)
+                    next_url = f'/search?q={quote(query)}' \
+                               f'&cursor={next_cursor}' \
+                        if next_cursor is not None else None
+                    data = {'ids': page, 'next': next_url}
+                    if output == 'fragment':
+                        data['html'] = server._anchors(page)
+                    return self._send(200, json.dumps(data),
+                                      'application/json')
+                except ValueError as error:
+                    return self._send(400, str(error), 'text/plain')
+
+        return Handler
+
+
+class FakeStatus(object):
+    """
+    Mimics the tweepy Status model, which keeps the tweet JSON in _json.
+    """
+    def __init__(self, data):
+        self._json = data
+        self.id = data['id']
+
+
+class FakeStatusesAPI(object):
+    """
+    Stand-in for tweepy.API with a statuses_lookup method. It returns one
+    generated tweet per id, published at the time encoded in the id, and can
+    simulate latency, rate limits, errors and deleted tweets.
+    Args:
+        - latency (float): Seconds waited per call
+        - rate_limit (int): Calls allowed per window. If None, there is no
+            rate limit
+        - window (float): Length of the rate limit window in seconds
+        - error_rate (float): Probability that a call raises a TweepError
+        - missing_rate (float): Probability that a tweet is not returned,
+            like deleted or protected tweets
+        - seed (int): Seed of the random generator
+    """
+    def __init__(self, latency=0.0, rate_limit=None, window=900.0,
+                 error_rate=0.0, missing_rate=0.0, seed=0):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.window = window
+        self.error_rate = error_rate
+        self.missing_rate = missing_rate
+        self.seed = seed
+        self.calls = 0
+        self.errors = 0
+        self._call_times = []
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _check_limits(self):
+        with self._lock:
+            self.calls += 1
+            now = time.monotonic()
+            self._call_times = [t for t in self._call_times
+                                if now - t < self.window]
+            if self.rate_limit is not None \
+                    and len(self._call_times) >= self.rate_limit:
+                self.errors += 1
+                raise RateLimitError('Rate limit exceeded')
+            self._call_times.append(now)
+            if self._rng.random() < self.error_rate:
+                self.errors += 1
+                raise TweepError('Internal error', api_code=131)
+
+    def _tweet(self, tweet_id):
+        rng = random.Random(int(tweet_id) ^ self.seed)
+        ts = snowflake_to_datetime(tweet_id)
+        author = rng.randrange(97)
+        hashtags = [f'tag{int(rng.paretovariate(1.5)) % 50}'
+                    for _ in range(rng.randrange(3))]
+        mentions = [f'user{rng.randrange(97)}'
+                    for _ in range(rng.randrange(3))]
+        text = ' '.join(['fake tweet'] + ['#' + h for h in hashtags]
+                        + ['@' + m for m in mentions])
+        user = {'id': author, 'screen_name': f'user{author}',
+                'followers_count': int(rng.paretovariate(1.2) * 100),
+                'friends_count': rng.randrange(5000),
+                'statuses_count': rng.randrange(1, 100000),
+                'location': f'City {author % 10}',
+                'created_at': 'Wed Oct 10 20:19:24 +0000 2012'}
+        data = {'created_at': ts.strftime('%a %b %d %H:%M:%S +0000 %Y'),
+                'id': int(tweet_id), 'id_str': str(tweet_id),
+                'full_text': text, 'truncated': False,
+                'display_text_range': [0, len(text)],
+                'entities': {'hashtags': [{'text': h} for h in hashtags],
+                             'symbols': [], 'urls': [],
+                             'user_mentions': [{'screen_name': m}
+                                               for m in mentions]},
+                'in_reply_to_screen_name': None, 'user': user,
+                'geo': None, 'coordinates': None, 'place': None,
+                'is_quote_status': False,
+                'retweet_count': int(rng.paretovariate(1.5) * 5),
+                'favorite_count': int(rng.paretovariate(1.5) * 15),
+                'lang': 'en'}
+        return data
+
+    def statuses_lookup(self, id_, tweet_mode=None, **kwargs):
+        if len(id_) > 100:
+            raise TweepError('Too many ids requested', api_code=195)
+        self._check_limits()
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            missing = [self._rng.random() < self.missing_rate for _ in id_]
+        return [FakeStatus(self._tweet(tweet_id))
+                for tweet_id, skip in zip(id_, missing) if not skip]
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", required=False, default='127.0.0.1')
+    ap.add_argument("--port", required=False, default='8000')
+    ap.add_argument("--tweets_per_day", required=False, default='200')
+    ap.add_argument("--page_size", required=False, default='20')
+    ap.add_argument("--latency", required=False, default='0')
+    args = vars(ap.parse_args())
+
+    fake_server = FakeTwitterServer(
+        host=args['host'], port=int(args['port']),
+        tweets_per_day=int(args['tweets_per_day']),
+        page_size=int(args['page_size']), latency=float(args['latency']))
+    print(f'Serving fake Twitter search on {fake_server.base_url}')
+    try:
+        fake_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,191 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+
+# Types of interaction between users, in the order of their edge codes
+INTERACTIONS = ['mention', 'reply', 'retweet']
+RECEIVED_COLUMNS = ['mentions_received', 'replies_received',
+                    'retweets_received']
+
+
+def interaction_edges(df):
+    """
+    Returns one edge per interaction found in the clean data: the author of
+    a tweet mentions, replies to, or retweets another user.
+    Args:
+        - df (df): Clean data with the columns user_screen_name,
+            user_mentions, reply_to_user, and retweeted_user_screen_name.
+            The mentions can be lists or the lists saved as strings in
+            df_clean.csv.
+    Returns:
+        - edges (df): Columns source, target, and interaction (category)
+    """
+    source = df['user_screen_name'].astype(str).str.lower()
+    edges = []
+
+    # The mentions are read with a regular expression instead of evaluating
+    # the list of every tweet
+    mentions = df['user_mentions']
+    if mentions.map(lambda x: isinstance(x, list)).any():
+        mentions = mentions.map(
+            lambda x: [user.lstrip('@') for user in x]
+            if isinstance(x, list) else [])
+    else:
+        mentions = mentions.fillna('').astype(str).str.findall(r"'@([^']+)'")
+    mentions = pd.DataFrame({'source': source, 'target': mentions})\
+        .explode('target').dropna()
+    edges.append(mentions.assign(interaction='mention'))
+
+    replies = df['reply_to_user'].fillna('').astype(str).str.lstrip('@')
+    edges.append(pd.DataFrame({'source': source, 'target': replies,
+                               'interaction': 'reply'}))
+
+    if 'retweeted_user_screen_name' in df.columns:
+        edges.append(pd.DataFrame({
+            'source': source,
+            'target': df['retweeted_user_screen_name'].fillna(''),
+            'interaction': 'retweet'}))
+
+    edges = pd.concat(edges, ignore_index=True, sort=False)
+    edges['target'] = edges['target'].astype(str).str.lower()
+
+    # Users interacting with themselves don't add links to the graph
+    edges = edges[(edges.target != '') & (edges.target != 'nan') &
+                  (edges.source != 'nan') & (edges.source != edges.target)]
+    edges['interaction'] = pd.Categorical(edges['interaction'],
+                                          categories=INTERACTIONS)
+    return edges.reset_index(drop=True)
+
+
+def pagerank(adjacency, damping=0.85, tol=1e-10, max_iter=100):
+    """
+    Computes the PageRank of every node of a weighted directed graph with
+    power iterations over the sparse matrix. The rank of nodes without
+    outgoing edges is spread over every node.
+    Args:
+        - adjacency (csr_matrix): Weight of the edge from each row to each
+            column
+        - damping (float): Probability of following an edge instead of
+            jumping to a random node
+        - tol (float): Sum of the absolute changes of the ranks below which
+            the iterations stop
+        - max_iter (int): Maximum number of iterations
+    Returns:
+        - ranks (array): PageRank of each node. The ranks add up to 1.
+    """
+    n = adjacency.shape[0]
+    if n == 0:
+        return np.zeros(0)
+    out_weight = np.asarray(adjacency.sum(axis=1)).ravel()
+    dangling = out_weight == 0
+    scale = np.divide(1.0, out_weight, out=np.zeros(n),
+                      where=~dangling)
+
+    # Transposed transition matrix, so each iteration is one product
+    transition = (sparse.diags(scale) @ adjacency).T.tocsr()
+    ranks = np.full(n, 1.0 / n)
+    for _ in range(int(max_iter)):
+        jump = (1 - damping + damping * ranks[dangling].sum()) / n
+        new_ranks = damping * (transition @ ranks) + jump
+        change = np.abs(new_ranks - ranks).sum()
+        ranks = new_ranks
+        if change < tol:
+            break
+    return ranks / ranks.sum()
+
+
+class InteractionGraph(object):
+    """
+    Graph of who mentions, replies to, or retweets whom. Users are encoded
+    as integers and the interactions are kept in a sparse CSR matrix, with
+    the number of interactions from each user to each other user as
+    weights, so the metrics are computed with sparse matrix operations
+    instead of one Python object per user.
+    Args:
+        - edges (df): Columns source, target, and interaction, as returned
+            by interaction_edges
+    """
+    def __init__(self, edges):
+        codes, users = pd.factorize(
+            pd.concat([edges['source'], edges['target']],
+                      ignore_index=True))
+        self.users = np.asarray(users)
+        n_edges = edges.shape[0]
+        self.sources = codes[:n_edges]
+        self.targets = codes[n_edges:]
+        self.interactions = pd.Categorical(
+            edges['interaction'], categories=INTERACTIONS).codes
+        n = len(self.users)
+
+        # Repeated interactions are added up when the matrix is built
+        self.adjacency = sparse.csr_matrix(
+            (np.ones(n_edges), (self.sources, self.targets)), shape=(n, n))
+
+    def __len__(self):
+        return len(self.users)
+
+    def degrees(self):
+        """
+        Returns the number of users each user interacted with (out_degree)
+        and that interacted with them (in_degree), and the number of
+        interactions each user received of each type.
+        """
+        n = len(self.users)
+        degrees = {
+            'in_degree': np.diff(self.adjacency.tocsc().indptr),
+            'out_degree': np.diff(self.adjacency.indptr),
+        }
+        for code, column in enumerate(RECEIVED_COLUMNS):
+            degrees[column] = np.bincount(
+                self.targets[self.interactions == code], minlength=n)
+        return degrees
+
+    def components(self):
+        """
+        Returns the weakly connected component of each user, numbered by
+        size, 0 being the largest.
+        """
+        _, labels = connected_components(self.adjacency, directed=True,
+                                         connection='weak')
+        sizes = np.bincount(labels)
+        order = np.argsort(-sizes, kind='stable')
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        return rank[labels]
+
+    def nodes(self):
+        """
+        Returns one row per user with their node number, which is their row
+        and column in the adjacency matrix, PageRank, degrees, interactions
+        received, and component, sorted by PageRank.
+        """
+        df = pd.DataFrame({'node': np.arange(len(self.users)),
+                           'user': self.users,
+                           'pagerank': pagerank(self.adjacency)})
+        for column, values in self.degrees().items():
+            df[column] = values
+        df['component'] = self.components()
+        df['component_size'] = df.groupby('component')['user']\
+            .transform('size')
+        df['link'] = 'https://twitter.com/' + df['user']
+        return df.sort_values('pagerank', ascending=False, kind='mergesort')
+
+    def edge_list(self):
+        """
+        Returns the edges of the graph with the number of interactions of
+        each type between each pair of users, sorted by weight.
+        """
+        n = len(self.users)
+        keys = (self.sources.astype(np.int64) * n + self.targets) * \
+            len(INTERACTIONS) + self.interactions
+        keys, weights = np.unique(keys, return_counts=True)
+        pairs, interactions = np.divmod(keys, len(INTERACTIONS))
+        sources, targets = np.divmod(pairs, n)
+        df = pd.DataFrame({'source': self.users[sources],
+                           'target': self.users[targets],
+                           'interaction': np.array(INTERACTIONS)[
+                               interactions],
+                           'weight': weights})
+        return df.sort_values('weight', ascending=False, kind='mergesort')
@@ -0,0 +1,168 @@
+import datetime
+import os
+import sqlite3
+import threading
+import pandas as pd
+
+
+class IdIndex(object):
+    """
+    Persistent index of tweet ids that have already been stored in the raw
+    data. The index lives in a SQLite file, so membership checks are done
+    with the primary key instead of reading df_raw.csv every time. There is
+    one index per keyword and, optionally, a global index shared by all
+    keywords under the save path.
+    Args:
+        - save_path (str): Path where data is saved
+        - keyword (str): Hashtag, Twitter account, or query. If None, the
+            global index is used.
+    """
+    def __init__(self, save_path, keyword=None):
+        self.save_path = os.path.expanduser(save_path)
+        self.keyword = keyword
+        if keyword is None:
+            folder = f'{self.save_path}/.global_index'
+        else:
+            folder = f'{self.save_path}/{keyword}/.raw_data'
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.index_path = f'{folder}/ids.sqlite'
+
+        # The connection can be shared by the threads of a single run, so
+        # writes are serialized with a lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.index_path, check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS ids '
+                           '(id TEXT PRIMARY KEY, keyword TEXT)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS meta '
+                           '(key TEXT PRIMARY KEY, value TEXT)')
+        self._conn.commit()
+
+        # Seed the index with the ids stored in df_raw.csv by its keyword
+        # or, for the global index, by every keyword under the save path.
+        # Seeding is recorded once it finished, so a seed interrupted or
+        # failed partway is done again on the next run.
+        if not self._is_seeded():
+            if keyword is not None:
+                seeded = self._seed_from_raw_data(f'{folder}/df_raw.csv')
+            else:
+                seeded = all([self._seed_from_raw_data(
+                    f'{self.save_path}/{stored_keyword}/.raw_data/'
+                    f'df_raw.csv', keyword=stored_keyword)
+                    for stored_keyword in self._stored_keywords()])
+            if seeded:
+                with self._lock:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO meta VALUES ('seeded', ?)",
+                        (datetime.datetime.now().isoformat(),))
+                    self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM ids').fetchone()[0]
+
+    def __contains__(self, tweet_id):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT 1 FROM ids WHERE id = ?',
+                (str(tweet_id),)).fetchone() is not None
+
+    def _is_seeded(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM meta WHERE key = 'seeded'").fetchone() \
+                is not None
+
+    def _stored_keywords(self):
+        # Keyword folders, without the files saved by batch mode or the
+        # folders of the comparisons and the indexes
+        return sorted(
+            name for name in os.listdir(self.save_path)
+            if not name.startswith(('.', '_')) and
+            os.path.isdir(f'{self.save_path}/{name}'))
+
+    def _seed_from_raw_data(self, path_raw_data, keyword=None):
+        """
+        Adds the ids of a df_raw.csv file. Returns False when the file
+        exists but could not be read, so seeding is tried again later.
+        """
+        try:
+            ids = pd.read_csv(path_raw_data, usecols=['id_str'],
+                              dtype=str).id_str
+        except (FileNotFoundError, NotADirectoryError, ValueError,
+                pd.errors.EmptyDataError):
+            # No raw data to seed from
+            return True
+        except OSError as error:
+            print(f'Could not seed the index from {path_raw_data}: {error}')
+            return False
+        self.add(ids.dropna().tolist(), keyword=keyword)
+        return True
+
+    def filter_new(self, ids):
+        """
+        Returns the ids that are not in the index yet, keeping their order
+        and removing duplicates.
+        Args:
+            - ids (list): Tweet ids as strings or integers
+        Returns:
+            - new_ids (list): Tweet ids (str) not found in the index
+        """
+        ids = list(dict.fromkeys(str(tweet_id) for tweet_id in ids
+                                 if tweet_id is not None))
+        if not ids:
+            return []
+
+        # SQLite limits the number of variables per query, so we check
+        # membership in chunks
+        known = set()
+        chunk_size = 900
+        with self._lock:
+            for i in range(0, len(ids), chunk_size):
+                chunk = ids[i:i + chunk_size]
+                rows = self._conn.execute(
+                    f'SELECT id FROM ids WHERE id IN '
+                    f'({",".join("?" * len(chunk))})', chunk).fetchall()
+                known.update(row[0] for row in rows)
+        return [tweet_id for tweet_id in ids if tweet_id not in known]
+
+    def keywords_of(self, ids):
+        """
+        Returns the keyword that stored each of the ids found in the index.
+        Args:
+            - ids (list): Tweet ids as strings or integers
+        Returns:
+            - keywords (dict): Keyword by tweet id (str), only for the ids
+                found in the index
+        """
+        ids = list(dict.fromkeys(str(tweet_id) for tweet_id in ids
+                                 if tweet_id is not None))
+        keywords = {}
+        chunk_size = 900
+        with self._lock:
+            for i in range(0, len(ids), chunk_size):
+                chunk = ids[i:i + chunk_size]
+                keywords.update(self._conn.execute(
+                    f'SELECT id, keyword FROM ids WHERE id IN '
+                    f'({",".join("?" * len(chunk))})', chunk).fetchall())
+        return keywords
+
+    def add(self, ids, keyword=None):
+        """
+        Adds ids to the index. Ids already present are ignored.
+        Args:
+            - ids (list): Tweet ids as strings or integers
+            - keyword (str): Keyword that stored the ids. Defaults to the
+                keyword of the index, which is None for the global index.
+        """
+        keyword = keyword or self.keyword
+        rows = [(str(tweet_id), keyword) for tweet_id in ids
+                if tweet_id is not None]
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO ids (id, keyword) VALUES (?, ?)', rows)
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
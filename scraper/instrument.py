@@ -0,0 +1,225 @@
+import datetime
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # The resource module is only available on Unix
+    resource = None
+
+
+class Instrument(object):
+    """
+    Records wall time, CPU time, memory and row counts of every stage of a
+    run, and writes them as a JSON report and optionally as a Prometheus
+    textfile. Stages can be nested, e.g. each scroll inside the collection of
+    one day, and each record keeps the name of its parent stage.
+
+    CPU time is measured for the thread running the stage, so it stays
+    meaningful when stages run concurrently. Python allocations are only
+    traced when trace_memory is enabled, because tracemalloc slows down the
+    run, and its peak is reset by nested stages and shared by the stages
+    running at the same time.
+    """
+    def __init__(self):
+        self.records = []
+        self.trace_memory = False
+        self.started_at = datetime.datetime.now().isoformat()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def reset(self, trace_memory=False):
+        with self._lock:
+            self.records = []
+            self.started_at = datetime.datetime.now().isoformat()
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif not trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @staticmethod
+    def _peak_rss_mb():
+        if resource is None:
+            return None
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    @contextmanager
+    def stage(self, name, rows_in=None, **labels):
+        """
+        Measures the code run inside the context. The record is yielded, so
+        the caller can set 'rows_in' and 'rows_out' when they are known.
+        Args:
+            - name (str): Name of the stage, e.g. 'scroll' or
+                'get_df_grouped_date'
+            - rows_in (int): Rows or items received by the stage
+            - labels: Extra fields added to the record, e.g. the keyword
+        """
+        stack = self._stack()
+        record = {'stage': name,
+                  'parent': stack[-1]['stage'] if stack else None,
+                  'thread': threading.current_thread().name,
+                  'rows_in': rows_in,
+                  'rows_out': None,
+                  'status': 'ok'}
+        record.update(labels)
+        stack.append(record)
+
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            memory_start = tracemalloc.get_traced_memory()[0]
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+        rss_start = self._peak_rss_mb()
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield record
+        except BaseException:
+            record['status'] = 'failed'
+            raise
+        finally:
+            record['wall_s'] = round(time.perf_counter() - wall_start, 6)
+            record['cpu_s'] = round(time.thread_time() - cpu_start, 6)
+            # The peak resident memory is the one of the whole process, so
+            # the stage is also recorded with how much it raised that peak.
+            # Stages running at the same time share that increase.
+            rss_end = self._peak_rss_mb()
+            record['process_peak_rss_mb'] = rss_end
+            record['peak_rss_increase_mb'] = round(rss_end - rss_start, 3) \
+                if rss_end is not None else None
+            if tracing and tracemalloc.is_tracing():
+                peak = tracemalloc.get_traced_memory()[1]
+                record['tracemalloc_peak_mb'] = round(
+                    max(peak - memory_start, 0) / 2 ** 20, 3)
+            stack.pop()
+            with self._lock:
+                self.records.append(record)
+
+    def set_rows_in(self, rows):
+        """
+        Sets the rows received by the innermost stage of the current thread.
+        """
+        stack = self._stack()
+        if stack:
+            stack[-1]['rows_in'] = rows
+
+    def summary(self):
+        # Aggregate the records of each stage name
+        summary = {}
+        with self._lock:
+            records = list(self.records)
+        for record in records:
+            stage = summary.setdefault(
+                record['stage'], {'count': 0, 'wall_s': 0.0, 'cpu_s': 0.0,
+                                  'rows_in': 0, 'rows_out': 0, 'failed': 0})
+            stage['count'] += 1
+            stage['wall_s'] += record['wall_s']
+            stage['cpu_s'] += record['cpu_s']
+            stage['rows_in'] += record['rows_in'] or 0
+            stage['rows_out'] += record['rows_out'] or 0
+            stage['failed'] += record['status'] == 'failed'
+        for stage in summary.values():
+            stage['wall_s'] = round(stage['wall_s'], 6)
+            stage['cpu_s'] = round(stage['cpu_s'], 6)
+        return summary
+
+    def write_report(self, path, prometheus_path=None):
+        """
+        Saves the records and their summary per stage as JSON. Nothing is
+        saved when no stage ran.
+        Args:
+            - path (str): Path of the JSON report
+            - prometheus_path (str): If given, also saves the summary in the
+                Prometheus textfile format
+        """
+        with self._lock:
+            records = list(self.records)
+        if not records:
+            return
+        path = os.path.expanduser(path)
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        report = {'started_at': self.started_at,
+                  'finished_at': datetime.datetime.now().isoformat(),
+                  'peak_rss_mb': self._peak_rss_mb(),
+                  'summary': self.summary(),
+                  'records': records}
+        with open(path, 'w') as file:
+            json.dump(report, file, indent=2, default=str)
+
+        if prometheus_path is not None:
+            self.write_prometheus(prometheus_path)
+
+    def write_prometheus(self, path):
+        lines = []
+        metrics = [('wall_s', 'wall_seconds_total', 'Wall time per stage'),
+                   ('cpu_s', 'cpu_seconds_total', 'CPU time per stage'),
+                   ('count', 'runs_total', 'Times each stage ran'),
+                   ('rows_in', 'rows_in_total', 'Rows received per stage'),
+                   ('rows_out', 'rows_out_total', 'Rows returned per stage')]
+        summary = self.summary()
+        for key, metric, description in metrics:
+            lines.append(f'# HELP scraper_stage_{metric} {description}')
+            lines.append(f'# TYPE scraper_stage_{metric} counter')
+            for stage, values in sorted(summary.items()):
+                lines.append(f'scraper_stage_{metric}{{stage="{stage}"}} '
+                             f'{values[key]}')
+        peak_rss = self._peak_rss_mb()
+        if peak_rss is not None:
+            lines.append('# HELP scraper_peak_rss_megabytes Peak resident '
+                         'memory of the run')
+            lines.append('# TYPE scraper_peak_rss_megabytes gauge')
+            lines.append(f'scraper_peak_rss_megabytes {peak_rss}')
+
+        # Write to a temporary file first, so the node exporter never reads
+        # a half written file
+        path = os.path.expanduser(path)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
+
+
+# Records of the current run, shared by every module of the package
+INSTRUMENT = Instrument()
+
+
+def _count_rows(result):
+    # Only data frames, arrays, and lists of rows are counted, not the
+    # status messages returned by some stages
+    if hasattr(result, 'shape') and len(result.shape) > 0:
+        return result.shape[0]
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    return None
+
+
+def instrumented(func):
+    """
+    Decorator that records a method as a stage named after the method. The
+    rows returned are counted when the method returns a data frame or a
+    list, and the keyword of the instance is added to the record.
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with INSTRUMENT.stage(func.__name__,
+                              keyword=getattr(self, 'keyword', None)) \
+                as record:
+            result = func(self, *args, **kwargs)
+            record['rows_out'] = _count_rows(result)
+            return result
+    return wrapper
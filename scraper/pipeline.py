@@ -0,0 +1,200 @@
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class Task(object):
+    """
+    A stage of the pipeline. Each task declares the files it reads and the
+    files it writes, and the pipeline uses them to order the tasks and to
+    skip the ones whose inputs haven't changed since the last run.
+    Args:
+        - name (str): Unique name of the task
+        - func (callable): Function called without arguments to run the task
+        - inputs (list): Paths of the files read by the task
+        - outputs (list): Paths of the files written by the task
+        - depends_on (list): Names of tasks that must run first even if
+            they don't share files with this task
+    """
+    def __init__(self, name, func, inputs=(), outputs=(), depends_on=()):
+        self.name = name
+        self.func = func
+        self.inputs = [os.path.expanduser(path) for path in inputs]
+        self.outputs = [os.path.expanduser(path) for path in outputs]
+        self.depends_on = list(depends_on)
+
+
+class Pipeline(object):
+    """
+    Runs tasks as a dependency graph. A task depends on every task that
+    writes one of its inputs. Tasks whose dependencies are done run
+    concurrently in a thread pool, and a task is skipped when the content of
+    its inputs and its outputs is the same as after its last run.
+    Args:
+        - state_path (str): JSON file where the fingerprints of the last run
+            are stored
+        - max_workers (int): Maximum number of tasks running at once
+        - force (bool): If True, run every task even if nothing changed
+    """
+    def __init__(self, state_path, max_workers=4, force=False):
+        self.state_path = os.path.expanduser(state_path)
+        self.max_workers = int(max_workers)
+        self.force = force
+        self.tasks = {}
+        self._lock = threading.Lock()
+        try:
+            with open(self.state_path, 'r') as file:
+                self.state = json.load(file)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            self.state = {}
+
+    def add(self, name, func, inputs=(), outputs=(), depends_on=()):
+        if name in self.tasks:
+            raise ValueError(f'Task {name} was already added to the pipeline')
+        self.tasks[name] = Task(name, func, inputs, outputs, depends_on)
+
+    @staticmethod
+    def _file_hash(path):
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                sha1.update(chunk)
+        return sha1.hexdigest()
+
+    def _fingerprint(self, path, previous=None):
+        """
+        Returns the size, modification time and content hash of a file, or
+        None if it doesn't exist. The hash is only computed again when the
+        size or modification time changed since the previous fingerprint.
+        """
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        fingerprint = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+        if previous is not None and previous['size'] == stat.st_size \
+                and previous['mtime'] == stat.st_mtime_ns:
+            fingerprint['sha1'] = previous['sha1']
+        else:
+            fingerprint['sha1'] = self._file_hash(path)
+        return fingerprint
+
+    @staticmethod
+    def _same_content(current, previous):
+        if current is None or previous is None:
+            return current is previous
+        return current['sha1'] == previous['sha1']
+
+    def _dependencies(self):
+        # Map each file to the task writing it, and then each task to the
+        # tasks writing its inputs
+        writers = {}
+        for task in self.tasks.values():
+            for path in task.outputs:
+                writers[path] = task.name
+        dependencies = {}
+        for task in self.tasks.values():
+            upstream = set(task.depends_on)
+            upstream.update(writers[path] for path in task.inputs
+                            if path in writers and writers[path] != task.name)
+            unknown = upstream - set(self.tasks)
+            if unknown:
+                raise ValueError(f'Task {task.name} depends on unknown tasks '
+                                 f'{sorted(unknown)}')
+            dependencies[task.name] = upstream
+        return dependencies
+
+    def _is_up_to_date(self, task):
+        previous = self.state.get(task.name)
+        if self.force or previous is None:
+            return False
+        for group in ['inputs', 'outputs']:
+            for path in getattr(task, group):
+                # Files added to the task since its last run
+                if path not in previous[group]:
+                    return False
+                current = self._fingerprint(path, previous[group].get(path))
+                if not self._same_content(current, previous[group].get(path)):
+                    return False
+        return True
+
+    def _run_task(self, task):
+        if self._is_up_to_date(task):
+            print(f'Skipping {task.name}, its inputs have not changed')
+            return 'skipped'
+        task.func()
+
+        # Record the fingerprints after a successful run
+        previous = self.state.get(task.name, {'inputs': {}, 'outputs': {}})
+        state = {group: {path: self._fingerprint(
+                            path, previous[group].get(path))
+                         for path in getattr(task, group)}
+                 for group in ['inputs', 'outputs']}
+        with self._lock:
+            self.state[task.name] = state
+            self._save_state()
+        return 'done'
+
+    def _save_state(self):
+        folder = os.path.dirname(self.state_path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        tmp_path = f'{self.state_path}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(self.state, file, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.state_path)
+
+    def run(self):
+        """
+        Runs every task once its dependencies are done.
+        Returns:
+            - status (dict): 'done', 'skipped', 'failed', or
+                'upstream_failed' per task name
+        Raises:
+            - The first exception raised by a task, after the tasks that
+                don't depend on it have finished
+        """
+        dependencies = self._dependencies()
+        pending = dict(dependencies)
+        status = {}
+        errors = []
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                # Tasks downstream of a failure are not run
+                for name, upstream in list(pending.items()):
+                    if any(status.get(dep) in ('failed', 'upstream_failed')
+                           for dep in upstream):
+                        status[name] = 'upstream_failed'
+                        del pending[name]
+
+                # Submit every task whose dependencies are done
+                ready = [name for name, upstream in pending.items()
+                         if all(status.get(dep) in ('done', 'skipped')
+                                for dep in upstream)]
+                for name in ready:
+                    del pending[name]
+                    future = executor.submit(self._run_task, self.tasks[name])
+                    running[future] = name
+
+                if not running:
+                    if pending:
+                        raise ValueError(f'Tasks {sorted(pending)} have '
+                                         f'circular dependencies')
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        status[name] = future.result()
+                    except Exception as error:
+                        print(f'Task {name} failed: {error!r}')
+                        status[name] = 'failed'
+                        errors.append(error)
+
+        if errors:
+            raise errors[0]
+        return status
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+
+
+# Columns of the clean data read to rank the tweets
+RANKING_COLUMNS = ['id', 'retweet_count', 'favorite_count',
+                   'user_followers_count']
+
+# Score of each tweet for each ranking. Follower weighted engagement adds up
+# the retweets and favorites of a tweet and multiplies them by the log of
+# the followers of its author, so engagement from large audiences ranks
+# higher without letting the number of followers alone decide the order.
+METRICS = {
+    'retweets': lambda df: df['retweet_count'].values,
+    'favorites': lambda df: df['favorite_count'].values,
+    'weighted_engagement': lambda df: (
+        df['retweet_count'].values + df['favorite_count'].values) *
+        np.log1p(df['user_followers_count'].clip(lower=0).values),
+}
+
+
+def top_k(scores, k):
+    """
+    Returns the positions of the k highest scores, highest first, without
+    sorting every score: the k highest are selected with argpartition in
+    linear time and only they are sorted. Ties are ordered by position.
+    Args:
+        - scores (array): Score of each tweet
+        - k (int): Number of positions returned. If None or larger than the
+            number of scores, every position is returned.
+    Returns:
+        - positions (array): Positions of the k highest scores
+    """
+    scores = np.asarray(scores, dtype=float)
+    n = scores.shape[0]
+    if k is None or k >= n:
+        candidates = np.arange(n)
+    else:
+        candidates = np.argpartition(-scores, int(k) - 1)[:int(k)]
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order]
+
+
+def rank_tweets(df, top_k_tweets=1000, metrics=None):
+    """
+    Ranks the tweets by several metrics over the same columns, keeping only
+    the ids and scores of the top tweets of each ranking.
+    Args:
+        - df (df): Clean data with the columns in RANKING_COLUMNS
+        - top_k_tweets (int): Number of tweets kept per ranking. If None,
+            every tweet is kept.
+        - metrics (list): Names of the rankings, keys of METRICS. Defaults
+            to every ranking.
+    Returns:
+        - rankings (df): Columns metric, rank (1 is the top tweet), id, and
+            score, one row per tweet ranked by each metric
+    """
+    metrics = list(METRICS) if metrics is None else metrics
+    # A tweet saved twice is ranked once, with its latest counts
+    df = df.dropna(subset=['id']).drop_duplicates('id', keep='last')
+    counts = df[RANKING_COLUMNS[1:]].fillna(0)
+    ids = df['id'].astype(str).values
+    rankings = []
+    for metric in metrics:
+        scores = METRICS[metric](counts)
+        positions = top_k(scores, top_k_tweets)
+        rankings.append(pd.DataFrame({
+            'metric': metric,
+            'rank': np.arange(1, positions.shape[0] + 1),
+            'id': ids[positions],
+            'score': scores[positions]}))
+    if not rankings:
+        return pd.DataFrame(columns=['metric', 'rank', 'id', 'score'])
+    return pd.concat(rankings, ignore_index=True)
+
+
+def ranked_tweets(rankings, clean_data, metric='retweets'):
+    """
+    Returns the rows of the clean data of the tweets of a ranking, in the
+    order of the ranking.
+    Args:
+        - rankings (df): Rankings returned by rank_tweets
+        - clean_data (df): Clean data, with the ids as strings
+        - metric (str): Name of the ranking
+    Returns:
+        - df (df): Rank, score, and the columns of the clean data
+    """
+    ranking = rankings[rankings.metric == metric][['rank', 'id', 'score']]
+    clean_data = clean_data.assign(id=clean_data['id'].astype(str))
+    return ranking.assign(id=ranking['id'].astype(str))\
+        .merge(clean_data, on='id', how='left')\
+        .sort_values('rank').reset_index(drop=True)
@@ -0,0 +1,298 @@
+import datetime
+import os
+import numpy as np
+import pandas as pd
+from scraper.api import lookup_statuses
+from scraper.instrument import INSTRUMENT, instrumented
+from scraper.ranking import RANKING_COLUMNS, rank_tweets
+from scraper.save import Save
+
+
+class EngagementRefresh(object):
+    """
+    Updates the retweet and favorite counts of the tweets already stored,
+    without hydrating every tweet again. Tweets are refreshed by priority
+    within a budget of API calls per run: the priority of a tweet is how
+    fast it gained engagement, per day, the last time it was seen, decayed
+    by its age with a half life, so recent and fast-growing tweets are
+    refreshed first. Tweets refreshed less than min_interval hours ago are
+    skipped.
+
+    The counts are updated in place in df_raw.csv and df_clean.csv, the
+    rows of grouped_date affected by the new counts are fixed up without
+    running Transform again, and the rankings are computed again. The time
+    and rate of each refresh are saved in .raw_data/refresh_state.csv.
+    Args:
+        - keyword (str): Hashtag, Twitter account, or query
+        - api (object): Client with a statuses_lookup method
+        - save_path (str): Path where data is saved
+        - budget (int): API calls per run. Each call refreshes 100 tweets.
+        - half_life (float): Days after which the priority of a tweet is
+            halved
+        - min_interval (float): Hours before a tweet can be refreshed again
+        - max_retries (int): Times an API call is retried after an error
+        - rate_limit_wait (float): Seconds to wait when the API rate limit
+            is reached
+        - top_k (int): Tweets kept in each ranking, like in Transform. If
+            None or 0, every tweet is kept.
+    """
+    def __init__(self, keyword, api, save_path='data', budget=10,
+                 half_life=3, min_interval=6, max_retries=3,
+                 rate_limit_wait=900, top_k=1000):
+        self.keyword = keyword
+        self.api = api
+        self.save_path = save_path
+        self.budget = int(budget)
+        self.half_life = float(half_life)
+        self.min_interval = float(min_interval)
+        self.max_retries = int(max_retries)
+        self.rate_limit_wait = float(rate_limit_wait)
+        self.top_k = int(top_k) if top_k else None
+        folder = f'{os.path.expanduser(save_path)}/{keyword}'
+        self.path_raw_data = f'{folder}/.raw_data/df_raw.csv'
+        self.clean_data_path = f'{folder}/clean_data/df_clean.csv'
+        self.state_path = f'{folder}/.raw_data/refresh_state.csv'
+        self.grouped_date_path = f'{folder}/grouped_date/grouped_date.csv'
+        self.tweets_sorted_path = f'{folder}/tweets_sorted_by_retweets/' \
+                                  f'tweets_sorted_by_retweets.csv'
+        self.rankings_path = f'{folder}/rankings/rankings.csv'
+
+    @staticmethod
+    def _utc(now):
+        now = pd.Timestamp(now or datetime.datetime.utcnow())
+        return now.tz_localize('UTC') if now.tzinfo is None \
+            else now.tz_convert('UTC')
+
+    def _read_state(self):
+        try:
+            return pd.read_csv(self.state_path, dtype={'id': str},
+                               parse_dates=['refreshed_at'])
+        except (FileNotFoundError, pd.errors.EmptyDataError):
+            return pd.DataFrame({'id': pd.Series(dtype=str),
+                                 'refreshed_at': pd.Series(
+                                     dtype='datetime64[ns, UTC]'),
+                                 'engagement_rate': pd.Series(dtype=float)})
+
+    def get_priorities(self, now=None):
+        """
+        Returns the priority of the tweets that can be refreshed.
+        Args:
+            - now (datetime): Time of the refresh, in UTC. Defaults to now.
+        Returns:
+            - df (df): Columns id, priority, retweet_count, and
+                favorite_count
+        """
+        now = self._utc(now)
+        df = pd.read_csv(self.clean_data_path,
+                         usecols=['id', 'ts', 'retweet_count',
+                                  'favorite_count'],
+                         dtype={'id': str})
+        INSTRUMENT.set_rows_in(df.shape[0])
+        # A tweet saved twice in the clean data is refreshed once, with its
+        # latest counts
+        df = df.drop_duplicates('id', keep='last')
+        df['ts'] = pd.to_datetime(df['ts'], utc=True)
+        age_days = ((now - df['ts']).dt.total_seconds() / 86400).clip(
+            lower=1 / 24)
+
+        # Tweets never refreshed gained their engagement since they were
+        # published
+        state = self._read_state().drop_duplicates('id', keep='last')\
+            .set_index('id')
+        rate = df['id'].map(state['engagement_rate'])
+        lifetime_rate = (df['retweet_count'] + df['favorite_count']) / \
+            age_days
+        rate = rate.fillna(lifetime_rate)
+
+        df['priority'] = (1 + rate) * 0.5 ** (age_days / self.half_life)
+
+        # Skip the tweets refreshed recently
+        refreshed_at = df['id'].map(state['refreshed_at'])
+        recent = (now - refreshed_at).dt.total_seconds() < \
+            self.min_interval * 3600
+        df = df[~recent.fillna(False)]
+        return df[['id', 'priority', 'retweet_count', 'favorite_count']]
+
+    def _select(self, df):
+        # Only the tweets that fit in the budget are sorted
+        return df.nlargest(self.budget * 100, 'priority')
+
+    def _hydrate(self, ids):
+        counts = []
+        for floor in range(0, len(ids), 100):
+            batch = ids[floor:floor + 100]
+            with INSTRUMENT.stage('api_batch', rows_in=len(batch),
+                                  keyword=self.keyword) as record:
+                response = lookup_statuses(
+                    self.api, batch, max_retries=self.max_retries,
+                    rate_limit_wait=self.rate_limit_wait)
+                counts += [{'id': tweet._json['id_str'],
+                            'retweet_count': tweet._json['retweet_count'],
+                            'favorite_count': tweet._json['favorite_count']}
+                           for tweet in response]
+                record['rows_out'] = len(response)
+        return pd.DataFrame(counts, columns=['id', 'retweet_count',
+                                             'favorite_count'])\
+            .drop_duplicates('id')
+
+    @staticmethod
+    def _update_counts(df, id_col, updates):
+        # The files are read as strings, so the columns not updated are
+        # written back exactly as they were
+        new = updates.set_index('id')
+        mask = df[id_col].isin(new.index)
+        for column in ['retweet_count', 'favorite_count']:
+            df.loc[mask, column] = df.loc[mask, id_col]\
+                .map(new[column]).astype(int).astype(str)
+        return df
+
+    def _update_raw_data(self, updates):
+        df = pd.read_csv(self.path_raw_data, dtype=str, keep_default_na=False,
+                         engine='python')
+        df = self._update_counts(df, 'id_str', updates)
+        Save(df, self.save_path, self.keyword, '.raw_data', 'df_raw',
+             True).save_data()
+
+    def _update_clean_data(self, updates):
+        """
+        Updates df_clean.csv and returns the change of the counts of each
+        tweet, with its date.
+        """
+        df = pd.read_csv(self.clean_data_path, dtype=str,
+                         keep_default_na=False)
+        old = df[df.id.isin(updates.id)][
+            ['id', 'date', 'retweet_count', 'favorite_count']]
+        df = self._update_counts(df, 'id', updates)
+        Save(df, self.save_path, self.keyword, 'clean_data', 'df_clean',
+             True).save_data()
+
+        changes = old.merge(updates, on='id', suffixes=('_old', ''))
+        for column in ['retweet_count', 'favorite_count']:
+            changes[f'{column}_delta'] = changes[column] - \
+                pd.to_numeric(changes[f'{column}_old'])
+        return changes
+
+    def _update_grouped_date(self, changes):
+        # Add the change of the counts to the dates of the tweets refreshed
+        if not os.path.exists(self.grouped_date_path):
+            return
+        df = pd.read_csv(self.grouped_date_path)
+        deltas = changes.groupby('date')[
+            ['retweet_count_delta', 'favorite_count_delta']].sum()
+        dates = pd.to_datetime(df['date']).dt.strftime('%Y-%m-%d')
+        for column in ['retweet_count', 'favorite_count']:
+            df[column] += dates.map(deltas[f'{column}_delta'])\
+                .fillna(0).astype(df[column].dtype)
+        Save(df, self.save_path, self.keyword, 'grouped_date',
+             'grouped_date', True).save_data()
+
+    def _update_tweets_sorted(self, updates):
+        """
+        Moves the tweets refreshed to their new position in the list of
+        tweets sorted by retweets, without sorting the other tweets again.
+        Transform saves the rankings instead of this list, so only the
+        folders of keywords transformed before the rankings have it.
+        """
+        if not os.path.exists(self.tweets_sorted_path):
+            return
+        df = pd.read_csv(self.tweets_sorted_path, dtype={'id': str})
+        if 'id' not in df.columns:
+            # Saved before the list had tweet ids, so it is rebuilt
+            from scraper.transform import Transform
+            Transform(self.keyword, self.save_path)\
+                .get_df_tweets_sorted_by_retweets()
+            return
+
+        df = self._update_counts(df, 'id', updates)
+        for column in ['retweet_count', 'favorite_count']:
+            df[column] = df[column].astype(int)
+        retweets = df.retweet_count.values
+        changed = df.id.isin(updates.id).values
+        kept = np.flatnonzero(~changed)
+        moved = np.flatnonzero(changed)
+        moved = moved[np.argsort(-retweets[moved], kind='stable')]
+
+        # Binary search of the position of each tweet moved in the tweets
+        # kept, which are still sorted in descending order
+        positions = np.searchsorted(-retweets[kept], -retweets[moved],
+                                    side='left')
+        df = df.iloc[np.insert(kept, positions, moved)]\
+            .reset_index(drop=True)
+        Save(df, self.save_path, self.keyword, 'tweets_sorted_by_retweets',
+             'tweets_sorted_by_retweets', True).save_data()
+
+    def _update_rankings(self):
+        # Tweets outside the top of a ranking can enter it with their new
+        # counts, so the rankings are computed again from the clean data,
+        # which only needs the ids and counts
+        if not os.path.exists(self.rankings_path):
+            return
+        df = pd.read_csv(self.clean_data_path, usecols=RANKING_COLUMNS,
+                         dtype={'id': str})
+        Save(rank_tweets(df, self.top_k), self.save_path, self.keyword,
+             'rankings', 'rankings', True).save_data()
+
+    def _save_state(self, refreshed, now):
+        state = self._read_state()
+        state = pd.concat([state, refreshed], ignore_index=True)\
+            .drop_duplicates('id', keep='last')
+        folder = os.path.dirname(self.state_path)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        state.to_csv(self.state_path, index=False)
+
+    @instrumented
+    def refresh(self, now=None):
+        """
+        Refreshes the counts of the tweets with the highest priority.
+        Args:
+            - now (datetime): Time of the refresh, in UTC. Defaults to now.
+        Returns:
+            - summary (dict): Number of tweets requested, refreshed, and
+                changed, and the API calls made
+        """
+        now = self._utc(now)
+        candidates = self._select(self.get_priorities(now))
+        ids = candidates.id.tolist()
+        summary = {'requested': len(ids), 'refreshed': 0, 'changed': 0,
+                   'api_calls': -(-len(ids) // 100)}
+        if not ids:
+            return summary
+
+        updates = self._hydrate(ids)
+        summary['refreshed'] = updates.shape[0]
+        if updates.empty:
+            return summary
+
+        # Engagement gained per day since the tweet was last seen
+        state = self._read_state().drop_duplicates('id', keep='last')\
+            .set_index('id')
+        clean = pd.read_csv(self.clean_data_path, usecols=['id', 'ts'],
+                            dtype={'id': str})\
+            .drop_duplicates('id', keep='last').set_index('id')
+        last_seen = updates.id.map(state['refreshed_at'])\
+            .fillna(pd.to_datetime(updates.id.map(clean['ts']), utc=True))
+        days = ((now - last_seen).dt.total_seconds() / 86400).clip(
+            lower=1 / 24)
+        old = candidates.set_index('id').loc[updates.id]
+        gained = (updates.retweet_count.values +
+                  updates.favorite_count.values -
+                  old.retweet_count.values - old.favorite_count.values)
+        refreshed = pd.DataFrame({'id': updates.id.values,
+                                  'refreshed_at': now,
+                                  'engagement_rate': np.clip(
+                                      gained / days.values, 0, None)})
+
+        changed = updates[(updates.retweet_count.values !=
+                           old.retweet_count.values) |
+                          (updates.favorite_count.values !=
+                           old.favorite_count.values)]
+        summary['changed'] = changed.shape[0]
+        if not changed.empty:
+            self._update_raw_data(changed)
+            changes = self._update_clean_data(changed)
+            self._update_grouped_date(changes)
+            self._update_tweets_sorted(changed)
+            self._update_rankings()
+        self._save_state(refreshed, now)
+        return summary
@@ -1,5 +1,6 @@
 import pandas as pd
 import os
+from scraper.instrument import INSTRUMENT
 
 
 class Save(object):
@@ -27,6 +28,12 @@ class Save(object):
         self.save_filename = f'{self.save_path}/{filename}.csv'
 
     def save_data(self):
+        with INSTRUMENT.stage('save', rows_in=self.data.shape[0],
+                              filename=self.save_filename) as record:
+            self._save_data()
+            record['rows_out'] = self.data.shape[0]
+
+    def _save_data(self):
         # Check argument "replace". If True, just replace dataframe with
         # new dataframe, but if False, update current dataframe with new
         # dataframe
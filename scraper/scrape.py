@@ -1,18 +1,130 @@
+import calendar
 import datetime
 import os
-import tweepy
+import queue
+import re
+import threading
+from scraper.api import lookup_statuses, new_api
 from scraper.save import Save
+from scraper.index import IdIndex
+from scraper.instrument import INSTRUMENT, instrumented
+from scraper.slicer import AdaptiveSlicer
 from selenium import webdriver
 from time import sleep
+import time
 import pickle5 as pickle
 import json
 import pandas as pd
 
 
+# Tweet ids in the URLs of the anchors, e.g. /user/status/123/photo/1
+STATUS_ID_RE = re.compile(r'/status/(\d+)')
+
+# Returns the href of every status anchor not returned by a previous call,
+# and marks the anchors, so each scroll only transfers the new anchors in
+# one WebDriver round trip
+NEW_STATUS_HREFS_JS = """
+var anchors = document.querySelectorAll(
+  'a[href*="/status/"]:not([data-scraper-seen])');
+var hrefs = new Array(anchors.length);
+for (var i = 0; i < anchors.length; i++) {
+  anchors[i].setAttribute('data-scraper-seen', '');
+  hrefs[i] = anchors[i].href;
+}
+return hrefs;
+"""
+
+
+def parse_status_ids(hrefs):
+    """
+    Returns the tweet ids found in a list of URLs, without duplicates and
+    in the order they were found.
+    """
+    matches = (STATUS_ID_RE.search(href) for href in hrefs if href)
+    return list(dict.fromkeys(match.group(1) for match in matches if match))
+
+
+def new_status_ids(driver):
+    """
+    Returns the tweet ids of the status anchors added to the page since the
+    last call with the same driver and page.
+    """
+    return parse_status_ids(driver.execute_script(NEW_STATUS_HREFS_JS))
+
+
+def new_driver(chromedriver_path):
+    # Start a headless Chrome session
+    chrome_options = webdriver.ChromeOptions()
+    chrome_options.add_argument('--no-sandbox')
+    chrome_options.add_argument('--headless')
+    chrome_options.add_argument('--disable-gpu')
+    chrome_options.add_argument('--disable-dev-shm-usage')
+    with INSTRUMENT.stage('driver_launch'):
+        return webdriver.Chrome(executable_path=chromedriver_path,
+                                chrome_options=chrome_options)
+
+
+class DriverPool(object):
+    """
+    Reuses Chrome sessions across days and keywords instead of launching a
+    new browser for every day. Sessions are created on demand, up to size,
+    and acquire blocks until one is free when all of them are in use.
+    Args:
+        - chromedriver_path (str): Path to the chromedriver executable
+        - size (int): Maximum number of Chrome sessions
+    """
+    def __init__(self, chromedriver_path='/usr/local/bin/chromedriver',
+                 size=2):
+        self.chromedriver_path = chromedriver_path
+        self.size = int(size)
+        self._idle = queue.Queue()
+        self._drivers = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = len(self._drivers) < self.size
+            if create:
+                # Reserve the slot before launching the browser
+                self._drivers.append(None)
+        if not create:
+            return self._idle.get()
+        try:
+            driver = new_driver(self.chromedriver_path)
+        except Exception:
+            with self._lock:
+                self._drivers.remove(None)
+            raise
+        with self._lock:
+            self._drivers[self._drivers.index(None)] = driver
+        return driver
+
+    def release(self, driver):
+        self._idle.put(driver)
+
+    def close(self):
+        with self._lock:
+            drivers = [driver for driver in self._drivers
+                       if driver is not None]
+            self._drivers = []
+        for driver in drivers:
+            driver.quit()
+
+
 class Scrape(object):
 
-    def __init__(self, keyword, start, end, keyword_type, keys_path,
-                 delay=1, chromedriver_path='/usr/local/bin/chromedriver'):
+    def __init__(self, keyword, start, end, keyword_type, keys_path=None,
+                 delay=1, chromedriver_path='/usr/local/bin/chromedriver',
+                 global_index=False, base_url='https://twitter.com', api=None,
+                 max_retries=3, rate_limit_wait=900, driver_pool=None,
+                 hydration_cache=None, engine='selenium', max_concurrency=8,
+                 max_empty_scrolls=1, max_scrolls=None, day_time_budget=None,
+                 split_scrolls=None, split_rate=None, window_workers=1,
+                 max_drivers=2):
         """
         Collects all tweet ids published in a given time frame that include a
         given keyword or hashtag, or published by a given account, depending
@@ -32,6 +144,47 @@ class Scrape(object):
                 Format: 'YYYY-MM-DD'
             - keyword_type (str): it can be 'hashtag', 'query', or 'account'.
             - save_path (str): path where the program will save the Twitter ids.
+            - global_index (bool): if True, tweets already stored by another
+                keyword are copied from its raw data instead of being
+                hydrated again with the API. They are still stored for this
+                keyword.
+            - base_url (str): URL of the site searched for tweet ids, e.g. the
+                URL of a FakeTwitterServer for load tests.
+            - api (object): client with a statuses_lookup method, e.g. a
+                FakeStatusesAPI. If None, a tweepy client is created with the
+                keys in keys_path.
+            - max_retries (int): times an API batch is retried after an error.
+            - rate_limit_wait (int): seconds to wait when the API rate limit
+                is reached.
+            - driver_pool (DriverPool): pool of Chrome sessions shared with
+                other scrapers. If None, each day opens and closes its own
+                session.
+            - hydration_cache (cache.LRUCache): tweet JSON by tweet id shared
+                with other scrapers, so tweets found by several keywords are
+                only requested once to the API. Bounded, so a long running
+                worker doesn't keep every tweet it hydrated in memory.
+            - engine (str): how the ids are collected. 'selenium' collects
+                one day after the other, 'async_browser' collects up to
+                max_concurrency days at the same time with Selenium, and
+                'async_http' fetches the JSON pages of the search endpoint
+                over plain HTTP, e.g. from a FakeTwitterServer.
+            - max_concurrency (int): maximum number of days collected at the
+                same time by the async engines.
+            - max_empty_scrolls (int): scrolls in a row without new tweet ids
+                after which the collection of a day stops.
+            - max_scrolls (int): maximum number of scrolls per day. If None,
+                there is no limit.
+            - day_time_budget (float): maximum seconds spent collecting one
+                day or time window. If None, there is no limit.
+            - split_scrolls (int): scrolls after which a busy day is split in
+                smaller time windows. If None (the default) or 0, days are
+                not split because of their scrolls.
+            - split_rate (float): ids per hour above which a day or window is
+                split. If None, days are not split because of their rate.
+            - window_workers (int): time windows of a busy day collected at
+                the same time. Only useful with a driver_pool.
+            - max_drivers (int): Chrome sessions of the pool opened by the
+                'async_browser' engine when no driver_pool is given.
         """
         # Set URL parameters
         self.start = start
@@ -41,20 +194,96 @@ class Scrape(object):
         self.delay = int(delay)
         self.save_path = os.path.expanduser('data')
         self.chromedriver_path = chromedriver_path
+        self.base_url = base_url.rstrip('/')
+        self.api = api
+        self.max_retries = int(max_retries)
+        self.rate_limit_wait = float(rate_limit_wait)
+        self.driver_pool = driver_pool
+        self.hydration_cache = hydration_cache
+        self.engine = engine
+        self.max_concurrency = int(max_concurrency)
+        self.max_empty_scrolls = max(int(max_empty_scrolls), 1)
+        self.max_scrolls = int(max_scrolls) if max_scrolls is not None \
+            else None
+        self.day_time_budget = float(day_time_budget) \
+            if day_time_budget is not None else None
+        self.split_scrolls = int(split_scrolls) if split_scrolls else None
+        self.split_rate = float(split_rate) if split_rate else None
+        self.window_workers = int(window_workers)
+        self.max_drivers = int(max_drivers)
 
-        # Get twitter keys
-        with open(keys_path, 'r') as file:
-            keys = json.load(file)
-        self.consumer_key = keys['consumer_key']
-        self.consumer_secret = keys['consumer_secret']
-        self.access_token = keys['access_token']
-        self.access_token_secret = keys['access_token_secret']
+        # Get twitter keys, which are only needed if no API client was given
+        if api is None:
+            with open(keys_path, 'r') as file:
+                keys = json.load(file)
+            self.consumer_key = keys['consumer_key']
+            self.consumer_secret = keys['consumer_secret']
+            self.access_token = keys['access_token']
+            self.access_token_secret = keys['access_token_secret']
 
         # Create a new directory to save raw data if it doesn't exist
         self.path_raw_data = f"{self.save_path}/{self.keyword}/.raw_data"
         if not os.path.exists(self.path_raw_data):
             os.makedirs(self.path_raw_data)
 
+        # Index of tweet ids already stored for this keyword, so they are
+        # never scraped, hydrated, or appended to its raw data again, and
+        # index of the keyword that stored each tweet, so tweets stored by
+        # other keywords are copied instead of hydrated
+        self.index = IdIndex(self.save_path, self.keyword)
+        self.global_index = IdIndex(self.save_path) if global_index else None
+
+        # Counts of ids and scrolls of each day collected, also saved in
+        # day_stats.json. Days can be collected by several threads.
+        self.day_stats = {}
+        self._stats_lock = threading.Lock()
+        stats_path = f'{self.path_raw_data}/day_stats.json'
+        if os.path.exists(stats_path):
+            with open(stats_path, 'r') as file:
+                self.day_stats = json.load(file)
+
+    def _filter_stored_ids(self, ids):
+        """
+        Removes the tweet ids that were already stored in the raw data of
+        this keyword.
+        Args:
+            - ids (list): Tweet ids
+        Returns:
+            - ids (list): Deduplicated tweet ids that are not stored yet
+        """
+        return self.index.filter_new(ids)
+
+    def _copy_stored_tweets(self, ids):
+        """
+        Reads the raw data of the tweets stored by other keywords, according
+        to the global index.
+        Args:
+            - ids (list): Tweet ids not stored for this keyword yet
+        Returns:
+            - df (df): Raw data of the tweets found, as saved in df_raw.csv
+        """
+        stored = self.global_index.keywords_of(ids)
+        by_keyword = {}
+        for tweet_id, keyword in stored.items():
+            if keyword is not None and keyword != self.keyword:
+                by_keyword.setdefault(keyword, set()).add(tweet_id)
+
+        # Rows are read as strings, so they are written back exactly as they
+        # were saved by the other keyword
+        frames = []
+        for keyword, keyword_ids in by_keyword.items():
+            path = f'{self.save_path}/{keyword}/.raw_data/df_raw.csv'
+            try:
+                for chunk in pd.read_csv(path, dtype=str, chunksize=100000):
+                    frames.append(chunk[chunk.id_str.isin(keyword_ids)])
+            except (FileNotFoundError, pd.errors.EmptyDataError):
+                continue
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True, sort=False)\
+            .drop_duplicates(subset=['id_str'])
+
+    @instrumented
     def get_metadata(self):
         """
         Gets metadata for all of the Twitter ids extracted by extract_all_ids.
@@ -76,12 +305,38 @@ class Scrape(object):
                 ids = list(set([item for sublist in list_of_lists
                                 if not not sublist for item in sublist]))
 
+        # Skip ids whose metadata is already in the raw data
+        ids = self._filter_stored_ids(ids)
+        if not ids:
+            return "All tweet ids were already stored"
+
         print('Total ids to be processed: {}'.format(len(ids)))
+        INSTRUMENT.set_rows_in(len(ids))
+
+        # Tweets stored by other keywords are copied from their raw data
+        df_copied = pd.DataFrame()
+        if self.global_index is not None:
+            df_copied = self._copy_stored_tweets(ids)
+            if not df_copied.empty:
+                copied = set(df_copied.id_str)
+                ids = [tweet_id for tweet_id in ids if tweet_id not in copied]
+                print(f'{len(copied)} ids copied from other keywords')
 
-        # Set credentials
-        auth = tweepy.OAuthHandler(self.consumer_key, self.consumer_secret)
-        auth.set_access_token(self.access_token, self.access_token_secret)
-        api = tweepy.API(auth)
+        # Tweets already hydrated by other keywords of the same batch are
+        # taken from the cache
+        all_data = []
+        if self.hydration_cache is not None:
+            missing = []
+            for tweet_id in ids:
+                found, tweet = self.hydration_cache.get(tweet_id)
+                if found:
+                    all_data.append(tweet)
+                else:
+                    missing.append(tweet_id)
+            ids = missing
+            print(f'{len(all_data)} ids found in the hydration cache')
+
+        api = self._get_api() if ids else None
 
         # Set batch list to only call the API once every 100 ids
         floor_batch_lst = list(range(0, len(ids), 100))
@@ -89,152 +344,331 @@ class Scrape(object):
         batch_list = [(i, i+100) if i+100 < total_ids else (i, total_ids)
                       for i in floor_batch_lst]
 
-        all_data = []
         for floor, ceil in batch_list:
             print(f'Currently getting {floor} - {ceil} ids out of {total_ids}')
             ids_batch = ids[floor:ceil]
-            response = api.statuses_lookup(ids_batch, tweet_mode='extended')
-            # Getting tweet in JSON format uses private attribute and may
-            # break in the future
-            tweets = [dict(tweet._json) for tweet in response]
+            with INSTRUMENT.stage('api_batch', rows_in=len(ids_batch),
+                                  keyword=self.keyword) as record:
+                response = self._lookup_batch(api, ids_batch)
+                # Getting tweet in JSON format uses private attribute and may
+                # break in the future
+                tweets = [dict(tweet._json) for tweet in response]
+                record['rows_out'] = len(tweets)
             all_data += tweets
+            if self.hydration_cache is not None:
+                for tweet in tweets:
+                    self.hydration_cache.put(tweet['id_str'], tweet)
         print('Metadata collection complete!')
 
+        if not all_data and df_copied.empty:
+            return "The API didn't return metadata for the tweet ids"
+
         # Metadata comes in JSON format, so we convert it to CSV and also drop
         # observations without tweet id
-        df = pd.DataFrame(all_data).dropna(subset=['entities'])
+        df = pd.DataFrame(all_data)
+        if not df.empty:
+            df = df.dropna(subset=['entities'])
+        df = pd.concat([df, df_copied], ignore_index=True, sort=False)
+        if df.empty:
+            return "The API didn't return metadata for the tweet ids"
+
+        # The API can return the same tweet more than once, and another run
+        # may have stored some of these tweets in the meantime
+        df = df.drop_duplicates(subset=['id_str'])
+        df = df[df.id_str.isin(self._filter_stored_ids(df.id_str))]
         save_data = Save(
             df, self.save_path, self.keyword, '.raw_data', 'df_raw', False)
         save_data.save_data()
 
-    def extract_all_ids(self):
-        # Convert dates to datetime to manipulate them more easily
+        # Register the stored ids after saving, so a crash in between only
+        # means they are hydrated again in the next run
+        self.index.add(df.id_str)
+        if self.global_index is not None:
+            self.global_index.add(df.id_str, keyword=self.keyword)
+
+    def _get_api(self):
+        if self.api is None:
+            # Set credentials
+            self.api = new_api({
+                'consumer_key': self.consumer_key,
+                'consumer_secret': self.consumer_secret,
+                'access_token': self.access_token,
+                'access_token_secret': self.access_token_secret
+            })
+        return self.api
+
+    def _lookup_batch(self, api, ids_batch):
+        return lookup_statuses(api, ids_batch, max_retries=self.max_retries,
+                               rate_limit_wait=self.rate_limit_wait,
+                               delay=self.delay)
+
+    def _days(self):
+        # Dates between start and end, end excluded
         start_date = datetime.datetime.strptime(self.start, '%Y-%m-%d')
         final_date = datetime.datetime.strptime(self.end, '%Y-%m-%d')
+        days = []
+        while start_date.date() < final_date.date():
+            days.append(str(start_date.date()))
+            start_date += datetime.timedelta(days=1)
+        return days
 
-        # Iterate over each day between start_date and end_date
+    def _append_ids(self, new_ids):
+        """
+        Appends the ids of one day to the pickle file, after dropping the ids
+        already stored in the raw data.
+        """
+        # Load previously saved ids if available. If note, start from zero
         ids_pickle_path = f"{self.path_raw_data}/ids.pickle"
-        while str(start_date.date()) != str(final_date.date()):
-            # Load previously saved ids if available. If note, start from zero
-            if os.path.exists(ids_pickle_path):
-                with open(ids_pickle_path, 'rb') as handle:
-                    ids = pickle.load(handle)
-            else:
-                ids = []
-            # Get ids
-            new_ids = self._extract_ids_from_one_day(str(start_date.date()))
-            # Append new ids found
-            ids.append(new_ids)
-            # Update pickle file with new ids
-            with open(f'{self.path_raw_data}/ids.pickle', 'wb') as handle:
-                pickle.dump(ids, handle, protocol=pickle.HIGHEST_PROTOCOL)
-            # Increment start_date by one day
-            start_date += datetime.timedelta(days=1)
+        if os.path.exists(ids_pickle_path):
+            with open(ids_pickle_path, 'rb') as handle:
+                ids = pickle.load(handle)
+        else:
+            ids = []
+        if new_ids:
+            new_ids = self._filter_stored_ids(new_ids)
+        # Append new ids found
+        ids.append(new_ids)
+        # Update pickle file with new ids
+        with open(ids_pickle_path, 'wb') as handle:
+            pickle.dump(ids, handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @instrumented
+    def extract_all_ids(self):
+        days = self._days()
+        if self.engine in ['async_http', 'async_browser']:
+            from scraper.collector import AsyncCollector
+            # Days are saved as soon as they are complete, in any order
+            # Without a shared pool, the days collected at the same time
+            # share max_drivers Chrome sessions instead of one each. No more
+            # days than sessions are in flight, so no day waits for a
+            # session of the pool when it is closed after an error.
+            own_pool = self.engine == 'async_browser' and \
+                self.driver_pool is None
+            max_concurrency = min(self.max_concurrency, self.max_drivers) \
+                if own_pool else self.max_concurrency
+            collector = AsyncCollector(self, mode=self.engine[len('async_'):],
+                                       max_concurrency=max_concurrency)
+            if own_pool:
+                self.driver_pool = DriverPool(self.chromedriver_path,
+                                              size=self.max_drivers)
+            try:
+                collector.run(days,
+                              on_day=lambda day, ids: self._append_ids(ids))
+            finally:
+                if own_pool:
+                    self.driver_pool.close()
+                    self.driver_pool = None
+            return
+
+        # Iterate over each day between start_date and end_date
+        for day in days:
+            self._append_ids(self._extract_ids_from_one_day(day))
 
+    @instrumented
     def _extract_ids_from_one_day(self, start_date):
         """
         Get ids of all tweets posted on a given date defined by the start_date
-        parameter.
+        parameter. Busy days are split in smaller time windows, see
+        AdaptiveSlicer.
         Args:
             - start_date (str): The date of interest to extract data.
                 Format: 'YYYY-MM-DD'
         Returns:
             - ids (list): The list of ids published on the start_date.
         """
-        # Generate URL using the keyword and the lower and upper date bounds
-        until = (datetime.datetime.strptime(start_date, '%Y-%m-%d') +
-                 datetime.timedelta(days=1)).strftime('%Y-%m-%d')
-        url = self._form_url(keyword_type=self.keyword_type, since=start_date,
+        since = datetime.datetime.strptime(start_date, '%Y-%m-%d')
+        until = since + datetime.timedelta(days=1)
+        if self.split_scrolls is None and self.split_rate is None:
+            return self._collect_window(since, until)[0]
+
+        slicer = AdaptiveSlicer(self._collect_window,
+                                split_scrolls=self.split_scrolls,
+                                split_rate=self.split_rate,
+                                max_workers=self.window_workers)
+        return slicer.collect(since, until)
+
+    def _collect_window(self, since, until, max_scrolls=None):
+        """
+        Get ids of all tweets posted in a time window.
+        Args:
+            - since (datetime): Start of the window
+            - until (datetime): End of the window, excluded
+            - max_scrolls (int): Maximum number of scrolls, on top of the
+                max_scrolls of the scraper. If None, there is no limit.
+        Returns:
+            - ids (list): The list of ids published in the window
+            - stats (dict): Counts of ids and scrolls of the window
+        """
+        # Whole days are searched by date, and smaller windows by time
+        if since.time() == datetime.time() and \
+                until - since == datetime.timedelta(days=1):
+            label = str(since.date())
+            since, until = label, str(until.date())
+        else:
+            label = f"{since.strftime('%Y-%m-%dT%H:%M:%S')}/" \
+                    f"{until.strftime('%Y-%m-%dT%H:%M:%S')}"
+
+        # Generate URL using the keyword and the lower and upper bounds
+        url = self._form_url(keyword_type=self.keyword_type, since=since,
                              until=until, keyword=self.keyword)
-        print(f"Getting data from {start_date} until {until} for "
+        print(f"Getting data from {since} until {until} for "
               f"keyword {self.keyword} with URL...\n{url}")
 
-        # Start session, open URL, and give it a few seconds to load
-        chrome_options = webdriver.ChromeOptions()
-        chrome_options.add_argument('--no-sandbox')
-        chrome_options.add_argument('--headless')
-        chrome_options.add_argument('--disable-gpu')
-        chrome_options.add_argument('--disable-dev-shm-usage')
-        driver = webdriver.Chrome(executable_path=self.chromedriver_path,
-                                  chrome_options=chrome_options)
-        driver.get(url)
-        sleep(self.delay)
-
-        # Extract the ids of the first tweets. Also stop if no tweet is found
-        # that day. The Selenium object is found by looking for all href tags
-        # that contain the string '/status/'
-        ids = driver.find_elements_by_xpath('//a[contains(@href,"/status/")]')
-        ids = [self._parse_ids(element) for element in ids]
-        if len(ids) == 0:
+        # Start session, open URL, and give it a few seconds to load. The
+        # driver is always released, even if the page fails to load
+        stats = {'day': label, 'ids': 0, 'scrolls': 0,
+                 'empty_scrolls': 0, 'stop_reason': None}
+        started = time.perf_counter()
+        ids = {}
+        driver = self._acquire_driver()
+        try:
+            with INSTRUMENT.stage('page_load', keyword=self.keyword,
+                                  day=label):
+                driver.get(url)
+                sleep(self.delay)
+
+            # Ids are added to a dict, which keeps their order and is the
+            # set of ids seen in the window
+            for new_ids in self._stream_new_ids(driver, label, stats,
+                                                started, max_scrolls):
+                ids.update(dict.fromkeys(new_ids))
+        finally:
+            self._release_driver(driver)
+
+        stats['ids'] = len(ids)
+        stats['seconds'] = round(time.perf_counter() - started, 3)
+        self._record_day_stats(stats)
+        if not ids:
             print(f"There were no tweets posted by/with {self.keyword} "
-                  f"on {start_date}")
+                  f"from {since} until {until}")
+            return [], stats
+        print(f"We found {len(ids)} for the keyword {self.keyword} "
+              f"from {since} until {until} after {stats['scrolls']} "
+              f"scrolls ({stats['stop_reason']})\n")
+        return list(ids), stats
 
-            # Close driver
-            driver.quit()
+    def _stream_new_ids(self, driver, day, stats, started,
+                        max_scrolls=None):
+        """
+        Yields the ids found in the page loaded by the driver, first the ids
+        of the first tweets and then the new ids found after each scroll.
+        Only ids not yielded before are yielded. Scrolling stops after
+        max_empty_scrolls scrolls in a row without new ids, after
+        max_scrolls scrolls, or when the day has used day_time_budget
+        seconds.
+        Args:
+            - driver (webdriver): Session with the search page of the day
+            - day (str): Date or time window of the search
+            - stats (dict): Counts of the day, updated while scrolling
+            - started (float): time.perf_counter() when the day started
+            - max_scrolls (int): Maximum number of scrolls, on top of the
+                max_scrolls of the scraper
+        """
+        limits = [limit for limit in [self.max_scrolls, max_scrolls]
+                  if limit is not None]
+        max_scrolls = min(limits) if limits else None
+
+        # The ids are taken from all href tags that contain the string
+        # '/status/', and the script only returns the anchors not seen yet.
+        # Pages can render the same tweet again, so ids are also checked
+        # against the ids already yielded.
+        seen = set()
+
+        def new(ids):
+            ids = [tweet_id for tweet_id in ids if tweet_id not in seen]
+            seen.update(ids)
+            return ids
+
+        first_ids = new(new_status_ids(driver))
+        if not first_ids:
+            stats['stop_reason'] = 'no_tweets'
             return
+        yield first_ids
 
         # Scroll down to see if there were more tweets published that day
-        print('Scrolling down to get more tweets')
-        driver.execute_script('window.scrollTo(0, document.body.scrollHeight);')
-        sleep(self.delay)
-        next_ids = driver.find_elements_by_xpath(
-            '//a[contains(@href,"/status/")]')
-        next_ids = [self._parse_ids(element) for element in next_ids]
-
-        # Check if we got any new tweet ids after scrolling down. If we didn't
-        # continue scrolling down to until we don't get any new tweet id
-        new_tweets = set(next_ids) - set(ids)
-        while len(new_tweets) > 0:
-            # If we got new tweet ids, add them to the list
-            ids.extend(next_ids)
-            # Scroll down to continue checking if we can get additional
-            # tweet ids
+        while True:
+            if max_scrolls is not None and stats['scrolls'] >= max_scrolls:
+                stats['stop_reason'] = 'max_scrolls'
+                return
+            if self.day_time_budget is not None and \
+                    time.perf_counter() - started >= self.day_time_budget:
+                stats['stop_reason'] = 'time_budget'
+                return
+
             print('Scrolling down to get more tweets')
-            driver.execute_script(
-                'window.scrollTo(0, document.body.scrollHeight);')
-            sleep(self.delay)
-            next_ids = driver.find_elements_by_xpath(
-                '//a[contains(@href,"/status/")]')
-            next_ids = [self._parse_ids(element) for element in next_ids]
-            new_tweets = set(next_ids) - set(ids)
-
-        # Make sure we don't have duplicated tweet ids
-        ids = list(set(ids))
-        print(f"We found {len(ids)} for the keyword {self.keyword} "
-              f"from {start_date} until {until} \n")
+            with INSTRUMENT.stage('scroll', keyword=self.keyword,
+                                  day=day) as record:
+                driver.execute_script(
+                    'window.scrollTo(0, document.body.scrollHeight);')
+                sleep(self.delay)
+                next_ids = new(new_status_ids(driver))
+                record['rows_out'] = len(next_ids)
+            stats['scrolls'] += 1
+
+            if next_ids:
+                stats['empty_scrolls'] = 0
+                yield next_ids
+                continue
+            # Stop when several scrolls in a row bring no new tweet ids
+            stats['empty_scrolls'] += 1
+            if stats['empty_scrolls'] >= self.max_empty_scrolls:
+                stats['stop_reason'] = 'no_new_tweets'
+                return
+
+    def _record_day_stats(self, stats):
+        """
+        Saves the counts of ids and scrolls of each day in
+        data/<keyword>/.raw_data/day_stats.json, for monitoring.
+        """
+        with self._stats_lock:
+            self.day_stats[stats['day']] = stats
+            with open(f'{self.path_raw_data}/day_stats.json', 'w') as file:
+                json.dump(self.day_stats, file, indent=2, sort_keys=True)
 
-        # Close driver
-        driver.quit()
+    def _acquire_driver(self):
+        if self.driver_pool is not None:
+            return self.driver_pool.acquire()
+        return new_driver(self.chromedriver_path)
 
-        return ids
+    def _release_driver(self, driver):
+        if self.driver_pool is not None:
+            self.driver_pool.release(driver)
+        else:
+            driver.quit()
 
     def _form_url(self, keyword_type, since, until, keyword):
         """
         Generate the URL to extract all tweets posted with/by the given
-        keyword for a single date. The URL adapts if the keyword is a
-        query, hashtag, or account.
+        keyword for a single date or time window. The URL adapts if the
+        keyword is a query, hashtag, or account.
         Args:
-            - since (str): The date of interest to extract data.
-                Format: 'YYYY-MM-DD'
-            - until (str): The date of interest to extract data plus one day.
-                It serves as upper bound for the query. Format: 'YYYY-MM-DD'
+            - since (str or datetime): The date of interest to extract data.
+                Format: 'YYYY-MM-DD'. A datetime (UTC) searches from that
+                time with the since_time operator.
+            - until (str or datetime): The date of interest to extract data
+                plus one day. It serves as upper bound for the query.
+                Format: 'YYYY-MM-DD'. A datetime (UTC) searches until that
+                time with the until_time operator.
             - keyword (str): The keyword used for the query.
         Returns:
             - url (str): The URL for the query.
         """
+        if isinstance(since, datetime.datetime):
+            bounds = f'since_time%3A{calendar.timegm(since.timetuple())}' \
+                     f'%20until_time%3A{calendar.timegm(until.timetuple())}'
+        else:
+            bounds = f'since%3A{since}%20until%3A{until}'
+
         if keyword_type == 'account':
-            return f'https://twitter.com/search?f=tweets&vertical=default' \
-                   f'&q=(from%3A{keyword})%20since%3A{since}' \
-                   f'%20until%3A{until}&src=typed_query'
+            return f'{self.base_url}/search?f=tweets&vertical=default' \
+                   f'&q=(from%3A{keyword})%20{bounds}&src=typed_query'
         elif keyword_type == 'hashtag':
-            return f'https://twitter.com/search?f=tweets&vertical=default' \
-                   f'&q=(%23{keyword})%20since%3A{since}' \
-                   f'%20until%3A{until}&src=typed_query'
+            return f'{self.base_url}/search?f=tweets&vertical=default' \
+                   f'&q=(%23{keyword})%20{bounds}&src=typed_query'
         elif keyword_type == 'query':
             keyword = keyword.replace("_", '%20')
-            return f'https://twitter.com/search?f=tweets&vertical=default' \
-                   f'&q={keyword}%20since%3A{since}' \
-                   f'%20until%3A{until}&src=typed_query'
+            return f'{self.base_url}/search?f=tweets&vertical=default' \
+                   f'&q={keyword}%20{bounds}&src=typed_query'
         else:
             return print('Only user, hashtag or keyword data can be True')
 
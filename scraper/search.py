@@ -0,0 +1,226 @@
+import argparse
+import os
+import sqlite3
+import threading
+import pandas as pd
+import unidecode
+from scraper.instrument import instrumented
+
+
+class SearchIndex(object):
+    """
+    Persistent inverted index of the tweets of a keyword, to find the tweets
+    that mention a word, hashtag, or account without scanning the full text
+    of df_clean.csv. The terms of a tweet are the words of its clean text,
+    its hashtags (#word), and its mentions (@account). The postings are
+    saved in a SQLite table clustered by term, so each term of a query is a
+    single range read, and tweets already indexed are skipped, so only the
+    new tweets are added on each run.
+    Args:
+        - save_path (str): Path where data is saved
+        - keyword (str): Hashtag, Twitter account, or query
+    """
+    # Columns of the clean data returned with the matching tweets
+    row_columns = ['id', 'date', 'user_screen_name', 'full_text', 'url']
+    # Version of the terms saved. Indexes saved with an older version are
+    # emptied, so their tweets are indexed again with the current terms.
+    version = 1
+
+    def __init__(self, save_path, keyword):
+        self.save_path = os.path.expanduser(save_path)
+        self.keyword = keyword
+        folder = f'{self.save_path}/{keyword}/.raw_data'
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.index_path = f'{folder}/search.sqlite'
+
+        # The connection can be shared by the threads of a single run, so
+        # queries and writes are serialized with a lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.index_path, check_same_thread=False)
+        if self._conn.execute('PRAGMA user_version').fetchone()[0] < \
+                self.version:
+            self._conn.execute('DROP TABLE IF EXISTS tweets')
+            self._conn.execute('DROP TABLE IF EXISTS postings')
+            self._conn.execute(f'PRAGMA user_version = {self.version}')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS tweets '
+                           '(doc INTEGER PRIMARY KEY, id TEXT UNIQUE, '
+                           'date TEXT, user_screen_name TEXT, '
+                           'full_text TEXT, url TEXT)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS postings '
+                           '(term TEXT, doc INTEGER, '
+                           'PRIMARY KEY (term, doc)) WITHOUT ROWID')
+        self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COUNT(*) FROM tweets').fetchone()[0]
+
+    @classmethod
+    def _terms(cls, text_clean, hashtags, user_mentions):
+        # Hashtags and mentions are lists, or empty strings when the tweet
+        # has none. The clean text is already normalized by Transform.
+        terms = set(text_clean.split()) if isinstance(text_clean, str) \
+            else set()
+        for entities in [hashtags, user_mentions]:
+            if isinstance(entities, list):
+                terms.update(cls.normalize(entity) for entity in entities)
+        return terms
+
+    @staticmethod
+    def normalize(term):
+        """
+        Normalizes a term of a query like the terms of the index: lower case
+        and without accents.
+        """
+        return unidecode.unidecode(term.strip().lower())
+
+    @instrumented
+    def add(self, df):
+        """
+        Adds the tweets of the clean data that are not in the index yet.
+        Args:
+            - df (df): Clean data with the columns id, text_clean, hashtags,
+                and user_mentions, as returned by get_df_clean_data
+        Returns:
+            - ids (list): Ids of the tweets added
+        """
+        ids = df['id'].astype(str)
+        unique = ~ids.duplicated().values
+        df = df[unique]
+        ids = ids[unique].tolist()
+
+        with self._lock:
+            # Only the ids of the data frame are looked up, not every id of
+            # the index. SQLite limits the number of variables per query, so
+            # we check membership in chunks.
+            known = set()
+            chunk_size = 900
+            for i in range(0, len(ids), chunk_size):
+                chunk = ids[i:i + chunk_size]
+                known.update(row[0] for row in self._conn.execute(
+                    f'SELECT id FROM tweets WHERE id IN '
+                    f'({",".join("?" * len(chunk))})', chunk))
+            new = df[[tweet_id not in known for tweet_id in ids]]
+            if new.empty:
+                return []
+
+            first_doc = self._conn.execute(
+                'SELECT COALESCE(MAX(doc), 0) + 1 FROM tweets').fetchone()[0]
+            docs = range(first_doc, first_doc + new.shape[0])
+            values = [[None if pd.isnull(value) else str(value)
+                       for value in new[column]]
+                      for column in self.row_columns]
+            tweets = list(zip(docs, *values))
+            postings = [(term, doc) for doc, terms in zip(docs, map(
+                self._terms, new['text_clean'], new['hashtags'],
+                new['user_mentions'])) for term in terms]
+
+            # One transaction for every new tweet
+            with self._conn:
+                self._conn.executemany(
+                    'INSERT INTO tweets VALUES (?, ?, ?, ?, ?, ?)', tweets)
+                self._conn.executemany(
+                    'INSERT OR IGNORE INTO postings VALUES (?, ?)', postings)
+        return [tweet[1] for tweet in tweets]
+
+    def _docs(self, term):
+        return [row[0] for row in self._conn.execute(
+            'SELECT doc FROM postings WHERE term = ?', (term,))]
+
+    def search(self, query, match='all', limit=None):
+        """
+        Returns the ids of the tweets that contain the terms of a query,
+        newest first.
+        Args:
+            - query (str or list): Terms separated by spaces, e.g.
+                'grumpy #cats @realgrumpycat'
+            - match (str): 'all' for tweets with every term, 'any' for
+                tweets with at least one
+            - limit (int): Maximum number of ids returned. If None, every
+                matching id is returned.
+        Returns:
+            - ids (list): Tweet ids (str)
+        """
+        docs = self._match(query, match)
+        if not docs:
+            return []
+        return self._fetch(docs, 'id', limit)['id'].tolist()
+
+    def rows(self, query, match='all', limit=None):
+        """
+        Returns the id, date, user, text, and URL of the tweets that contain
+        the terms of a query, newest first. Same arguments as search.
+        """
+        docs = self._match(query, match)
+        return self._fetch(docs, ', '.join(self.row_columns), limit)
+
+    def _match(self, query, match):
+        if isinstance(query, str):
+            query = query.split()
+        terms = list(dict.fromkeys(self.normalize(term) for term in query
+                                   if term.strip()))
+        if not terms:
+            return set()
+
+        with self._lock:
+            postings = sorted((self._docs(term) for term in terms), key=len)
+        if match == 'any':
+            return set().union(*postings)
+
+        # Intersect from the rarest term, so the sets stay small
+        docs = set(postings[0])
+        for doc_list in postings[1:]:
+            if not docs:
+                break
+            docs.intersection_update(doc_list)
+        return docs
+
+    def _fetch(self, docs, columns, limit):
+        # Tweet ids grow with time, so the newest tweets have the highest
+        # ids. SQLite limits the number of variables per query, so the
+        # tweets are read in chunks.
+        docs = list(docs)
+        chunk_size = 900
+        rows = []
+        with self._lock:
+            for i in range(0, len(docs), chunk_size):
+                chunk = docs[i:i + chunk_size]
+                rows += self._conn.execute(
+                    f'SELECT {columns} FROM tweets WHERE doc IN '
+                    f'({",".join("?" * len(chunk))})', chunk).fetchall()
+        df = pd.DataFrame(rows, columns=[column.strip() for column in
+                                         columns.split(',')])
+        df['order'] = pd.to_numeric(df['id'])
+        df = df.sort_values('order', ascending=False)\
+            .drop(columns='order').reset_index(drop=True)
+        return df.head(int(limit)) if limit is not None else df
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-keyword", required=True)
+    ap.add_argument("query", nargs='+',
+                    help="Words, #hashtags, and @accounts, e.g. grumpy #cats")
+    ap.add_argument("--save_path", required=False, default='data')
+    ap.add_argument("--match", required=False, default='all',
+                    choices=['all', 'any'])
+    ap.add_argument("--limit", required=False, default='20')
+    ap.add_argument("--ids", required=False, action='store_true',
+                    help='Only print the ids of the tweets')
+    args = vars(ap.parse_args())
+
+    index = SearchIndex(args['save_path'], args['keyword'])
+    if args['ids']:
+        print('\n'.join(index.search(args['query'], match=args['match'],
+                                     limit=args['limit'])))
+    else:
+        with pd.option_context('display.max_colwidth', 80,
+                               'display.width', 200):
+            print(index.rows(args['query'], match=args['match'],
+                             limit=args['limit']).to_string(index=False))
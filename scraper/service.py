@@ -0,0 +1,319 @@
+import argparse
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+import numpy as np
+import pandas as pd
+from scraper.cache import LRUCache
+from scraper.ranking import METRICS, top_k
+
+
+class AggregateService(object):
+    """
+    Local HTTP service that answers aggregate queries over the clean data of
+    the keywords under save_path as JSON, so dashboards and notebooks don't
+    parse the CSV files of every aggregation again. The columns needed by the
+    queries are read once per keyword and kept sorted by date, so date
+    ranges are sliced with a binary search. Results are kept in an LRU
+    cache, and both the data and the results of a keyword are dropped when
+    its df_clean.csv changes.
+
+    Every endpoint is GET /<keyword>/<aggregate> and accepts start and end
+    dates (YYYY-MM-DD, both included):
+        - summary: tweets, users, retweets, and favorites
+        - grouped_date: tweets, retweets, and favorites per day, week, or
+            month, with freq=D, W, or M
+        - most_active_users, most_mentioned_users, most_mentioned_hashtags:
+            the top N, with top=N
+        - top_tweets: the top N tweets by metric=retweets, favorites, or
+            weighted_engagement
+    GET /keywords lists the keywords and GET /stats the cache statistics.
+    Args:
+        - save_path (str): Path where data is saved
+        - host (str): Host where the server listens
+        - port (int): Port where the server listens. If 0, a free port is used
+        - cache_size (int): Maximum number of results cached. If 0, results
+            are computed on every request.
+    """
+    columns = ['id', 'date', 'user_screen_name', 'hashtags', 'user_mentions',
+               'retweet_count', 'favorite_count', 'user_followers_count']
+    aggregates = ['summary', 'grouped_date', 'most_active_users',
+                  'most_mentioned_users', 'most_mentioned_hashtags',
+                  'top_tweets']
+
+    def __init__(self, save_path='data', host='127.0.0.1', port=8050,
+                 cache_size=256):
+        self.save_path = os.path.expanduser(save_path)
+        self.cache = LRUCache(cache_size)
+        self._frames = {}
+        self._frames_lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def serve_forever(self):
+        """
+        Answers requests in the current thread until stop is called from
+        another thread or the process is interrupted.
+        """
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def start(self):
+        """
+        Answers requests in a background thread.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _clean_data_path(self, keyword):
+        return f'{self.save_path}/{keyword}/clean_data/df_clean.csv'
+
+    def keywords(self):
+        if not os.path.exists(self.save_path):
+            return []
+        return sorted(keyword for keyword in os.listdir(self.save_path)
+                      if os.path.exists(self._clean_data_path(keyword)))
+
+    @staticmethod
+    def _exploded(df, column, pattern):
+        # The lists are saved as strings in df_clean.csv, so their items are
+        # read with a regular expression instead of evaluating every list
+        values = df[column].fillna('').astype(str).str.findall(pattern)
+        exploded = pd.DataFrame({'date': df['date'], 'value': values})\
+            .explode('value').dropna()
+        return {'dates': exploded['date'].values,
+                'values': exploded['value'].values}
+
+    def _load(self, keyword):
+        """
+        Returns the data of a keyword sorted by date, reading df_clean.csv
+        again only when its size or modification time changed.
+        """
+        # Only the folders of the keywords can be read
+        if keyword.startswith('.') or os.sep in keyword:
+            raise KeyError(keyword)
+        path = self._clean_data_path(keyword)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            raise KeyError(keyword)
+        stamp = (stat.st_size, stat.st_mtime_ns)
+        with self._frames_lock:
+            cached = self._frames.get(keyword)
+            if cached is not None and cached['stamp'] == stamp:
+                return cached
+
+            df = pd.read_csv(path, usecols=lambda column:
+                             column in self.columns, dtype={'id': str})
+            df['date'] = pd.to_datetime(df['date']).values\
+                .astype('datetime64[D]')
+            df = df.sort_values('date', kind='mergesort')\
+                .reset_index(drop=True)
+            for column in ['retweet_count', 'favorite_count',
+                           'user_followers_count']:
+                df[column] = df[column].fillna(0)
+            frames = {
+                'stamp': stamp,
+                'tweets': df,
+                'dates': df['date'].values,
+                'hashtags': self._exploded(df, 'hashtags', r"'(#[^']+)'"),
+                'mentions': self._exploded(df, 'user_mentions',
+                                           r"'@([^']+)'"),
+            }
+            self._frames[keyword] = frames
+
+        # Results computed from the previous data are not valid anymore
+        self.cache.invalidate(lambda key: key[0] == keyword)
+        return frames
+
+    @staticmethod
+    def _bounds(dates, start, end):
+        # Dates are sorted, so the range is found with a binary search
+        first = np.searchsorted(dates, np.datetime64(start, 'D'), 'left') \
+            if start else 0
+        last = np.searchsorted(dates, np.datetime64(end, 'D'), 'right') \
+            if end else len(dates)
+        return first, last
+
+    @staticmethod
+    def _top(top):
+        top = int(top)
+        if top < 1:
+            raise ValueError('top must be at least 1')
+        return top
+
+    def _top_values(self, values, top, name):
+        counts = pd.Series(values).value_counts(sort=False)\
+            .nlargest(self._top(top))
+        return [{name: value, 'count': int(count)}
+                for value, count in counts.items()]
+
+    def aggregate(self, keyword, name, params=None):
+        """
+        Returns the result of an aggregate of a keyword, from the cache when
+        it was already computed for the same data and parameters.
+        Args:
+            - keyword (str): Keyword with clean data
+            - name (str): One of aggregates
+            - params (dict): start, end, top, freq, and metric
+        Returns:
+            - result (dict): keyword, aggregate, parameters, and data
+        """
+        if name not in self.aggregates:
+            raise KeyError(name)
+        params = {key: value for key, value in (params or {}).items()
+                  if value not in (None, '')}
+        frames = self._load(keyword)
+        key = (keyword, name, tuple(sorted(params.items())),
+               frames['stamp'])
+        found, result = self.cache.get(key)
+        if found:
+            return result
+
+        result = {'keyword': keyword, 'aggregate': name, 'params': params,
+                  'data': getattr(self, f'_{name}')(frames, **params)}
+        self.cache.put(key, result)
+        return result
+
+    def _tweets(self, frames, start, end):
+        first, last = self._bounds(frames['dates'], start, end)
+        return frames['tweets'].iloc[first:last]
+
+    def _summary(self, frames, start=None, end=None):
+        df = self._tweets(frames, start, end)
+        return {'tweets': int(df.shape[0]),
+                'users': int(df['user_screen_name'].nunique()),
+                'retweets': int(df['retweet_count'].sum()),
+                'favorites': int(df['favorite_count'].sum()),
+                'first_date': df['date'].iloc[0].strftime('%Y-%m-%d')
+                if len(df) else None,
+                'last_date': df['date'].iloc[-1].strftime('%Y-%m-%d')
+                if len(df) else None}
+
+    def _grouped_date(self, frames, start=None, end=None, freq='D'):
+        if freq not in ['D', 'W', 'M']:
+            raise ValueError('freq must be D, W, or M')
+        df = self._tweets(frames, start, end)
+        df = df.assign(tweets_published=1)\
+            .set_index(pd.DatetimeIndex(df['date']))[
+                ['tweets_published', 'retweet_count', 'favorite_count']]\
+            .resample(freq).sum()
+        return [{'date': date.strftime('%Y-%m-%d'),
+                 **{column: int(value) for column, value in row.items()}}
+                for date, row in df.iterrows()]
+
+    def _most_active_users(self, frames, start=None, end=None, top='20'):
+        df = self._tweets(frames, start, end)
+        return self._top_values(df['user_screen_name'].values, top, 'user')
+
+    def _most_mentioned_users(self, frames, start=None, end=None, top='20'):
+        mentions = frames['mentions']
+        first, last = self._bounds(mentions['dates'], start, end)
+        return self._top_values(mentions['values'][first:last], top,
+                                'user')
+
+    def _most_mentioned_hashtags(self, frames, start=None, end=None,
+                                 top='20'):
+        hashtags = frames['hashtags']
+        first, last = self._bounds(hashtags['dates'], start, end)
+        return self._top_values(hashtags['values'][first:last], top,
+                                'hashtag')
+
+    def _top_tweets(self, frames, start=None, end=None, top='20',
+                    metric='retweets'):
+        if metric not in METRICS:
+            raise ValueError(f'metric must be one of {list(METRICS)}')
+        df = self._tweets(frames, start, end)
+        scores = METRICS[metric](df)
+        positions = top_k(scores, self._top(top))
+        df = df.iloc[positions]
+        return [{'id': tweet_id, 'user': user,
+                 'date': date.strftime('%Y-%m-%d'),
+                 'score': float(score)}
+                for tweet_id, user, date, score in zip(
+                    df['id'], df['user_screen_name'], df['date'],
+                    scores[positions])]
+
+    def stats(self):
+        return {'hits': self.cache.hits, 'misses': self.cache.misses,
+                'cached': len(self.cache), 'keywords': len(self._frames)}
+
+    def _handler(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, data):
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                try:
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                parts = [unquote(part) for part in url.path.split('/') if part]
+                params = {key: values[0] for key, values in
+                          parse_qs(url.query).items()}
+                if parts == ['keywords']:
+                    return self._send(200, service.keywords())
+                if parts == ['stats']:
+                    return self._send(200, service.stats())
+                if len(parts) != 2:
+                    return self._send(404, {'error': 'Not found'})
+                try:
+                    return self._send(200, service.aggregate(
+                        parts[0], parts[1], params))
+                except KeyError as error:
+                    return self._send(404, {'error': f'Not found: {error}'})
+                except (TypeError, ValueError) as error:
+                    return self._send(400, {'error': str(error)})
+
+        return Handler
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--save_path", required=False, default='data')
+    ap.add_argument("--host", required=False, default='127.0.0.1')
+    ap.add_argument("--port", required=False, default='8050')
+    ap.add_argument("--cache_size", required=False, default='256')
+    args = vars(ap.parse_args())
+
+    service = AggregateService(
+        save_path=args['save_path'], host=args['host'],
+        port=int(args['port']), cache_size=int(args['cache_size']))
+    print(f'Serving the aggregates of {args["save_path"]} on '
+          f'{service.base_url}')
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,120 @@
+import datetime
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+def split_window(since, until, parts):
+    """
+    Splits a time window in parts of the same length.
+    Args:
+        - since (datetime): Start of the window
+        - until (datetime): End of the window, excluded
+        - parts (int): Number of windows returned
+    Returns:
+        - windows (list): (since, until) of each part, newest first like the
+            search timeline
+    """
+    step = (until - since) / parts
+    bounds = [since + step * i for i in range(parts)] + [until]
+    return [(bounds[i], bounds[i + 1]) for i in reversed(range(parts))]
+
+
+class AdaptiveSlicer(object):
+    """
+    Collects the ids of a time window, and splits it in smaller windows when
+    it is too busy to be collected from a single search timeline. A window is
+    busy when its probe reaches split_scrolls scrolls, stops because of the
+    time budget, or finds more than split_rate ids per hour. Busy windows are
+    split in split_parts windows, recursively, until they are shorter than
+    min_window, and the ids of every window are merged without duplicates.
+    Every window of a day, at any depth, is collected by the same pool of
+    max_workers threads, so the number of Chrome sessions open at the same
+    time never exceeds max_workers.
+    Args:
+        - collect_window (function): Called with since, until, and the
+            maximum number of scrolls (None for no limit). Returns the ids
+            found in the window and the stats of the scroll loop.
+        - split_scrolls (int): Scrolls after which a window is split. If
+            None (the default), windows are not split because of their
+            scrolls.
+        - split_rate (float): Ids per hour above which a window is split. If
+            None, windows are not split because of their rate.
+        - split_parts (int): Number of windows a busy window is split in
+        - min_window (timedelta): Windows shorter than this are not split,
+            and are scrolled without limit
+        - max_workers (int): Windows collected at the same time
+    """
+    def __init__(self, collect_window, split_scrolls=None, split_rate=None,
+                 split_parts=4, min_window=datetime.timedelta(minutes=15),
+                 max_workers=1):
+        self.collect_window = collect_window
+        self.split_scrolls = int(split_scrolls) \
+            if split_scrolls is not None else None
+        self.split_rate = float(split_rate) if split_rate is not None \
+            else None
+        self.split_parts = max(int(split_parts), 2)
+        self.min_window = min_window
+        self.max_workers = max(int(max_workers), 1)
+
+    def _is_busy(self, ids, stats, since, until):
+        if stats['stop_reason'] in ['max_scrolls', 'time_budget']:
+            return True
+        hours = (until - since).total_seconds() / 3600
+        return self.split_rate is not None and \
+            len(ids) / hours > self.split_rate
+
+    def _probe(self, window):
+        """
+        Collects the ids of a window and, when it is busy, adds the windows
+        it is split in to its children.
+        """
+        since, until = window['since'], window['until']
+        # The smallest windows are scrolled until the end of the timeline
+        splittable = until - since > self.min_window
+        ids, stats = self.collect_window(
+            since, until, self.split_scrolls if splittable else None)
+        window['ids'] = ids
+        if not splittable or not self._is_busy(ids, stats, since, until):
+            return
+
+        print(f'Splitting {since} - {until} in {self.split_parts} windows '
+              f'after {stats["scrolls"]} scrolls and {len(ids)} ids')
+        window['children'] = [
+            {'since': child_since, 'until': child_until, 'ids': [],
+             'children': []}
+            for child_since, child_until in split_window(
+                since, until, self.split_parts)]
+
+    def collect(self, since, until):
+        """
+        Returns the ids published between since and until, newest windows
+        first.
+        """
+        root = {'since': since, 'until': until, 'ids': [], 'children': []}
+        if self.max_workers > 1:
+            # The windows of every level are submitted to a single pool as
+            # soon as their parent is split
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                pending = {executor.submit(self._probe, root): root}
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        window = pending.pop(future)
+                        future.result()
+                        for child in window['children']:
+                            pending[executor.submit(self._probe, child)] = \
+                                child
+        else:
+            stack = [root]
+            while stack:
+                window = stack.pop()
+                self._probe(window)
+                stack.extend(reversed(window['children']))
+
+        # Keep the ids of the probes too, in case a window missed some
+        merged = {}
+        stack = [root]
+        while stack:
+            window = stack.pop()
+            merged.update(dict.fromkeys(window['ids']))
+            stack.extend(reversed(window['children']))
+        return list(merged)
@@ -1,4 +1,5 @@
 import pandas as pd
+import functools
 import os
 from ast import literal_eval
 import unidecode
@@ -7,18 +8,44 @@ import nltk
 import sklearn
 from sklearn.preprocessing import MinMaxScaler
 import numpy as np
+from scipy import sparse
+from scraper.graph import InteractionGraph, interaction_edges
+from scraper.ranking import RANKING_COLUMNS, rank_tweets
 from scraper.save import Save
+from scraper.search import SearchIndex
+from scraper.instrument import INSTRUMENT, instrumented
+
+
+@functools.lru_cache(maxsize=None)
+def _words_ignore():
+    """
+    Returns the set of words removed from the text of tweets. The NLTK
+    stopwords are loaded once per process and shared by every Transform,
+    instead of once per tweet.
+    """
+    words_ignore = ['http', 'www', 'com', 'ly', 'bit', 'u', 'li', 'ht',
+                    '’', 'rt', 'co', '...', 'https', "'", '"', ",", " ",
+                    "", "gt"]
+    words_ignore = \
+        words_ignore + nltk.corpus.stopwords.words('spanish') \
+        + nltk.corpus.stopwords.words('english') \
+        + [word for word in list(string.ascii_lowercase)]
+    return frozenset(words_ignore)
 
 
 class Transform(object):
 
-    def __init__(self, keyword):
+    def __init__(self, keyword, save_path='data', top_k=1000):
         self.keyword = keyword
-        self.save_path = 'data'
+        self.save_path = save_path
+        # Tweets kept in each ranking. If None or 0, every tweet is kept.
+        self.top_k = int(top_k) if top_k else None
         self.path_raw_data = f'{os.path.expanduser(self.save_path)}/{keyword}/' \
                              f'.raw_data/df_raw.csv'
         self.clean_data_path = f'{os.path.expanduser(self.save_path)}/' \
                                f'{self.keyword}/clean_data/df_clean.csv'
+        self.users_path = f'{os.path.expanduser(self.save_path)}/' \
+                          f'{self.keyword}/users/df_users.csv'
         self.mapping_months = {1: 'JAN', 2: 'FEB', 3: 'MAR', 4: 'APR',
                                5: 'MAY', 6: 'JUN', 7: 'JUL', 8: 'AUG',
                                9: 'SEP', 10: 'OCT', 11: 'NOV', 12: 'DEC'}
@@ -55,14 +82,8 @@ class Transform(object):
         text = [word for word in text
                 if not word.startswith('@') or not word.startswith('#')]
 
-        # Generate list of words that should be removed
-        words_ignore = ['http', 'www', 'com', 'ly', 'bit', 'u', 'li', 'ht',
-                        '’', 'rt', 'co', '...', 'https', "'", '"', ",", " ",
-                        "", "gt"]
-        words_ignore = \
-            words_ignore + nltk.corpus.stopwords.words('spanish') \
-            + nltk.corpus.stopwords.words('english') \
-            + [word for word in list(string.ascii_lowercase)]
+        # Remove words that should be ignored
+        words_ignore = _words_ignore()
         text = [unidecode.unidecode(word) for word in text]
         text = [word for word in text if word not in words_ignore]
 
@@ -74,8 +95,10 @@ class Transform(object):
 
         return text
 
+    @instrumented
     def get_df_clean_data(self):
         df = pd.read_csv(self.path_raw_data)
+        INSTRUMENT.set_rows_in(df.shape[0])
 
         # Cast timestamp as datetime using EST as timezone. The column ts refers
         # to the timestamp when the tweet was published
@@ -210,11 +233,92 @@ class Transform(object):
             df, self.save_path, self.keyword, 'clean_data', 'df_clean', True)
         save_data.save_data()
 
+        # Save the users found in the tweets once, instead of once per tweet
+        self.get_df_users(df)
+
+        # Index the terms of the tweets not indexed yet for the search
+        search_index = SearchIndex(self.save_path, self.keyword)
+        try:
+            search_index.add(df)
+        finally:
+            search_index.close()
+
+        return df
+
+    @instrumented
+    def get_df_users(self, clean_data=None):
+        """
+        Builds the table of users who published or were retweeted in the
+        clean data, with one row per user. The profile of each user is the
+        one of their latest tweet, and the counts of tweets published and
+        retweets received are computed in the same groupby.
+        Args:
+            - clean_data (df): Clean data. If None, it is read from
+                df_clean.csv.
+        Returns:
+            - df (df): Users, saved in users/df_users.csv
+        """
+        if clean_data is None:
+            clean_data = pd.read_csv(self.clean_data_path)
+            INSTRUMENT.set_rows_in(clean_data.shape[0])
+
+        # One snapshot of the profile of the author of each tweet and, for
+        # retweets, one of the retweeted user
+        profile = ['user', 'count_followers', 'count_following',
+                   'count_tweets_published_all_time', 'location']
+        authors = clean_data[['ts', 'user_screen_name', 'user_followers_count',
+                              'user_friends_count', 'user_statuses_count',
+                              'user_location', 'user_ts']]
+        authors.columns = ['ts'] + profile + ['user_ts']
+        authors = authors.assign(tweets_published=1, count_retweets=0)
+        snapshots = [authors]
+        if 'retweeted_user_screen_name' in clean_data.columns:
+            retweeted = clean_data[
+                clean_data.retweeted_user_screen_name.notnull()][
+                ['ts', 'retweeted_user_screen_name',
+                 'retweeted_user_followers_count',
+                 'retweeted_user_friends_count',
+                 'retweeted_user_statuses_count', 'retweeted_user_location']]
+            retweeted.columns = ['ts'] + profile
+            retweeted = retweeted.assign(
+                user=retweeted.user.str.lower(), tweets_published=0,
+                count_retweets=1)
+            snapshots.append(retweeted)
+        df = pd.concat(snapshots, ignore_index=True, sort=False)
+        df = df[df.user.notnull()]
+
+        # Timestamps are compared as UTC, since the CSV keeps their offsets
+        df['ts'] = pd.to_datetime(df['ts'], utc=True)
+        df = df.sort_values('ts', kind='mergesort')
+        agg = {column: 'last' for column in profile[1:]}
+        agg.update({'user_ts': 'last', 'ts': 'last',
+                    'tweets_published': 'sum', 'count_retweets': 'sum'})
+        df = df.groupby('user').agg(agg) \
+            .rename({'ts': 'last_seen'}, axis=1) \
+            .reset_index()
+        counts = profile[1:4]
+        df[counts] = df[counts].fillna(0).astype(int)
+        df['link'] = 'https://twitter.com/' + df['user']
+
+        save_data = Save(
+            df, self.save_path, self.keyword, 'users', 'df_users', True)
+        save_data.save_data()
+
         return df
 
+    def _load_users(self):
+        # Build the users table if the clean data was saved before it existed
+        if not os.path.exists(self.users_path):
+            return self.get_df_users()
+        df = pd.read_csv(self.users_path)
+        INSTRUMENT.set_rows_in(df.shape[0])
+        return df
+
+    @instrumented
     def get_df_grouped_date(self):
         # Load cleaned data
         clean_data = pd.read_csv(self.clean_data_path)
+        INSTRUMENT.set_rows_in(clean_data.shape[0])
 
         # Group by date and get sums and counts
         df = clean_data.groupby('date') \
@@ -237,9 +341,11 @@ class Transform(object):
 
         return df
 
+    @instrumented
     def get_df_key_topics(self, num_tfidf_feat=40):
         # Load cleaned data
         df = pd.read_csv(self.clean_data_path)
+        INSTRUMENT.set_rows_in(df.shape[0])
 
         # Create list of stop_words for the count vectorizer
         stop_words = nltk.corpus.stopwords.words('spanish') \
@@ -279,9 +385,11 @@ class Transform(object):
 
         return df_tfidf
 
+    @instrumented
     def get_df_most_mentioned_users(self):
         # Load cleaned data and return if there were no users mentioned
         df = pd.read_csv(self.clean_data_path)
+        INSTRUMENT.set_rows_in(df.shape[0])
 
         # Flatten nested list of users mentioned per tweet
         df['user_mentions'] = df['user_mentions'].apply(
@@ -307,9 +415,11 @@ class Transform(object):
 
         return df
 
+    @instrumented
     def get_hashtags_df(self):
         # Load cleaned data
         df = pd.read_csv(self.clean_data_path)
+        INSTRUMENT.set_rows_in(df.shape[0])
         # Flatten nested list of hashtags mentioned per tweet and
         # return empty data frame if there were no hashtags captured
         df['hashtags'] = df['hashtags'].apply(
@@ -324,6 +434,7 @@ class Transform(object):
         else:
             return df
 
+    @instrumented
     def get_df_most_mentioned_hashtags(self):
         # Load hashtags data
         df = self.get_hashtags_df()
@@ -351,6 +462,7 @@ class Transform(object):
 
         return df
 
+    @instrumented
     def get_df_most_active_users(self):
         df = pd.read_csv(self.clean_data_path) \
             .user_screen_name.value_counts() \
@@ -367,30 +479,19 @@ class Transform(object):
 
         return df
 
+    @instrumented
     def get_df_most_retweeted_users(self):
-        # Load cleaned data
-        df_clean = pd.read_csv(self.clean_data_path)
+        # Load the users table, which already counts how many times each
+        # user was retweeted and has their latest number of followers
+        df = self._load_users()
 
         # Return if no tweet was a retweet
-        if 'retweeted_user_screen_name' not in df_clean.columns:
+        df = df[df.count_retweets > 0]
+        if df.empty:
             return
 
-        # Count how many times each retweeted user was retweeted and also
-        # add the number of followers per user that was retweeted
-        df = df_clean[df_clean.retweeted_user_screen_name.notnull()]
-        df = df.groupby('retweeted_user_screen_name', as_index=False) \
-            .id.count() \
-            .merge(df_clean[['retweeted_user_screen_name',
-                             'retweeted_user_followers_count']],
-                   on='retweeted_user_screen_name', how='inner') \
-            .rename({'retweeted_user_screen_name': 'user',
-                     'id': 'count_retweets',
-                     'retweeted_user_followers_count': 'count_followers'},
-                    axis=1) \
-            .drop_duplicates()
-        df['link'] = 'https://twitter.com/' + df['user']
-        df = df.groupby('user').max().reset_index()\
-            .sort_values('count_retweets', ascending=False) \
+        df = df[['user', 'count_retweets', 'count_followers', 'link']] \
+            .sort_values('count_retweets', ascending=False)
 
         save_data = Save(
             df, self.save_path, self.keyword, 'most_retweeted_users',
@@ -399,21 +500,13 @@ class Transform(object):
 
         return df
 
+    @instrumented
     def get_df_users_by_followers(self):
-        # Load cleaned data
-        df = pd.read_csv(self.clean_data_path,
-                         usecols=['user_screen_name', 'user_followers_count',
-                                  'user_friends_count',
-                                  'user_statuses_count']) \
-            .rename({'user_screen_name': 'user',
-                     'user_followers_count': 'count_followers',
-                     'user_friends_count': 'count_following',
-                     'user_statuses_count': 'count_tweets_published_all_time'},
-                    axis=1) \
-            .sort_values('count_followers', ascending=False) \
-            .drop_duplicates()
-        df['link'] = 'https://twitter.com/' + df['user']
-        df = df.groupby('user').max().reset_index()\
+        # Load the users table and keep the users who published tweets
+        df = self._load_users()
+        df = df[df.tweets_published > 0][
+            ['user', 'count_followers', 'count_following',
+             'count_tweets_published_all_time', 'link']] \
             .sort_values('count_followers', ascending=False)
 
         save_data = Save(
@@ -423,6 +516,42 @@ class Transform(object):
 
         return df
 
+    @instrumented
+    def get_df_interaction_graph(self):
+        """
+        Builds the graph of users who mention, reply to, or retweet other
+        users. Saves one row per user with their PageRank, degrees, and
+        connected component, the edge list with the number of interactions
+        of each type, and the sparse adjacency matrix, whose rows and
+        columns are the node numbers of the users.
+        """
+        columns = ['user_screen_name', 'user_mentions', 'reply_to_user',
+                   'retweeted_user_screen_name']
+        df = pd.read_csv(self.clean_data_path,
+                         usecols=lambda column: column in columns)
+        INSTRUMENT.set_rows_in(df.shape[0])
+
+        # Return if no user interacted with another user
+        edges = interaction_edges(df)
+        if edges.empty:
+            return
+        graph = InteractionGraph(edges)
+        df = graph.nodes()
+
+        save_data = Save(
+            graph.edge_list(), self.save_path, self.keyword,
+            'interaction_graph', 'edges', True)
+        save_data.save_data()
+        sparse.save_npz(f'{save_data.save_path}/adjacency.npz',
+                        graph.adjacency)
+        save_data = Save(
+            df, self.save_path, self.keyword, 'interaction_graph',
+            'interaction_graph', True)
+        save_data.save_data()
+
+        return df
+
+    @instrumented
     def get_df_cohashtags_matrix(self):
         # Load hashtags data
         df = self.get_hashtags_df()
@@ -442,15 +571,16 @@ class Transform(object):
 
         return df
 
+    @instrumented
     def get_df_tweets_sorted_by_retweets(self):
-        df = pd.read_csv(self.clean_data_path) \
+        df = pd.read_csv(self.clean_data_path, dtype={'id': str}) \
             .sort_values('retweet_count', ascending=False) \
             .reset_index(drop=True)
         df['link'] = 'https://twitter.com/' + df['user_screen_name']
-        df = df[['user_screen_name', 'link', 'date', 'year', 'month_name',
-                 'day', 'full_text', 'retweet_count', 'favorite_count',
-                 'user_followers_count', 'user_friends_count',
-                 'user_statuses_count']]
+        df = df[['id', 'user_screen_name', 'link', 'date', 'year',
+                 'month_name', 'day', 'full_text', 'retweet_count',
+                 'favorite_count', 'user_followers_count',
+                 'user_friends_count', 'user_statuses_count']]
 
         save_data = Save(
             df, self.save_path, self.keyword, 'tweets_sorted_by_retweets',
@@ -458,3 +588,25 @@ class Transform(object):
         save_data.save_data()
 
         return df
+
+    @instrumented
+    def get_df_rankings(self):
+        """
+        Ranks the tweets by retweets, favorites, and follower weighted
+        engagement in one read of the clean data, and saves the ids and
+        scores of the top_k tweets of each ranking instead of a sorted copy
+        of every row.
+        Returns:
+            - df (df): Columns metric, rank, id, and score, saved in
+                rankings/rankings.csv
+        """
+        df = pd.read_csv(self.clean_data_path, usecols=RANKING_COLUMNS,
+                         dtype={'id': str})
+        INSTRUMENT.set_rows_in(df.shape[0])
+        df = rank_tweets(df, self.top_k)
+
+        save_data = Save(
+            df, self.save_path, self.keyword, 'rankings', 'rankings', True)
+        save_data.save_data()
+
+        return df
@@ -1,43 +1,167 @@
 from highcharts import Highchart
 import pandas as pd
+import json
 import os
+import threading
+from scraper.downsample import downsample_time_series
+from scraper.instrument import instrumented
+
+
+# Loads the full resolution data of a downsampled chart and replaces the
+# data of the chart with it
+DRILLDOWN_JS = """
+function loadDrilldown(chart, src, name) {
+  var script = document.createElement('script');
+  script.src = src;
+  script.onload = function () {
+    var data = window.drilldownData[name];
+    chart.update({
+      title: {text: chart.title.textStr.replace(/ by (week|month) /,
+                                                ' by day ')},
+      xAxis: {categories: data.categories}
+    }, false);
+    data.series.forEach(function (values, i) {
+      chart.series[i].setData(values, false);
+    });
+    chart.redraw();
+  };
+  document.head.appendChild(script);
+}
+"""
 
 
 # noinspection DuplicatedCode
 class Visualize(object):
 
-    def __init__(self, keyword):
+    def __init__(self, keyword, save_path='data', results=None):
+        """
+        Creates an HTML chart for each aggregation generated by Transform.
+        Args:
+            - keyword (str): Hashtag, Twitter account, or query
+            - save_path (str): Path where data is saved
+            - results (dict): Data frames returned by the Transform methods,
+                keyed by the name of their folder, e.g. 'grouped_date'. Charts
+                use them instead of reading the CSV files, which are only read
+                when an aggregation is missing from the dictionary.
+        """
         self.keyword = keyword
-        self.save_path = 'data'
+        self.save_path = save_path
+        self.results = results if results is not None else {}
+        # Each chart has a chart_<name> method returning its options and
+        # series, and a visualize_<name> method saving it as HTML in the
+        # folder of the aggregation
+        self.charts = ['grouped_date', 'key_topics', 'most_mentioned_users',
+                       'most_mentioned_hashtags', 'most_active_users',
+                       'most_retweeted_users', 'users_by_followers',
+                       'interaction_graph']
         self.months_order = ["JAN", "FEB", "MAR", "APR", "MAY", "JUN",
                              "JUL", "AUG", "SEP", "OCT", "NOV", "DEC"]
 
+    def _load_df(self, name):
+        # Copy the data frame kept in memory, so charts can modify it
+        # without changing the results of Transform
+        df = self.results.get(name)
+        if df is not None:
+            return df.copy()
+        return pd.read_csv(f'{os.path.expanduser(self.save_path)}/'
+                           f'{self.keyword}/{name}/{name}.csv')
+
     @staticmethod
     def func_save_html(path, html_str):
         return open(path, "w").write(html_str)
 
-    def visualize_grouped_date(self):
-        df_path = f'{os.path.expanduser(self.save_path)}/{self.keyword}/' \
-                  f'grouped_date/grouped_date.csv'
-        df = pd.read_csv(df_path)
+    def _save_chart(self, chart, name):
+        # Charts are None when there is no data to plot
+        if chart is None:
+            return
+        h = Highchart(width=1000, height=700)
+        h.set_dict_options(chart['options'])
+        for series in chart['series']:
+            h.add_data_set(series['data'], series['type'], series['name'],
+                           color=series['color'])
+
+        # Downsampled charts get a button to load their daily data
+        html = h.htmlcontent
+        if 'drilldown' in chart:
+            html = html.replace(
+                '</body>',
+                f'<button onclick="loadDrilldown(Highcharts.charts[0], '
+                f'\'{chart["drilldown"]["script"]}\', '
+                f'\'{chart["drilldown"]["name"]}\'); this.disabled = true;">'
+                f'Show daily data</button>'
+                f'<script>{DRILLDOWN_JS}</script></body>')
 
-        # Order month category
-        df['month'] = df['month'].astype('category') \
-            .cat.add_categories([month for month in self.months_order
-                                 if month not in df.month.unique().tolist()])
-        df.set_index(['year', 'month'], inplace=True)
+        # Save chart
+        save_chart_path = f'{os.path.expanduser(self.save_path)}/' \
+                          f'{self.keyword}/{name}/{name}.html'
+        self.func_save_html(save_chart_path, html)
+
+    @staticmethod
+    def _drilldown(name, df, date_col, columns):
+        # Full resolution data of a downsampled chart, loaded by the chart
+        # only when the user asks for it
+        return {'name': name, 'script': f'{name}_raw.js',
+                'data': {'categories': df[date_col].dt.strftime(
+                             '%Y-%m-%d').tolist(),
+                         'series': [df[column].values.tolist()
+                                    for column in columns]}}
+
+    def _save_drilldown(self, chart, name):
+        """
+        Saves the full resolution data of a downsampled chart as JSON,
+        wrapped in a script that charts load only when the user asks for it.
+        A script is used instead of a plain JSON file because browsers don't
+        let pages opened from disk fetch local files. The script of a
+        previous run is removed when the chart is not downsampled anymore.
+        """
+        path = f'{os.path.expanduser(self.save_path)}/{self.keyword}/' \
+               f'{name}/{name}_raw.js'
+        drilldown = chart.get('drilldown') if chart is not None else None
+        if drilldown is None:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        folder = os.path.dirname(path)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        data = json.dumps(drilldown['data'], separators=(',', ':'))
+        # The dashboard saves the same script, maybe at the same time, so
+        # it is written to a temporary file first and then moved in place
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        self.func_save_html(
+            tmp_path,
+            f'window.drilldownData = window.drilldownData || {{}};\n'
+            f'window.drilldownData["{drilldown["name"]}"] = {data};\n')
+        os.replace(tmp_path, path)
+
+    def chart_grouped_date(self, max_points=400):
+        df = self._load_df('grouped_date')
+        df['date'] = pd.to_datetime(df['date'])
+        df = df.sort_values('date')
+
+        # Long date ranges are plotted by week or month, and the daily data
+        # is only loaded on demand
+        columns = ['retweet_count', 'favorite_count', 'tweets_published']
+        drilldown = self._drilldown('grouped_date', df, 'date', columns)
+        df, resolution = downsample_time_series(
+            df, 'date', columns, max_points=max_points,
+            lttb_column='tweets_published')
+        if resolution == 'month':
+            categories = [f'{date.year}-{self.months_order[date.month - 1]}'
+                          for date in df.date]
+        else:
+            categories = df.date.dt.strftime('%Y-%m-%d').tolist()
 
         options = {
             'title': {'text': f'Count of tweets, retweets, and favorites by '
-                              f'month for {self.keyword}'
-                              f'from {df.index.min()[0]}-{df.index.min()[1]} '
-                              f'to {df.index.max()[0]}-{df.index.max()[1]}',
+                              f'{resolution} for {self.keyword} '
+                              f'from {categories[0]} to {categories[-1]}',
                       'style': {'fontSize': '20'}
                       },
-            'xAxis': {'categories': df.index.tolist(),
+            'xAxis': {'categories': categories,
                       'labels': {'style': {'fontSize': '13px'}
                                  },
-                      'title': {'text': 'Date (Year, Month)',
+                      'title': {'text': f'Date ({resolution.capitalize()})',
                                 'style': {'fontSize': '15'}
                                 }
                       },
@@ -53,25 +177,22 @@ class Visualize(object):
             'chart': {'backgroundColor': 'white'}
         }
 
-        # Create chart
-        h = Highchart(width=1000, height=700)
-        h.set_dict_options(options)
-        h.add_data_set(df.retweet_count.values.tolist(), 'line',
-                       'Retweets count', color='#1998CB')
-        h.add_data_set(df.favorite_count.values.tolist(), 'line',
-                       'Favorites count', color='#F0CD13')
-        h.add_data_set(df.tweets_published.values.tolist(), 'line',
-                       'Tweets published count', color='#EC3C37')
-
-        # Save chart
-        save_chart_path = f'{os.path.expanduser(self.save_path)}/' \
-                          f'{self.keyword}/grouped_date/grouped_date.html'
-        self.func_save_html(save_chart_path, h.htmlcontent)
-
-    def visualize_key_topics(self):
-        df_path = f'{os.path.expanduser(self.save_path)}/{self.keyword}/' \
-                  f'key_topics/key_topics.csv'
-        df = pd.read_csv(df_path)
+        series = [{'data': df.retweet_count.values.tolist(),
+                   'type': 'line', 'name': 'Retweets count',
+                   'color': '#1998CB'},
+                  {'data': df.favorite_count.values.tolist(),
+                   'type': 'line', 'name': 'Favorites count',
+                   'color': '#F0CD13'},
+                  {'data': df.tweets_published.values.tolist(),
+                   'type': 'line', 'name': 'Tweets published count',
+                   'color': '#EC3C37'}]
+        chart = {'options': options, 'series': series}
+        if resolution != 'day':
+            chart['drilldown'] = drilldown
+        return chart
+
+    def chart_key_topics(self):
+        df = self._load_df('key_topics')
 
         options = {
             'title': {'text': f'Top {df.shape[0]} key topics '
@@ -99,21 +220,13 @@ class Visualize(object):
             'chart': {'backgroundColor': 'white'}
         }
 
-        # Create chart
-        h = Highchart(width=1000, height=700)
-        h.set_dict_options(options)
-        h.add_data_set(df.weight_normalized.values.tolist(), 'bar',
-                       'Retweets count', color='#1998CB')
-
-        # Save chart
-        save_chart_path = f'{os.path.expanduser(self.save_path)}/' \
-                          f'{self.keyword}/key_topics/key_topics.html'
-        self.func_save_html(save_chart_path, h.htmlcontent)
+        series = [{'data': df.weight_normalized.values.tolist(),
+                   'type': 'bar', 'name': 'Retweets count',
+                   'color': '#1998CB'}]
+        return {'options': options, 'series': series}
 
-    def visualize_most_mentioned_users(self):
-        df_path = f'{os.path.expanduser(self.save_path)}/{self.keyword}/' \
-                  f'most_mentioned_users/most_mentioned_users.csv'
-        df = pd.read_csv(df_path)
+    def chart_most_mentioned_users(self):
+        df = self._load_df('most_mentioned_users')
         top_mentions = 20
         df = df.head(top_mentions)
 
@@ -141,23 +254,13 @@ class Visualize(object):
             'chart': {'backgroundColor': 'white'}
         }
 
-        # Create chart
-        h = Highchart(width=1000, height=700)
-        h.set_dict_options(options)
-        h.add_data_set(df.mentions_count.values.tolist(), 'bar',
-                       'Mentions count', color='#1998CB')
+        series = [{'data': df.mentions_count.values.tolist(),
+                   'type': 'bar', 'name': 'Mentions count',
+                   'color': '#1998CB'}]
+        return {'options': options, 'series': series}
 
-        # Save chart
-        save_chart_path = f'{os.path.expanduser(self.save_path)}' \
-                          f'/{self.keyword}/most_mentioned_users/' \
-                          f'most_mentioned_users.html'
-        self.func_save_html(save_chart_path, h.htmlcontent)
-
-    def visualize_most_mentioned_hashtags(self):
-        df_path = f'{os.path.expanduser(self.save_path)}/{self.keyword}/' \
-                  f'most_mentioned_hashtags/' \
-                  f'most_mentioned_hashtags.csv'
-        df = pd.read_csv(df_path)
+    def chart_most_mentioned_hashtags(self):
+        df = self._load_df('most_mentioned_hashtags')
         top_hashtags = 20
         df = df.head(top_hashtags)
 
@@ -185,23 +288,13 @@ class Visualize(object):
             'chart': {'backgroundColor': 'white'}
         }
 
-        # Create chart
-        h = Highchart(width=1000, height=700)
-        h.set_dict_options(options)
-        h.add_data_set(df.hashtags_count.values.tolist(), 'bar',
-                       'Mentions count', color='#1998CB')
-
-        # Save chart
-        save_chart_path = f'{os.path.expanduser(self.save_path)}/' \
-                          f'{self.keyword}/most_mentioned_hashtags/' \
-                          f'most_mentioned_hashtags.html'
-        self.func_save_html(save_chart_path, h.htmlcontent)
+        series = [{'data': df.hashtags_count.values.tolist(),
+                   'type': 'bar', 'name': 'Mentions count',
+                   'color': '#1998CB'}]
+        return {'options': options, 'series': series}
 
-    def visualize_most_active_users(self):
-        df_path = f'{os.path.expanduser(self.save_path)}/{self.keyword}/' \
-                  f'most_active_users/' \
-                  f'most_active_users.csv'
-        df = pd.read_csv(df_path)
+    def chart_most_active_users(self):
+        df = self._load_df('most_active_users')
         top_users = 20
         df = df.head(top_users)
 
@@ -229,26 +322,16 @@ class Visualize(object):
             'chart': {'backgroundColor': 'white'}
         }
 
-        # Create chart
-        h = Highchart(width=1000, height=700)
-        h.set_dict_options(options)
-        h.add_data_set(df.tweets_published.values.tolist(), 'bar',
-                       'Mentions count', color='#1998CB')
-
-        # Save chart
-        save_chart_path = f'{os.path.expanduser(self.save_path)}/' \
-                          f'{self.keyword}/most_active_users/' \
-                          f'most_active_users.html'
-        self.func_save_html(save_chart_path, h.htmlcontent)
+        series = [{'data': df.tweets_published.values.tolist(),
+                   'type': 'bar', 'name': 'Mentions count',
+                   'color': '#1998CB'}]
+        return {'options': options, 'series': series}
 
-    def visualize_most_retweeted_users(self):
+    def chart_most_retweeted_users(self):
         try:
-            df_path = f'{os.path.expanduser(self.save_path)}/' \
-                      f'{self.keyword}/most_retweeted_users/' \
-                      f'most_retweeted_users.csv'
-            df = pd.read_csv(df_path)
+            df = self._load_df('most_retweeted_users')
         except FileNotFoundError:
-            return
+            return None
         top_users = 20
         df = df.head(top_users)
 
@@ -277,23 +360,13 @@ class Visualize(object):
             'chart': {'backgroundColor': 'white'}
         }
 
-        # Create chart
-        h = Highchart(width=1000, height=700)
-        h.set_dict_options(options)
-        h.add_data_set(df.count_retweets.values.tolist(), 'bar',
-                       'Mentions count', color='#1998CB')
-
-        # Save chart
-        save_chart_path = f'{os.path.expanduser(self.save_path)}/' \
-                          f'{self.keyword}/most_retweeted_users/' \
-                          f'most_retweeted_users.html'
-        self.func_save_html(save_chart_path, h.htmlcontent)
+        series = [{'data': df.count_retweets.values.tolist(),
+                   'type': 'bar', 'name': 'Mentions count',
+                   'color': '#1998CB'}]
+        return {'options': options, 'series': series}
 
-    def visualize_users_by_followers(self):
-        df_path = f'{os.path.expanduser(self.save_path)}/' \
-                  f'{self.keyword}/users_by_followers/' \
-                  f'users_by_followers.csv'
-        df = pd.read_csv(df_path)
+    def chart_users_by_followers(self):
+        df = self._load_df('users_by_followers')
         top_users = 20
         df = df.head(top_users)
 
@@ -321,14 +394,81 @@ class Visualize(object):
             'chart': {'backgroundColor': 'white'}
         }
 
-        # Create chart
-        h = Highchart(width=1000, height=700)
-        h.set_dict_options(options)
-        h.add_data_set(df.count_followers.values.tolist(), 'bar',
-                       'Mentions count', color='#1998CB')
+        series = [{'data': df.count_followers.values.tolist(),
+                   'type': 'bar', 'name': 'Mentions count',
+                   'color': '#1998CB'}]
+        return {'options': options, 'series': series}
 
-        # Save chart
-        save_chart_path = f'{os.path.expanduser(self.save_path)}/' \
-                          f'{self.keyword}/users_by_followers/' \
-                          f'users_by_followers.html'
-        self.func_save_html(save_chart_path, h.htmlcontent)
+    def chart_interaction_graph(self):
+        try:
+            df = self._load_df('interaction_graph')
+        except FileNotFoundError:
+            return None
+        top_users = 20
+        df = df.head(top_users)
+
+        options = {
+            'title': {'text': f'Top {top_users} of the most central users '
+                              f'by PageRank of mentions, replies, and '
+                              f'retweets for {self.keyword}',
+                      'style': {'fontSize': '20'}
+                      },
+            'xAxis': {'categories': df.user.values.tolist(),
+                      'labels': {'style': {'fontSize': '13px'}
+                                 },
+                      'title': {'text': 'User',
+                                'style': {'fontSize': '15'}
+                                }
+                      },
+            'yAxis': {'title': {'text': 'PageRank',
+                                'style': {'fontSize': '15'}
+                                },
+                      'labels': {'style': {'fontSize': '15px'},
+                                 'format': '{value:.4f}'}
+                      },
+            'plotOptions': {'series': {'showInLegend': False}
+                            },
+            'chart': {'backgroundColor': 'white'}
+        }
+
+        series = [{'data': df.pagerank.round(6).values.tolist(),
+                   'type': 'bar', 'name': 'PageRank',
+                   'color': '#1998CB'}]
+        return {'options': options, 'series': series}
+
+    @instrumented
+    def visualize_grouped_date(self):
+        chart = self.chart_grouped_date()
+        self._save_drilldown(chart, 'grouped_date')
+        self._save_chart(chart, 'grouped_date')
+
+    @instrumented
+    def visualize_key_topics(self):
+        self._save_chart(self.chart_key_topics(), 'key_topics')
+
+    @instrumented
+    def visualize_most_mentioned_users(self):
+        self._save_chart(self.chart_most_mentioned_users(),
+                         'most_mentioned_users')
+
+    @instrumented
+    def visualize_most_mentioned_hashtags(self):
+        self._save_chart(self.chart_most_mentioned_hashtags(),
+                         'most_mentioned_hashtags')
+
+    @instrumented
+    def visualize_most_active_users(self):
+        self._save_chart(self.chart_most_active_users(), 'most_active_users')
+
+    @instrumented
+    def visualize_most_retweeted_users(self):
+        self._save_chart(self.chart_most_retweeted_users(),
+                         'most_retweeted_users')
+
+    @instrumented
+    def visualize_users_by_followers(self):
+        self._save_chart(self.chart_users_by_followers(), 'users_by_followers')
+
+    @instrumented
+    def visualize_interaction_graph(self):
+        self._save_chart(self.chart_interaction_graph(), 'interaction_graph')
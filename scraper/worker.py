@@ -0,0 +1,335 @@
+import datetime
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from scraper.instrument import INSTRUMENT
+
+
+class JobQueue(object):
+    """
+    Queue of jobs saved in a SQLite file, so jobs can be submitted by other
+    processes while a worker is running and their status survives restarts.
+    Each job is one command of main.py for one keyword.
+
+    A running job keeps the host and process id of the worker that claimed
+    it, and a heartbeat that the worker renews while the job runs, so only
+    the jobs of workers that died are run again, not those of other workers
+    sharing the queue. The heartbeats of workers on different hosts are
+    compared with the clock of each host, so their clocks must be in sync.
+
+    Jobs of the same keyword write the same files, so a job is not claimed
+    while another job of its keyword is running.
+    Args:
+        - save_path (str): Path where data is saved. The queue is saved in
+            <save_path>/.queue/jobs.sqlite
+        - lease (float): Seconds after the last heartbeat of a running job
+            when it is considered abandoned
+    """
+    columns = ['id', 'command', 'args', 'status', 'submitted_at',
+               'started_at', 'finished_at', 'result', 'error', 'owner',
+               'heartbeat_at', 'keyword']
+
+    def __init__(self, save_path='data', lease=120):
+        folder = f'{os.path.expanduser(save_path)}/.queue'
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.queue_path = f'{folder}/jobs.sqlite'
+        self.lease = float(lease)
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+
+        # Transactions are opened explicitly, so a job can't be claimed by
+        # two workers reading the queue at the same time
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.queue_path, isolation_level=None,
+                                     check_same_thread=False, timeout=30)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS jobs '
+                           '(id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                           'command TEXT, args TEXT, status TEXT, '
+                           'submitted_at TEXT, started_at TEXT, '
+                           'finished_at TEXT, result TEXT, error TEXT, '
+                           'owner TEXT, heartbeat_at REAL, keyword TEXT)')
+        # Queues created before the jobs had an owner or a keyword column
+        existing = [row[1] for row in
+                    self._conn.execute('PRAGMA table_info(jobs)')]
+        for column, kind in [('owner', 'TEXT'), ('heartbeat_at', 'REAL'),
+                             ('keyword', 'TEXT')]:
+            if column not in existing:
+                self._conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} '
+                                   f'{kind}')
+        if 'keyword' not in existing:
+            for job_id, args in self._conn.execute(
+                    'SELECT id, args FROM jobs').fetchall():
+                self._conn.execute(
+                    'UPDATE jobs SET keyword = ? WHERE id = ?',
+                    (json.loads(args).get('keyword'), job_id))
+        self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_status '
+                           'ON jobs (status, id)')
+
+    @staticmethod
+    def _now():
+        return datetime.datetime.now().isoformat()
+
+    def _to_dict(self, row):
+        job = dict(zip(self.columns, row))
+        job['args'] = json.loads(job['args'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def submit(self, args, command='all'):
+        """
+        Adds a job at the end of the queue.
+        Args:
+            - args (dict): Arguments of the job, e.g. keyword, keyword_type,
+                start, and end. They override the arguments of the worker.
+            - command (str): 'scrape', 'transform', 'visualize', 'refresh',
+                or 'all'
+        Returns:
+            - job_id (int): Id of the job
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                'INSERT INTO jobs (command, args, status, submitted_at, '
+                'keyword) VALUES (?, ?, ?, ?, ?)',
+                (command, json.dumps(args), 'pending', self._now(),
+                 args.get('keyword')))
+            return cursor.lastrowid
+
+    def claim(self):
+        """
+        Marks the oldest pending job as running, skipping the jobs of
+        keywords that already have a job running.
+        Returns:
+            - job (dict): The job claimed, or None if there are no pending
+                jobs that can run
+        """
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute(
+                    f"SELECT {', '.join(self.columns)} FROM jobs "
+                    f"WHERE status = 'pending' AND (keyword IS NULL OR "
+                    f"keyword NOT IN (SELECT keyword FROM jobs "
+                    f"WHERE status = 'running' AND keyword IS NOT NULL)) "
+                    f"ORDER BY id LIMIT 1").fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'running', started_at = ?, "
+                        "owner = ?, heartbeat_at = ? WHERE id = ?",
+                        (self._now(), self.owner, time.time(), row[0]))
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        if row is None:
+            return None
+        job = self._to_dict(row)
+        job.update(status='running', owner=self.owner)
+        return job
+
+    def finish(self, job_id, status, result=None, error=None):
+        # A job requeued after its lease expired may be run by another
+        # worker, which then owns its result
+        with self._lock:
+            self._conn.execute(
+                'UPDATE jobs SET status = ?, finished_at = ?, result = ?, '
+                'error = ? WHERE id = ? AND owner = ?',
+                (status, self._now(), json.dumps(result, default=str),
+                 error, job_id, self.owner))
+
+    def heartbeat(self, job_ids):
+        """
+        Renews the lease of running jobs claimed by this queue.
+        """
+        job_ids = [int(job_id) for job_id in job_ids]
+        if not job_ids:
+            return
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE jobs SET heartbeat_at = ? WHERE status = 'running' "
+                f"AND owner = ? AND id IN ({', '.join('?' * len(job_ids))})",
+                [time.time(), self.owner] + job_ids)
+
+    @staticmethod
+    def _is_alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            # The process exists but belongs to another user
+            return True
+        return True
+
+    def _is_abandoned(self, owner, heartbeat_at, now):
+        if owner is None or heartbeat_at is None or \
+                heartbeat_at < now - self.lease:
+            return True
+        # The process of a worker on the same host can be checked without
+        # waiting for its lease to expire
+        host, _, pid = owner.rpartition(':')
+        return host == socket.gethostname() and owner != self.owner and \
+            pid.isdigit() and not self._is_alive(int(pid))
+
+    def requeue_abandoned(self):
+        """
+        Marks the jobs left running by a worker that stopped unexpectedly as
+        pending again: those whose worker process is not alive anymore, or
+        whose lease expired. The jobs of other live workers are kept.
+        Returns:
+            - count (int): Number of jobs requeued
+        """
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                now = time.time()
+                abandoned = [
+                    job_id for job_id, owner, heartbeat_at in
+                    self._conn.execute(
+                        "SELECT id, owner, heartbeat_at FROM jobs "
+                        "WHERE status = 'running'")
+                    if self._is_abandoned(owner, heartbeat_at, now)]
+                for job_id in abandoned:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'pending', "
+                        "started_at = NULL, owner = NULL, "
+                        "heartbeat_at = NULL WHERE id = ?", (job_id,))
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return len(abandoned)
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(self.columns)} FROM jobs WHERE id = ?",
+                (int(job_id),)).fetchone()
+        return self._to_dict(row) if row is not None else None
+
+    def jobs(self, status=None):
+        """
+        Returns the jobs of the queue, optionally only those with a status:
+        'pending', 'running', 'done', or 'failed'.
+        """
+        query = f"SELECT {', '.join(self.columns)} FROM jobs"
+        params = ()
+        if status is not None:
+            query += ' WHERE status = ?'
+            params = (status,)
+        with self._lock:
+            rows = self._conn.execute(f'{query} ORDER BY id',
+                                      params).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class Worker(object):
+    """
+    Long running process that takes jobs from a JobQueue. The scraping,
+    transformation, and visualization modules are imported once, the NLTK
+    stopwords are loaded once, and the API client, Chrome sessions, and
+    hydrated tweets are shared by every job, so each job only pays for its
+    own work.
+    Args:
+        - args (dict): Command line arguments used by every job, unless the
+            job overrides them
+        - queue (JobQueue): Queue of jobs
+        - execute (class): Class that runs a job, called with the arguments
+            and shared resources of the job, e.g. main.Execute
+        - shared (dict): Resources shared by the jobs: 'api',
+            'driver_pool', and 'hydration_cache'
+        - concurrency (int): Maximum number of jobs running at the same time
+        - poll_interval (float): Seconds to wait when the queue is empty
+    """
+    def __init__(self, args, queue, execute, shared=None, concurrency=2,
+                 poll_interval=1):
+        self.args = args
+        self.queue = queue
+        self.execute = execute
+        self.shared = shared if shared is not None else {}
+        self.concurrency = int(concurrency)
+        self.poll_interval = float(poll_interval)
+        self.report_path = f"{os.path.dirname(queue.queue_path)}/" \
+                           f"worker_report.json"
+        self._stop = threading.Event()
+
+    @staticmethod
+    def warm():
+        # Import every stage and load the stopwords before the first job
+        import scraper.scrape
+        import scraper.visualize
+        import scraper.dashboard
+        import scraper.refresh
+        from scraper.transform import _words_ignore
+        _words_ignore()
+
+    def stop(self):
+        """
+        Stops taking jobs. The jobs already running are finished.
+        """
+        self._stop.set()
+
+    def _run_job(self, job):
+        args = dict(self.args)
+        args.update(job['args'])
+        try:
+            result = self.execute(args=args, shared=self.shared)\
+                .run(job['command'])
+        except Exception as error:
+            self.queue.finish(job['id'], 'failed', error=repr(error))
+            return
+        self.queue.finish(job['id'], 'done', result=result)
+
+    def serve(self, until_empty=False):
+        """
+        Runs jobs until stop is called or, with until_empty, until the queue
+        has no pending jobs. The leases of the running jobs are renewed
+        until they finish, also after stop is called.
+        """
+        self.warm()
+        running = {}
+        checked_at = None
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                while running or not self._stop.is_set():
+                    running = {future: job_id for future, job_id in
+                               running.items() if not future.done()}
+                    # Renew the lease of the jobs running in this worker,
+                    # and take back the jobs of workers that died
+                    if checked_at is None or time.monotonic() - checked_at \
+                            >= self.queue.lease / 4:
+                        self.queue.heartbeat(running.values())
+                        self.queue.requeue_abandoned()
+                        checked_at = time.monotonic()
+                    job = None
+                    if not self._stop.is_set() and \
+                            len(running) < self.concurrency:
+                        job = self.queue.claim()
+                    if job is not None:
+                        running[executor.submit(self._run_job, job)] = \
+                            job['id']
+                        continue
+
+                    # Save the report of the jobs finished while idle, so
+                    # the records of a long running worker don't pile up
+                    if not running and INSTRUMENT.records:
+                        INSTRUMENT.write_report(self.report_path)
+                        INSTRUMENT.reset(INSTRUMENT.trace_memory)
+                    if until_empty and not running:
+                        break
+                    if self._stop.is_set():
+                        wait(running, timeout=self.poll_interval,
+                             return_when=FIRST_COMPLETED)
+                    else:
+                        self._stop.wait(self.poll_interval)
+        except KeyboardInterrupt:
+            self.stop()
+        if INSTRUMENT.records:
+            INSTRUMENT.write_report(self.report_path)
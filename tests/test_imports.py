@@ -0,0 +1,87 @@
+import ast
+import os
+import subprocess
+import sys
+import pytest
+import main
+from conftest import ROOT
+
+
+# Packages that only the commands talking to Twitter may load
+SCRAPING_PACKAGES = ['selenium', 'tweepy']
+
+
+def imported_modules(command):
+    # Modules of the package imported inside the methods of Execute that the
+    # command runs, following the calls to other methods of Execute
+    with open(os.path.join(ROOT, 'main.py'), 'r') as file:
+        tree = ast.parse(file.read())
+    execute = next(node for node in tree.body
+                   if isinstance(node, ast.ClassDef) and
+                   node.name == 'Execute')
+    methods = {node.name: node for node in execute.body
+               if isinstance(node, ast.FunctionDef)}
+
+    def imports(name, seen):
+        seen.add(name)
+        modules = set()
+        for node in ast.walk(methods[name]):
+            if isinstance(node, ast.ImportFrom) and node.module and \
+                    node.module.startswith('scraper.'):
+                modules.add(node.module)
+            elif isinstance(node, ast.Import):
+                modules.update(alias.name for alias in node.names
+                               if alias.name.startswith('scraper.'))
+            elif isinstance(node, ast.Attribute) and \
+                    isinstance(node.value, ast.Name) and \
+                    node.value.id == 'self' and node.attr in methods and \
+                    node.attr not in seen:
+                modules.update(imports(node.attr, seen))
+        return modules
+
+    return sorted(imports(main.COMMANDS[command], set()))
+
+
+def loaded_packages(modules):
+    # Import the modules in a new interpreter with python -X importtime, so
+    # the modules imported by other tests don't count. Lines look like
+    # 'import time: self | cumulative | name', with nested imports indented.
+    code = '; '.join(['import main'] +
+                     [f'import {module}' for module in modules])
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            cwd=ROOT, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, check=True).stderr
+    packages = set()
+    for line in output.decode().splitlines():
+        parts = line.split('|')
+        if line.startswith('import time:') and len(parts) == 3:
+            packages.add(parts[2].strip().split('.')[0])
+    assert 'main' in packages
+    return [package for package in SCRAPING_PACKAGES if package in packages]
+
+
+@pytest.mark.parametrize('command', list(main.COMMANDS))
+def test_command_modules_match_imports(command):
+    assert main.COMMAND_MODULES[command] == imported_modules(command)
+
+
+def test_every_command_has_modules():
+    modules = main.COMMAND_MODULES
+    assert set(modules) == set(main.COMMANDS)
+    assert set(modules['all']) >= set(modules['scrape'] +
+                                      modules['transform'] +
+                                      modules['visualize'])
+
+
+def test_main_does_not_load_scraping_packages():
+    assert loaded_packages([]) == []
+
+
+@pytest.mark.parametrize('command', ['transform', 'visualize'])
+def test_command_does_not_load_scraping_packages(command):
+    assert loaded_packages(main.COMMAND_MODULES[command]) == []
+
+
+def test_refresh_does_not_load_selenium():
+    # Refresh calls the API with tweepy, but doesn't open a browser
+    assert 'selenium' not in loaded_packages(main.COMMAND_MODULES['refresh'])
@@ -0,0 +1,35 @@
+import os
+import sqlite3
+import pandas as pd
+from scraper.index import IdIndex
+
+
+def save_raw_data(save_path, keyword, ids):
+    folder = save_path / keyword / '.raw_data'
+    os.makedirs(folder)
+    pd.DataFrame({'id_str': ids}).to_csv(folder / 'df_raw.csv', index=False)
+
+
+def test_global_index_skips_files_and_hidden_folders(tmp_path):
+    save_raw_data(tmp_path, 'a', ['1', '2'])
+    save_raw_data(tmp_path, '_comparison', ['3'])
+    (tmp_path / 'batch_status.json').write_text('{}')
+
+    index = IdIndex(str(tmp_path))
+    assert len(index) == 2
+    assert index.keywords_of(['1', '2', '3']) == {'1': 'a', '2': 'a'}
+
+
+def test_seeding_is_retried_until_it_finishes(tmp_path):
+    save_raw_data(tmp_path, 'a', ['1', '2'])
+    IdIndex(str(tmp_path)).close()
+
+    # An index whose seeding was interrupted has ids but no record of it
+    connection = sqlite3.connect(str(tmp_path / '.global_index' /
+                                     'ids.sqlite'))
+    connection.execute("DELETE FROM meta")
+    connection.execute("DELETE FROM ids WHERE id = '2'")
+    connection.commit()
+    connection.close()
+
+    assert '2' in IdIndex(str(tmp_path))
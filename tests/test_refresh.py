@@ -0,0 +1,108 @@
+import os
+import pandas as pd
+import pytest
+from scraper.refresh import EngagementRefresh
+
+
+NOW = pd.Timestamp('2020-01-10 12:00', tz='UTC')
+
+
+class Status(object):
+    def __init__(self, tweet_id, retweet_count, favorite_count):
+        self._json = {'id_str': tweet_id, 'retweet_count': retweet_count,
+                      'favorite_count': favorite_count}
+
+
+class FakeAPI(object):
+    """
+    Returns the counts of each id, and remembers the ids requested.
+    """
+    def __init__(self, counts):
+        self.counts = counts
+        self.requested = []
+
+    def statuses_lookup(self, ids, tweet_mode=None):
+        self.requested += list(ids)
+        return [Status(tweet_id, *self.counts[tweet_id]) for tweet_id in ids
+                if tweet_id in self.counts]
+
+
+@pytest.fixture
+def keyword_path(tmp_path):
+    folder = tmp_path / 'kw'
+    for name in ['.raw_data', 'clean_data', 'grouped_date', 'rankings']:
+        os.makedirs(folder / name)
+    # Tweet 1 is saved twice, tweet 3 was never refreshed
+    clean = pd.DataFrame({
+        'id': ['1', '2', '1', '3'],
+        'ts': ['2020-01-08 12:00:00+00:00', '2020-01-09 12:00:00+00:00',
+               '2020-01-08 12:00:00+00:00', '2020-01-09 12:00:00+00:00'],
+        'date': ['2020-01-08', '2020-01-09', '2020-01-08', '2020-01-09'],
+        'retweet_count': [10, 5, 10, 0],
+        'favorite_count': [20, 5, 20, 0],
+        'user_followers_count': [100, 10, 100, 1]})
+    clean.to_csv(folder / 'clean_data' / 'df_clean.csv', index=False)
+    clean.rename(columns={'id': 'id_str'})\
+        .to_csv(folder / '.raw_data' / 'df_raw.csv', index=False)
+    pd.DataFrame({'date': ['2020-01-08', '2020-01-09'],
+                  'retweet_count': [20, 5], 'favorite_count': [40, 5],
+                  'tweets_published': [2, 2]})\
+        .to_csv(folder / 'grouped_date' / 'grouped_date.csv', index=False)
+    pd.DataFrame({'metric': ['retweets'], 'rank': [1], 'id': ['1'],
+                  'score': [10.0]})\
+        .to_csv(folder / 'rankings' / 'rankings.csv', index=False)
+    # Tweet 2 was refreshed twice
+    pd.DataFrame({'id': ['2', '2'],
+                  'refreshed_at': ['2020-01-09 18:00:00+00:00',
+                                   '2020-01-10 00:00:00+00:00'],
+                  'engagement_rate': [1.0, 2.0]})\
+        .to_csv(folder / '.raw_data' / 'refresh_state.csv', index=False)
+    return folder
+
+
+def test_refresh_with_duplicate_ids(keyword_path):
+    api = FakeAPI({'1': (12, 20), '2': (5, 5), '3': (3, 3)})
+    refresh = EngagementRefresh('kw', api,
+                                save_path=str(keyword_path.parent),
+                                min_interval=1, top_k=2)
+    summary = refresh.refresh(now=NOW)
+
+    # Each tweet is requested once, and only tweets 1 and 3 changed
+    assert sorted(api.requested) == ['1', '2', '3']
+    assert summary == {'requested': 3, 'refreshed': 3, 'changed': 2,
+                       'api_calls': 1}
+
+    # Every row of a tweet saved twice is updated
+    clean = pd.read_csv(keyword_path / 'clean_data' / 'df_clean.csv',
+                        dtype={'id': str})
+    assert clean.retweet_count.tolist() == [12, 5, 12, 3]
+    assert clean.favorite_count.tolist() == [20, 5, 20, 3]
+
+    state = pd.read_csv(keyword_path / '.raw_data' / 'refresh_state.csv',
+                        dtype={'id': str}).set_index('id')
+    assert sorted(state.index) == ['1', '2', '3']
+    # Tweets refreshed for the first time gained their engagement since
+    # they were published: 2 retweets in 2 days for tweet 1, and 6 in 1 day
+    # for tweet 3
+    assert state.loc['1', 'engagement_rate'] == pytest.approx(1.0)
+    assert state.loc['3', 'engagement_rate'] == pytest.approx(6.0)
+    # Tweet 2 didn't change since it was last seen
+    assert state.loc['2', 'engagement_rate'] == pytest.approx(0.0)
+
+    # The rankings keep top_k tweets, not as many as the previous file
+    rankings = pd.read_csv(keyword_path / 'rankings' / 'rankings.csv',
+                           dtype={'id': str})
+    assert rankings.groupby('metric').size().tolist() == [2, 2, 2]
+    assert rankings[rankings.metric == 'retweets'].id.tolist() == ['1', '2']
+
+
+def test_refresh_skips_recent_tweets(keyword_path):
+    api = FakeAPI({'1': (10, 20), '3': (0, 0)})
+    refresh = EngagementRefresh('kw', api,
+                                save_path=str(keyword_path.parent),
+                                min_interval=24)
+    summary = refresh.refresh(now=NOW)
+
+    # Tweet 2 was refreshed 12 hours ago
+    assert sorted(api.requested) == ['1', '3']
+    assert summary['changed'] == 0
@@ -0,0 +1,25 @@
+from scraper.worker import JobQueue
+
+
+def test_claim_skips_keywords_with_a_running_job(tmp_path):
+    queue = JobQueue(str(tmp_path))
+    first = queue.submit({'keyword': 'a'}, command='scrape')
+    second = queue.submit({'keyword': 'a'}, command='transform')
+    other = queue.submit({'keyword': 'b'}, command='all')
+
+    assert queue.claim()['id'] == first
+    # The second job of keyword a waits for the first one
+    assert queue.claim()['id'] == other
+    assert queue.claim() is None
+
+    queue.finish(first, 'done')
+    assert queue.claim()['id'] == second
+
+
+def test_claim_runs_jobs_without_keyword(tmp_path):
+    queue = JobQueue(str(tmp_path))
+    queue.submit({'keyword': 'a'})
+    queue.submit({})
+    queue.submit({})
+
+    assert [queue.claim()['keyword'] for _ in range(3)] == ['a', None, None]